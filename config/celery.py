@@ -24,6 +24,10 @@ app.conf.beat_schedule = {
         ),
         # "args": (True, False),
     },
+    "refresh_stored_quota_status": {
+        "task": "adminsec.tasks.refresh_stored_quota_status",
+        "schedule": crontab(minute=settings.CRON_REFRESH_QUOTA_STATUS_MINUTE),
+    },
     "send_quota_email_yellow": {
         "task": "adminsec.tasks.send_quota_email_yellow",
         "schedule": crontab(
@@ -44,7 +48,28 @@ app.conf.beat_schedule = {
             hour=settings.CRON_DISABLE_USERS_HOUR, minute=settings.CRON_DISABLE_USERS_MINUTE
         ),
     },
+    "compact_usage_history": {
+        "task": "adminsec.tasks.compact_usage_history",
+        "schedule": crontab(
+            hour=settings.CRON_COMPACT_USAGE_HISTORY_HOUR,
+            minute=settings.CRON_COMPACT_USAGE_HISTORY_MINUTE,
+        ),
+    },
+    "deliver_email_outbox": {
+        "task": "adminsec.tasks.deliver_email_outbox",
+        "schedule": crontab(minute=settings.CRON_DELIVER_EMAIL_OUTBOX_MINUTE),
+    },
 }
+
+if settings.VERSION_HISTORY_COMPACTION:
+    app.conf.beat_schedule["compact_version_history"] = {
+        "task": "adminsec.tasks.compact_version_history",
+        "schedule": crontab(
+            hour=settings.CRON_COMPACT_VERSION_HISTORY_HOUR,
+            minute=settings.CRON_COMPACT_VERSION_HISTORY_MINUTE,
+        ),
+    }
+
 app.conf.timezone = "UTC"
 
 # Load task modules from all registered Django apps.
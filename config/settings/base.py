@@ -148,6 +148,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "impersonate.middleware.ImpersonateMiddleware",
     "allauth.account.middleware.AccountMiddleware",
+    "hpc_access.utils.predicate_cache.PredicateCacheMiddleware",
 ]
 
 # STATIC
@@ -314,6 +315,13 @@ ENABLE_LDAP_SECONDARY = env.bool("ENABLE_LDAP_SECONDARY", False)
 # Alternative domains for detecting LDAP access by email address
 LDAP_ALT_DOMAINS = env.list("LDAP_ALT_DOMAINS", None, [])
 
+# Caching of LDAP lookups by email and username (seconds; not found users use the shorter one)
+LDAP_CACHE_ALIAS = env.str("LDAP_CACHE_ALIAS", "default")
+LDAP_CACHE_TIMEOUT = env.int("LDAP_CACHE_TIMEOUT", 300)
+LDAP_CACHE_NEGATIVE_TIMEOUT = env.int("LDAP_CACHE_NEGATIVE_TIMEOUT", 60)
+# Count cache hits and misses, costs two extra cache round trips per lookup
+LDAP_CACHE_STATS = env.bool("LDAP_CACHE_STATS", False)
+
 if ENABLE_LDAP:
     import itertools
 
@@ -411,14 +419,47 @@ SEND_EMAIL = env.bool("SEND_EMAIL", False)
 EMAIL_HOST = env.str("EMAIL_HOST", "localhost")
 EMAIL_PORT = env.int("EMAIL_PORT", 25)
 EMAIL_SENDER = env.str("EMAIL_SENDER", "root@admin")
+# Bulk sending, messages per connection, sending threads and messages per second (0: no limit)
+EMAIL_BATCH_SIZE = env.int("EMAIL_BATCH_SIZE", 100)
+EMAIL_WORKERS = env.int("EMAIL_WORKERS", 1)
+EMAIL_RATE_LIMIT = env.float("EMAIL_RATE_LIMIT", 0)
+# Opt in to store notification emails in the outbox and deliver them by a worker after the
+# commit, failed deliveries are retried with exponential backoff starting with the delay in
+# seconds. Emails claimed by a delivery are skipped by other deliveries for the lease in seconds
+EMAIL_OUTBOX = env.bool("EMAIL_OUTBOX", False)
+EMAIL_OUTBOX_MAX_ATTEMPTS = env.int("EMAIL_OUTBOX_MAX_ATTEMPTS", 5)
+EMAIL_OUTBOX_RETRY_DELAY = env.int("EMAIL_OUTBOX_RETRY_DELAY", 60)
+EMAIL_OUTBOX_LEASE = env.int("EMAIL_OUTBOX_LEASE", 600)
+EMAIL_OUTBOX_RETENTION_DAYS = env.int("EMAIL_OUTBOX_RETENTION_DAYS", 30)
 SEND_QUOTA_EMAILS = env.bool("SEND_QUOTA_EMAILS", False)
 
 # Quota settings
 QUOTA_WARNING_THRESHOLD = env.int("QUOTA_WARNING_THRESHOLD", 90)
 QUOTA_WARNING_ABSOLUTE = env.int("QUOTA_WARNING_ABSOLUTE", 5)
+QUOTA_REPORT_CACHE_TIMEOUT = env.int("QUOTA_REPORT_CACHE_TIMEOUT", 86400)
+
+# Usage history settings, days until raw samples are downsampled to hourly and hourly to
+# daily averages
+USAGE_HISTORY_RAW_DAYS = env.int("USAGE_HISTORY_RAW_DAYS", 7)
+USAGE_HISTORY_HOURLY_DAYS = env.int("USAGE_HISTORY_HOURLY_DAYS", 90)
+
+# Handling of changes limited to the used resources by the versioned saves, one of
+# "version" (new version object), "coalesce" (update latest version object) or "skip"
+VERSION_USAGE_POLICY = env.str("VERSION_USAGE_POLICY", "coalesce")
+
+# Days until versions that only repeat their successor are removed from the version history
+VERSION_HISTORY_RETENTION_DAYS = env.int("VERSION_HISTORY_RETENTION_DAYS", 90)
+
+# Schedule the nightly compaction of the version history, otherwise it is only run by the
+# compact_version_history management command
+VERSION_HISTORY_COMPACTION = env.bool("VERSION_HISTORY_COMPACTION", False)
 
 # Consenst settings
 CONSENT_GRACE_PERIOD = env.int("CONSENT_GRACE_PERIOD", 30)
+# Number of users notified per task after publishing the terms and conditions
+CONSENT_NOTIFICATION_CHUNK_SIZE = env.int("CONSENT_NOTIFICATION_CHUNK_SIZE", 100)
+# Seconds a chunk of users is claimed by the task notifying them, renewed after every batch
+CONSENT_NOTIFICATION_LEASE = env.int("CONSENT_NOTIFICATION_LEASE", 600)
 
 # View mode - disable all request options
 VIEW_MODE = env.bool("VIEW_MODE", False)
@@ -427,6 +468,9 @@ VIEW_MODE = env.bool("VIEW_MODE", False)
 STAGING = env.bool("STAGING", False)
 
 # Cron settings
+# Hourly check whether the quota warning thresholds changed and the stored status needs a refresh
+CRON_REFRESH_QUOTA_STATUS_MINUTE = env.str("CRON_REFRESH_QUOTA_STATUS_MINUTE", "0")
+
 CRON_QUOTA_EMAIL_YELLOW_DOW = env.str("CRON_QUOTA_EMAIL_YELLOW_DOW", "1")
 CRON_QUOTA_EMAIL_YELLOW_HOUR = env.str("CRON_QUOTA_EMAIL_YELLOW_HOUR", "0")
 CRON_QUOTA_EMAIL_YELLOW_MINUTE = env.str("CRON_QUOTA_EMAIL_YELLOW_MINUTE", "20")
@@ -440,6 +484,14 @@ CRON_DISABLE_USERS_MINUTE = env.str("CRON_DISABLE_USERS_MINUTE", "15")
 CRON_SYNC_LDAP_HOUR = env.str("CRON_SYNC_LDAP_HOUR", "0")
 CRON_SYNC_LDAP_MINUTE = env.str("CRON_SYNC_LDAP_MINUTE", "5")
 
+CRON_COMPACT_USAGE_HISTORY_HOUR = env.str("CRON_COMPACT_USAGE_HISTORY_HOUR", "1")
+CRON_COMPACT_USAGE_HISTORY_MINUTE = env.str("CRON_COMPACT_USAGE_HISTORY_MINUTE", "0")
+
+CRON_COMPACT_VERSION_HISTORY_HOUR = env.str("CRON_COMPACT_VERSION_HISTORY_HOUR", "1")
+CRON_COMPACT_VERSION_HISTORY_MINUTE = env.str("CRON_COMPACT_VERSION_HISTORY_MINUTE", "30")
+
+CRON_DELIVER_EMAIL_OUTBOX_MINUTE = env.str("CRON_DELIVER_EMAIL_OUTBOX_MINUTE", "*")
+
 # Celery
 # ------------------------------------------------------------------------------
 if USE_TZ:
@@ -33,6 +33,11 @@ ENABLE_LDAP = True
 ENABLE_LDAP_SECONDARY = True
 VIEW_MODE = False
 SEND_QUOTA_EMAILS = True
+# Send notification emails right away so that they show up in the test outbox
+EMAIL_OUTBOX = False
+
+# Run celery tasks triggered by the code under test right away
+CELERY_TASK_ALWAYS_EAGER = True
 
 AUTH_LDAP_USERNAME_DOMAIN = "CHARITE"
 AUTH_LDAP2_USERNAME_DOMAIN = "MDC-BERLIN"
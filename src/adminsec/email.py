@@ -2,19 +2,27 @@
 
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib import auth
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
 
 from adminsec.constants import TIER_USER_HOME
 from usersec.models import (
     INVITATION_STATUS_ACCEPTED,
+    OUTBOX_STATUS_FAILED,
     HpcGroupInvitation,
     HpcProject,
     HpcProjectInvitation,
     HpcQuotaStatus,
     HpcUser,
+    OutboxEmail,
 )
 
 logger = logging.getLogger(__name__)
@@ -401,6 +409,223 @@ Agreeing to the updated terms and conditions is a requirement for the continued
 # ------------------------------------------------------------------------------
 
 
+def format_message(message):
+    """Return the plain text of ``message`` as written by dry runs."""
+    return f"""
+Subject: {message.subject}
+To: {",".join(message.to)}
+
+{message.body}
+""".lstrip()
+
+
+class RateLimiter:
+    """Space out calls to ``wait()`` across threads to at most ``rate`` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(self.next_slot, now) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _send_batch(messages, rate_limiter):
+    """Send ``messages`` over a single connection.
+
+    Returns the error of every message, ``None`` for the messages sent.
+    """
+    errors = []
+
+    try:
+        with get_connection(fail_silently=False) as connection:
+            for message in messages:
+                rate_limiter.wait()
+
+                try:
+                    connection.send_messages([message])
+                    errors.append(None)
+                except Exception as ex:
+                    errors.append(str(ex))
+
+    except Exception as ex:
+        # The connection failed, the remaining messages of the batch have not been sent
+        errors += [str(ex)] * (len(messages) - len(errors))
+
+    return errors
+
+
+def send_messages(messages, batch_size=None, workers=None, rate_limit=None, dry_run=False):
+    """
+    Send prepared messages in batches, each batch over a single connection.
+
+    Messages with the same subject, recipients and body are only sent once.  Batches are
+    sent by up to ``workers`` threads and ``rate_limit`` caps the number of messages sent
+    per second over all threads.  Failures do not stop the remaining messages.
+
+    :param messages: Messages to send (list of ``EmailMessage``)
+    :param batch_size: Messages sent per connection, defaults to ``EMAIL_BATCH_SIZE``
+    :param workers: Number of sending threads, defaults to ``EMAIL_WORKERS``
+    :param rate_limit: Messages per second or 0 for no limit, defaults to ``EMAIL_RATE_LIMIT``
+    :param dry_run: Only render the messages
+    :return: Summary with the number of messages sent and skipped as duplicates, the
+        failures and the rendered messages of dry runs (dict)
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    workers = workers or settings.EMAIL_WORKERS
+    rate_limit = settings.EMAIL_RATE_LIMIT if rate_limit is None else rate_limit
+    unique = {}
+
+    for message in messages:
+        unique.setdefault((message.subject, tuple(sorted(message.to)), message.body), message)
+
+    summary = {"sent": 0, "skipped": len(messages) - len(unique), "failed": [], "messages": []}
+    messages = list(unique.values())
+
+    if dry_run:
+        summary["messages"] = [format_message(message) for message in messages]
+        return summary
+
+    rate_limiter = RateLimiter(rate_limit)
+    batches = [messages[i : i + batch_size] for i in range(0, len(messages), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda batch: _send_batch(batch, rate_limiter), batches)
+
+        for batch, errors in zip(batches, results, strict=True):
+            for message, error in zip(batch, errors, strict=True):
+                if error is None:
+                    summary["sent"] += 1
+                else:
+                    summary["failed"].append(
+                        {"to": message.to, "subject": message.subject, "error": error}
+                    )
+
+    return summary
+
+
+def enqueue_message(message):
+    """Store ``message`` in the outbox and trigger its delivery once the transaction commits.
+
+    The message is discarded with the transaction if it is rolled back.  A single delivery
+    is triggered per transaction, however many messages it stores: the commit callbacks of a
+    transaction share a trigger that only the first of them fires.  If the delivery cannot
+    be triggered, the periodic outbox delivery picks it up.
+    """
+    body_html = next(
+        (
+            content
+            for content, mimetype in getattr(message, "alternatives", [])
+            if mimetype == "text/html"
+        ),
+        "",
+    )
+    OutboxEmail.objects.create(
+        from_email=message.from_email,
+        recipients=message.to,
+        subject=message.subject,
+        body=message.body,
+        body_html=body_html,
+    )
+
+    connection = transaction.get_connection()
+
+    if getattr(connection, "outbox_delivery_trigger", None) is None:
+        connection.outbox_delivery_trigger = {"fired": False}
+
+    trigger = connection.outbox_delivery_trigger
+    transaction.on_commit(lambda: _trigger_outbox_delivery(connection, trigger), robust=True)
+
+
+def _trigger_outbox_delivery(connection, trigger):
+    """Trigger the outbox delivery unless ``trigger`` already fired after the same commit.
+
+    Triggers of rolled back transactions never fire and are reused by the next transaction.
+    """
+    from adminsec.tasks import deliver_email_outbox
+
+    if trigger["fired"]:
+        return
+
+    trigger["fired"] = True
+    connection.outbox_delivery_trigger = None
+    deliver_email_outbox.delay()
+
+
+def _build_outbox_message(email):
+    messenger = EmailMultiAlternatives if email.body_html else EmailMessage
+    message = messenger(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.recipients,
+    )
+
+    if email.body_html:
+        message.attach_alternative(email.body_html, "text/html")
+
+    return message
+
+
+def deliver_outbox(batch_size=None):
+    """
+    Deliver the due outbox emails in batches, each batch over a single connection.
+
+    Each batch is claimed in a short transaction by postponing its next attempt for
+    ``EMAIL_OUTBOX_LEASE`` seconds, concurrent deliveries skip the claimed emails.  The emails
+    are sent outside of a transaction and the results are recorded in a second one.  Emails
+    of a delivery that dies while sending are picked up again once their lease expired.
+    Failed emails are retried with exponential backoff up to ``EMAIL_OUTBOX_MAX_ATTEMPTS``.
+
+    :param batch_size: Emails sent per connection, defaults to ``EMAIL_BATCH_SIZE``
+    :return: Number of emails sent, scheduled for retry and given up (dict)
+    """
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    rate_limiter = RateLimiter(settings.EMAIL_RATE_LIMIT)
+    summary = {"sent": 0, "retried": 0, "failed": 0}
+
+    while True:
+        with transaction.atomic():
+            emails = list(
+                OutboxEmail.objects.due().select_for_update(skip_locked=True)[:batch_size]
+            )
+            lease_until = timezone.now() + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+
+            for email in emails:
+                email.next_attempt = lease_until
+
+            OutboxEmail.objects.bulk_update(emails, ["next_attempt"])
+
+        if not emails:
+            return summary
+
+        errors = _send_batch([_build_outbox_message(email) for email in emails], rate_limiter)
+        now = timezone.now()
+
+        for email, error in zip(emails, errors, strict=True):
+            if error is None:
+                email.mark_sent(now)
+                summary["sent"] += 1
+            else:
+                email.mark_failed(error, now)
+                logger.error(f"Error sending email {email}: {error}")
+                summary["failed" if email.status == OUTBOX_STATUS_FAILED else "retried"] += 1
+
+        OutboxEmail.objects.bulk_update(
+            emails, ["status", "attempts", "next_attempt", "date_sent", "error"]
+        )
+
+
 def send_mail(subject, message, recipient_list, alternative=None, dry_run=False):
     """
     Wrapper for send_mail() with logging and error messaging.
@@ -430,12 +655,10 @@ def send_mail(subject, message, recipient_list, alternative=None, dry_run=False)
             m.attach_alternative(alternative, "text/html")
         if dry_run:
             # Write email message to a file instead of sending it
-            return f"""
-Subject: {subject}
-To: {",".join(recipient_list)}
-
-{message}
-""".lstrip()
+            return format_message(m)
+        elif settings.EMAIL_OUTBOX:
+            enqueue_message(m)
+            ret = 1
         else:
             ret = m.send(fail_silently=False)
         logger.debug("Notification email sent")
@@ -600,13 +823,14 @@ def send_notification_manager_request_denied(request):
     return send_mail(subject, message, [request.requester.email])
 
 
-def send_notification_storage_quota(hpc_obj, report, dry_run=False):
+def build_notification_storage_quota(hpc_obj, report):
+    """Render the quota email for ``hpc_obj``, returns ``None`` if there is no recipient."""
     if isinstance(hpc_obj, HpcUser):
         email = hpc_obj.get_user_email()
         name = hpc_obj.user.name
         if not email:
             logger.warning(f"User {name} has no valid email address: {hpc_obj.user.email}")
-            return 0
+            return None
         greeting = USER_GREETING.format(user=name)
         subject = SUBJECT_QUOTA_USER
         fragment = FRAGMENT_QUOTA_USER
@@ -616,7 +840,7 @@ def send_notification_storage_quota(hpc_obj, report, dry_run=False):
     else:
         contacts = hpc_obj.get_manager_contact(slim=True)
         greeting = USER_GREETING.format(user=", ".join([c["name"] for c in contacts.values()]))
-        emails = [c["email"] for c in contacts.values()]
+        emails = list(dict.fromkeys(c["email"] for c in contacts.values() if c["email"]))
         entity = "project" if isinstance(hpc_obj, HpcProject) else "group"
         name = hpc_obj.name if entity == "project" else f"AG {hpc_obj.name.capitalize()}"
         subject = SUBJECT_QUOTA_GROUP_PROJECT.format(entity=entity, name=name)
@@ -667,8 +891,32 @@ def send_notification_storage_quota(hpc_obj, report, dry_run=False):
         table=table_text,
         footer=FOOTER,
     )
-    logger.info(f"Sending quota email: {emails}, '{subject}'")
-    return send_mail(subject, message_text, emails, alternative=message_html, dry_run=dry_run)
+
+    if not emails:
+        logger.warning(f"No recipients for quota email of {hpc_obj}")
+        return None
+
+    message = EmailMultiAlternatives(
+        subject=subject, body=message_text, from_email=EMAIL_SENDER, to=emails
+    )
+    message.attach_alternative(message_html, "text/html")
+    return message
+
+
+def send_notification_storage_quota(hpc_obj, report, dry_run=False):
+    message = build_notification_storage_quota(hpc_obj, report)
+
+    if not message:
+        return 0
+
+    logger.info(f"Sending quota email: {message.to}, '{message.subject}'")
+    return send_mail(
+        message.subject,
+        message.body,
+        message.to,
+        alternative=message.alternatives[0][0],
+        dry_run=dry_run,
+    )
 
 
 # ------------------------------------------------------------------------------
@@ -735,11 +983,19 @@ def send_notification_user_welcome_mail(user):
     return send_mail(subject, message, [user.user.email])
 
 
-def send_notification_user_consent(user):
-    subject = SUBJECT_CONSENT
-    message = NOTIFICATION_CONSENT.format(
-        greeting=USER_GREETING.format(user=user.name),
-        hpc_access_link=HPC_ACCESS_LINK,
-        footer=FOOTER,
+def build_notification_user_consent(user):
+    return EmailMessage(
+        subject=SUBJECT_CONSENT,
+        body=NOTIFICATION_CONSENT.format(
+            greeting=USER_GREETING.format(user=user.name),
+            hpc_access_link=HPC_ACCESS_LINK,
+            footer=FOOTER,
+        ),
+        from_email=EMAIL_SENDER,
+        to=[user.email],
     )
-    return send_mail(subject, message, [user.email])
+
+
+def send_notification_user_consent(user):
+    message = build_notification_user_consent(user)
+    return send_mail(message.subject, message.body, message.to)
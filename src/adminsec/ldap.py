@@ -1,38 +1,233 @@
 import logging as _logging
 import ssl
+import threading
+from collections import defaultdict
 
 import ldap3
 from django.conf import settings
+from django.core.cache import caches
 from django.core.exceptions import ImproperlyConfigured
+from ldap3.utils.conv import escape_filter_chars
 
 logger = _logging.getLogger("ldap_connector_logger")
 
+#: Attributes fetched for a user.
+USER_INFO_ATTRIBUTES = [
+    "mail",
+    "displayName",
+    "givenName",
+    "sn",
+    "userAccountControl",
+    "telephoneNumber",
+    "uidNumber",
+    "cn",
+]
+
+#: Number of usernames combined into one OR-filter when searching for many users.
+SEARCH_CHUNK_SIZE = 200
+
+#: Page size for paged searches.
+SEARCH_PAGED_SIZE = 500
+
+
+#: Prefix of the cache keys used for caching lookups.
+CACHE_KEY_PREFIX = "adminsec.ldap"
+
+#: Kinds of cached lookups.
+CACHE_KIND_MAIL = "mail"
+CACHE_KIND_USER = "user"
+
+
+class LdapUserNotFound(Exception):
+    """Raised when a lookup did not find any user."""
+
+
+class UserInfoAttribute(list):
+    """Values of an attribute of a ``UserInfo``, mimicking ``ldap3`` attributes."""
+
+    @property
+    def value(self):
+        if len(self) == 1:
+            return self[0]
+
+        return list(self) or None
+
+    @property
+    def values(self):
+        return list(self)
+
+
+class UserInfo:
+    """Picklable user information, giving the same attribute access as an ``ldap3`` entry."""
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+
+    def __getattr__(self, name):
+        if name == "attributes":
+            raise AttributeError(name)
+
+        return self[name]
+
+    def __getitem__(self, name):
+        return UserInfoAttribute(self.attributes.get(name) or [])
+
+    def __contains__(self, name):
+        return name in self.attributes
+
+
+def _cache():
+    return caches[settings.LDAP_CACHE_ALIAS]
+
+
+def _count_cache_access(kind, result):
+    if not settings.LDAP_CACHE_STATS:
+        return
+
+    cache = _cache()
+    key = f"{CACHE_KEY_PREFIX}:stats:{kind}:{result}"
+    cache.add(key, 0, None)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Key evicted in between; counting is best effort
+        pass
+
+
+def get_cache_stats():
+    """Return the hit and miss counters of the lookup cache per kind of lookup.
+
+    The counters are only maintained with ``LDAP_CACHE_STATS`` enabled.
+    """
+
+    cache = _cache()
+    return {
+        kind: {
+            result: cache.get(f"{CACHE_KEY_PREFIX}:stats:{kind}:{result}", 0)
+            for result in ("hits", "misses")
+        }
+        for kind in (CACHE_KIND_MAIL, CACHE_KIND_USER)
+    }
+
+
+def reset_cache_stats():
+    """Reset the hit and miss counters of the lookup cache."""
+
+    _cache().delete_many(
+        [
+            f"{CACHE_KEY_PREFIX}:stats:{kind}:{result}"
+            for kind in (CACHE_KIND_MAIL, CACHE_KIND_USER)
+            for result in ("hits", "misses")
+        ]
+    )
+
+
+#: Bound connections of pooled connectors, kept per thread and keyed by server and bind DN.
+_connection_pool = threading.local()
+
+
+def _get_pooled_connections():
+    if not hasattr(_connection_pool, "connections"):
+        _connection_pool.connections = {}
+
+    return _connection_pool.connections
+
+
+def reset_connection_pool():
+    """Unbind and drop the pooled connections of the current thread."""
+
+    connections = _get_pooled_connections()
+
+    for connection in connections.values():
+        try:
+            connection.unbind()
+        except Exception as e:
+            logger.debug("Error unbinding pooled connection: %s", e)
+
+    connections.clear()
+
 
 class LdapConnector:
-    """Connect to the two LDAPs and provide some search functions."""
+    """Connect to the two LDAPs and provide some search functions.
+
+    With ``pooled=True``, bound connections are kept per thread and reused by subsequent
+    connectors, so only the first ``connect()`` in a thread pays for the handshake and bind.
+    Outside of test mode these connections use the ``RESTARTABLE`` strategy, i.e. they are
+    re-opened and re-bound transparently when the server drops them.
+
+    With ``cached=True``, the results of ``get_ldap_username_domain_by_mail()`` and
+    ``get_user_info()`` are cached in the Django cache for ``LDAP_CACHE_TIMEOUT`` seconds.
+    Users that were not found are cached for ``LDAP_CACHE_NEGATIVE_TIMEOUT`` seconds.
+    ``cache_user_infos()`` stores the results of batched searches, so the LDAP sync
+    refreshes the cached user information of all users it checks.
+    """
 
     connection1 = None
     connection2 = None
 
     def __init__(
-        self, test_mode=False, test_setup_server1=None, test_setup_server2=None, logging=False
+        self,
+        test_mode=False,
+        test_setup_server1=None,
+        test_setup_server2=None,
+        logging=False,
+        pooled=False,
+        cached=False,
     ):
         self.test_mode = test_mode
         self.test_setup_server1 = test_setup_server1
         self.test_setup_server2 = test_setup_server2
+        self.pooled = pooled
+        self.cached = cached
         if logging:
             logger.setLevel(_logging.DEBUG)
         else:
             logger.setLevel(_logging.CRITICAL)
 
-    def connect(self):
-        # Open LDAP connections and bind
-        test_mode = {}
+    def _open_connection(self, server, bind_dn, password, test_setup, name):
+        # Open LDAP connection and bind
+        strategy = {}
 
         if self.test_mode:
             logger.debug("LDAP test mode enabled")
-            test_mode["client_strategy"] = ldap3.MOCK_SYNC
+            strategy["client_strategy"] = ldap3.MOCK_SYNC
+
+        elif self.pooled:
+            strategy["client_strategy"] = ldap3.RESTARTABLE
+
+        connection = ldap3.Connection(server, user=bind_dn, password=password, **strategy)
+
+        if self.test_mode:
+            logger.debug("%s test mode: setting up server", name)
+            test_setup(connection)
+
+        if not connection.bind():
+            msg = "Could not connect to %s" % name
+            logger.error(msg)
+            raise ConnectionError(msg)
+
+        return connection
+
+    def _get_connection(self, server, bind_dn, password, test_setup, name):
+        if not self.pooled:
+            return self._open_connection(server, bind_dn, password, test_setup, name)
+
+        connections = _get_pooled_connections()
+        key = (self.test_mode, str(server), bind_dn)
+        connection = connections.get(key)
 
+        if connection is None or connection.closed or not connection.bound:
+            logger.debug("Opening pooled %s connection", name)
+            connection = self._open_connection(server, bind_dn, password, test_setup, name)
+            connections[key] = connection
+
+        else:
+            logger.debug("Reusing pooled %s connection", name)
+
+        return connection
+
+    def connect(self):
         if settings.ENABLE_LDAP:
             logger.debug("LDAP enabled")
             ssl_options = {}
@@ -50,48 +245,68 @@ class LdapConnector:
             server1 = ldap3.Server(url, **ssl_options)
 
             logger.debug("Connecting to LDAP server: %s", settings.AUTH_LDAP_SERVER_URI)
-            self.connection1 = ldap3.Connection(
+            self.connection1 = self._get_connection(
                 server1,
-                user=settings.AUTH_LDAP_BIND_DN,
-                password=settings.AUTH_LDAP_BIND_PASSWORD,
-                **test_mode,
+                settings.AUTH_LDAP_BIND_DN,
+                settings.AUTH_LDAP_BIND_PASSWORD,
+                self.test_setup_server1,
+                "LDAP",
             )
 
-            if self.test_mode:
-                logger.debug("LDAP test mode: setting up server 1")
-                self.test_setup_server1(self.connection1)
-
-            if not self.connection1.bind():
-                msg = "Could not connect to LDAP"
-                logger.error(msg)
-                raise ConnectionError(msg)
-
         if settings.ENABLE_LDAP_SECONDARY:
             logger.debug("LDAP2 enabled")
             server2 = ldap3.Server(settings.AUTH_LDAP2_SERVER_URI)
 
             logger.debug("Connecting to LDAP2 server: %s", settings.AUTH_LDAP2_SERVER_URI)
-            self.connection2 = ldap3.Connection(
+            self.connection2 = self._get_connection(
                 server2,
-                user=settings.AUTH_LDAP2_BIND_DN,
-                password=settings.AUTH_LDAP2_BIND_PASSWORD,
-                **test_mode,
+                settings.AUTH_LDAP2_BIND_DN,
+                settings.AUTH_LDAP2_BIND_PASSWORD,
+                self.test_setup_server2,
+                "LDAP2",
             )
 
-            if self.test_mode:
-                logger.debug("LDAP test mode: setting up server 2")
-                self.test_setup_server2(self.connection2)
+        return True
 
-            if not self.connection2.bind():
-                msg = "Could not connect to LDAP2"
-                logger.error(msg)
-                raise ConnectionError(msg)
+    def _cached_lookup(self, kind, key, lookup):
+        if not self.cached:
+            return lookup()
 
-        return True
+        cache = _cache()
+        cache_key = f"{CACHE_KEY_PREFIX}:{kind}:{key}"
+        hit = cache.get(cache_key)
+
+        if hit is not None:
+            logger.debug("Cache hit for %s lookup: %s", kind, key)
+            _count_cache_access(kind, "hits")
+
+            if "error" in hit:
+                raise LdapUserNotFound(hit["error"])
+
+            return hit["value"]
+
+        _count_cache_access(kind, "misses")
+
+        try:
+            value = lookup()
+        except LdapUserNotFound as e:
+            cache.set(cache_key, {"error": str(e)}, settings.LDAP_CACHE_NEGATIVE_TIMEOUT)
+            raise
+
+        cache.set(cache_key, {"value": value}, settings.LDAP_CACHE_TIMEOUT)
+        return value
 
     def get_ldap_username_domain_by_mail(self, mail):
         """Load user information from a given email."""
 
+        return self._cached_lookup(
+            CACHE_KIND_MAIL,
+            mail.lower(),
+            lambda: self._get_ldap_username_domain_by_mail(mail),
+        )
+
+    def _get_ldap_username_domain_by_mail(self, mail):
+
         email_domains = []
         email_domains2 = []
 
@@ -144,7 +359,7 @@ class LdapConnector:
         if not connection.search(**search_params):
             msg = "No user found"
             logger.error(msg)
-            raise Exception(msg)
+            raise LdapUserNotFound(msg)
 
         if not len(connection.entries) == 1:
             msg = "Less or more than one user found"
@@ -158,8 +373,9 @@ class LdapConnector:
 
         return connection.entries[0]["sAMAccountName"].value, domain
 
-    def get_user_info(self, username):
-        """Load usr information for a given username."""
+    @staticmethod
+    def split_username(username):
+        """Split a Django username into LDAP username and domain."""
 
         try:
             username, domain = username.split("@")
@@ -168,6 +384,11 @@ class LdapConnector:
             logger.error(msg)
             raise ValueError(msg) from err
 
+        return username, domain
+
+    def _get_user_connection(self, domain):
+        """Return connection and search base for the given username domain."""
+
         if settings.ENABLE_LDAP and domain == settings.AUTH_LDAP_USERNAME_DOMAIN:
             connection = self.connection1
 
@@ -176,7 +397,7 @@ class LdapConnector:
                 logger.error(msg)
                 raise ImproperlyConfigured(msg)
 
-            search_base = settings.AUTH_LDAP_USER_SEARCH_BASE
+            return connection, settings.AUTH_LDAP_USER_SEARCH_BASE
 
         elif settings.ENABLE_LDAP_SECONDARY and domain == settings.AUTH_LDAP2_USERNAME_DOMAIN:
             connection = self.connection2
@@ -186,32 +407,35 @@ class LdapConnector:
                 logger.error(msg)
                 raise ImproperlyConfigured(msg)
 
-            search_base = settings.AUTH_LDAP2_USER_SEARCH_BASE
+            return connection, settings.AUTH_LDAP2_USER_SEARCH_BASE
 
-        else:
-            msg = "Domain %s not valid. Maybe LDAP not activated?" % domain
-            logger.error(msg)
-            raise ImproperlyConfigured(msg)
+        msg = "Domain %s not valid. Maybe LDAP not activated?" % domain
+        logger.error(msg)
+        raise ImproperlyConfigured(msg)
+
+    def get_user_info(self, username):
+        """Load usr information for a given username."""
+
+        return UserInfo(
+            self._cached_lookup(
+                CACHE_KIND_USER, username, lambda: self._get_user_attributes(username)
+            )
+        )
+
+    def _get_user_attributes(self, username):
+        username, domain = self.split_username(username)
+        connection, search_base = self._get_user_connection(domain)
 
         search_params = {
             "search_base": search_base,
             "search_filter": "(&(objectclass=person)(sAMAccountName={}))".format(username),
-            "attributes": [
-                "mail",
-                "displayName",
-                "givenName",
-                "sn",
-                "userAccountControl",
-                "telephoneNumber",
-                "uidNumber",
-                "cn",
-            ],
+            "attributes": USER_INFO_ATTRIBUTES,
         }
 
         if not connection.search(**search_params):
             msg = "No user found for username: %s@%s" % (username, domain)
             logger.error(msg)
-            raise Exception(msg)
+            raise LdapUserNotFound(msg)
 
         if not len(connection.entries) == 1:
             msg = "Less or more than one user found for username: %s@%s" % (username, domain)
@@ -220,4 +444,90 @@ class LdapConnector:
 
         logger.debug("User found for username: %s@%s" % (username, domain))
 
-        return connection.entries[0]
+        return connection.entries[0].entry_attributes_as_dict
+
+    def cache_user_infos(self, domain, infos):
+        """Store the results of ``get_user_infos()`` for ``get_user_info()``."""
+
+        if not self.cached or not infos:
+            return
+
+        _cache().set_many(
+            {
+                f"{CACHE_KEY_PREFIX}:{CACHE_KIND_USER}:{username}@{domain}": {
+                    "value": {
+                        name: value if isinstance(value, list) else [value]
+                        for name, value in attributes.items()
+                        if name in USER_INFO_ATTRIBUTES
+                    }
+                }
+                for username, attributes in infos.items()
+            },
+            settings.LDAP_CACHE_TIMEOUT,
+        )
+
+    def get_user_infos(
+        self, domain, usernames, chunk_size=SEARCH_CHUNK_SIZE, paged_size=SEARCH_PAGED_SIZE
+    ):
+        """Load user information for many usernames of one domain.
+
+        The usernames are resolved in chunks, each with a single paged OR-filter search.
+        Returns a tuple of two dicts, mapping usernames to the attributes of the found
+        entry and mapping usernames to error messages, respectively.
+        """
+
+        connection, search_base = self._get_user_connection(domain)
+        found = defaultdict(list)
+
+        for i in range(0, len(usernames), chunk_size):
+            chunk = usernames[i : i + chunk_size]
+            search_filter = "(&(objectclass=person)(|{}))".format(
+                "".join(
+                    "(sAMAccountName={})".format(escape_filter_chars(username))
+                    for username in chunk
+                )
+            )
+            logger.debug("Searching for %d users in domain %s" % (len(chunk), domain))
+
+            for entry in connection.extend.standard.paged_search(
+                search_base=search_base,
+                search_filter=search_filter,
+                attributes=USER_INFO_ATTRIBUTES + ["sAMAccountName"],
+                paged_size=paged_size,
+                generator=True,
+            ):
+                if entry.get("type", "searchResEntry") != "searchResEntry":
+                    continue
+
+                attributes = entry["attributes"]
+                found[str(first_value(attributes.get("sAMAccountName"))).lower()].append(attributes)
+
+        infos = {}
+        errors = {}
+
+        for username in usernames:
+            entries = found.get(username.lower(), [])
+
+            if not entries:
+                msg = "No user found for username: %s@%s" % (username, domain)
+                logger.error(msg)
+                errors[username] = msg
+
+            elif not len(entries) == 1:
+                msg = "Less or more than one user found for username: %s@%s" % (username, domain)
+                logger.error(msg)
+                errors[username] = msg
+
+            else:
+                infos[username] = entries[0]
+
+        return infos, errors
+
+
+def first_value(value):
+    """Return the first value of a (possibly multi-valued) LDAP attribute."""
+
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+
+    return value
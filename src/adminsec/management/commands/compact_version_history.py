@@ -0,0 +1,82 @@
+"""Compact the version history of the versioned HPC objects."""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from usersec.models import VERSION_COMPACT_BATCH_SIZE, get_versioned_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Remove old versions whose versioned fields all equal those of their successor. The "
+        "first and last version, status transitions and versions carrying a comment are kept."
+    )
+
+    def add_arguments(self, parser):
+        self.models = {model.__name__: model for model in get_versioned_models()}
+        parser.add_argument(
+            "--model",
+            choices=sorted(self.models),
+            action="append",
+            help="Only compact the history of this model, can be given multiple times.",
+        )
+        parser.add_argument(
+            "--start-after",
+            type=int,
+            default=0,
+            help="Resume after this primary key, requires a single --model.",
+        )
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=settings.VERSION_HISTORY_RETENTION_DAYS,
+            help="Only remove versions older than this number of days.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=VERSION_COMPACT_BATCH_SIZE,
+            help="Number of objects processed per transaction.",
+        )
+        parser.add_argument(
+            "--write",
+            action="store_true",
+            help="Remove the versions, otherwise only report what would be removed.",
+        )
+
+    def handle(self, *args, **options):
+        names = options["model"] or sorted(self.models)
+
+        if options["start_after"] and len(names) != 1:
+            self.stderr.write("--start-after requires a single --model ... aborting.")
+            return
+
+        before = timezone.now() - timedelta(days=options["retention_days"])
+        verb = "removed" if options["write"] else "to remove"
+        total = 0
+
+        for name in names:
+            deleted = 0
+
+            for progress in self.models[name].objects.compact_version_history(
+                before=before,
+                start_after=options["start_after"],
+                batch_size=options["batch_size"],
+                dry_run=not options["write"],
+            ):
+                deleted += progress["deleted"]
+                self.stderr.write(
+                    f"{name}: {progress['objects']} objects up to pk {progress['last_pk']}, "
+                    f"{progress['deleted']} versions {verb}"
+                )
+
+            self.stderr.write(f"{name}: done, {deleted} versions {verb}")
+            total += deleted
+
+        if not options["write"]:
+            self.stderr.write("Dry run succeeded. Use `--write` to save to database.")
+
+        self.stderr.write(f"Version history compacted: {total} versions {verb}.")
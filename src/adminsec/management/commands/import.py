@@ -1,16 +1,17 @@
 """Command for importing data from a json file."""
 
-import json
+import time
 from collections.abc import Generator
 from contextlib import contextmanager
 from datetime import datetime
+from itertools import islice
 
 from django.contrib import auth
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from adminsec.models import HpcaccessState
 from adminsec.tasks import clean_db_of_hpc_objects
+from hpc_access.utils.json_stream import iter_section
 from usersec.models import HpcGroup, HpcProject, HpcUser
 
 User = auth.get_user_model()
@@ -31,6 +32,9 @@ def rollback(_self) -> Generator[None, None, None]:
         pass
 
 
+#: Default number of entries read from the json file and written at once.
+IMPORT_BATCH_SIZE = 1000
+
 SUFFIX_MAPPING = {
     "c": "@CHARITE",
     "m": "@MDC-BERLIN",
@@ -38,147 +42,238 @@ SUFFIX_MAPPING = {
 
 
 class Command(BaseCommand):
-    help = "Import HPC objects from a json file."
+    help = (
+        "Import HPC objects from a json file. The file is streamed once per phase (groups, "
+        "users, group owners, projects) so that memory is bounded by --batch-size entries and "
+        "each phase can refer to the objects created by the previous ones."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument("json", type=str)
         parser.add_argument("--write", action="store_true")
         parser.add_argument("--purge", action="store_true")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=IMPORT_BATCH_SIZE,
+            help="Number of entries read and written at once.",
+        )
 
     def handle(self, *args, **options):
         worker_user = User.objects.get(username="hpc-worker")
         context = transaction.atomic() if options["write"] else rollback(self)
         users_consented = []
+        self.elapsed = {}
+        self.timer = time.monotonic()
+        # Map uuids of the dump to primary keys of the existing and created objects.
+        self.group_ids = {}
+        self.hpcuser_ids = {}
         try:
-            with context, open(options["json"], "r") as jsonfile:
+            with context:
                 if options["purge"]:
                     users_consented = clean_db_of_hpc_objects()
                     if users_consented is None:
                         self.stderr.write("Failed to clean database of HPC objects ... aborting.")
                         return
+                    self.lap("purge")
 
-                data = HpcaccessState(**json.load(jsonfile))
-                for group_uuid, group_data in data.hpc_groups.items():
-                    hpcgroup = HpcGroup(
-                        uuid=group_uuid,
-                        name=group_data["name"],
-                        description=group_data["description"],
-                        creator=worker_user,
-                        status=group_data["status"],
-                        gid=group_data["gid"],
-                        folders=dict(group_data["folders"]),
-                        resources_requested=dict(group_data["resources_requested"]),
-                        resources_used=dict(group_data["resources_used"]),
-                        expiration=datetime.fromisoformat(group_data["expiration"]),
+                users_consented = set(users_consented)
+                # Objects of the dump may refer to objects already in the database.
+                self.group_ids = {
+                    str(uuid): pk for uuid, pk in HpcGroup.objects.values_list("uuid", "pk")
+                }
+                self.hpcuser_ids = {
+                    str(uuid): pk for uuid, pk in HpcUser.objects.values_list("uuid", "pk")
+                }
+                # The file is read once per phase on purpose: phases depend on the objects of
+                # the previous ones and sections may appear in any order, so a single pass
+                # would have to hold the later sections in memory.
+                phases = (
+                    ("groups", "hpc_groups", lambda b: self.import_groups(b, worker_user)),
+                    (
+                        "users",
+                        "hpc_users",
+                        lambda b: self.import_users(b, worker_user, users_consented),
+                    ),
+                    ("owners", "hpc_groups", self.import_group_owners),
+                    ("projects", "hpc_projects", lambda b: self.import_projects(b, worker_user)),
+                )
+                for phase, section, import_batch in phases:
+                    self.run_phase(
+                        phase, options["json"], section, import_batch, options["batch_size"]
                     )
-                    hpcgroup.save_with_version()
-
-                for user_uuid, user_data in data.hpc_users.items():
-                    ldap_user, suffix = user_data["username"].split("_")
-                    if user_data["primary_group"]:
-                        hpcgroup = HpcGroup.objects.filter(uuid=user_data["primary_group"])
-                        if not hpcgroup:
-                            self.stderr.write(
-                                f"Primary group {user_data['primary_group']} of user "
-                                f"{user_data['username']} not found"
-                            )
-                            continue
-                        hpcgroup = hpcgroup.first()
-                    else:
-                        hpcgroup = None
-
-                    username = f"{ldap_user}{SUFFIX_MAPPING[suffix]}"
-                    user = User.objects.create(
-                        first_name=user_data["first_name"].strip(),
-                        last_name=user_data["last_name"].strip(),
-                        name=user_data["full_name"].strip(),
-                        display_name=user_data["display_name"].strip(),
-                        email=user_data["email"],
-                        is_staff=False,
-                        is_superuser=False,
-                        is_hpcadmin=False,
-                        consented_to_terms=username in users_consented,
-                        phone=user_data["phone_number"],
-                        username=username,
+
+        except Rollback:
+            pass
+
+        self.stderr.write(
+            "Elapsed: "
+            + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.elapsed.items())
+        )
+
+    def run_phase(self, phase, path, section, import_batch, batch_size):
+        """Stream the entries of ``section`` from the json file into ``import_batch``."""
+        count = 0
+        with open(path, "r") as jsonfile:
+            entries = iter_section(jsonfile, section)
+            while batch := list(islice(entries, batch_size)):
+                import_batch(batch)
+                count += len(batch)
+                self.stderr.write(f"{phase}: {count} entries processed")
+        self.lap(phase)
+
+    def lap(self, phase):
+        """Record the time spent in ``phase`` since the last lap."""
+        current = time.monotonic()
+        self.elapsed[phase] = current - self.timer
+        self.timer = current
+
+    def import_groups(self, groups, worker_user):
+        """Create groups without owner and delegate, these are set once users exist."""
+        hpcgroups = [
+            HpcGroup(
+                uuid=group_uuid,
+                name=group_data["name"],
+                description=group_data["description"],
+                creator=worker_user,
+                status=group_data["status"],
+                gid=group_data["gid"],
+                folders=dict(group_data["folders"]),
+                resources_requested=dict(group_data["resources_requested"]),
+                resources_used=dict(group_data["resources_used"]),
+                expiration=datetime.fromisoformat(group_data["expiration"]),
+            )
+            for group_uuid, group_data in groups
+        ]
+        for hpcgroup in hpcgroups:
+            hpcgroup.update_quota_status()
+        HpcGroup.objects.bulk_create_with_version(hpcgroups)
+        self.group_ids.update({str(hpcgroup.uuid): hpcgroup.pk for hpcgroup in hpcgroups})
+
+    def import_users(self, users, worker_user, users_consented):
+        """Create Django users and HPC users."""
+        entries = []
+        for user_uuid, user_data in users:
+            ldap_user, suffix = user_data["username"].split("_")
+            if user_data["primary_group"]:
+                group_id = self.group_ids.get(str(user_data["primary_group"]))
+                if group_id is None:
+                    self.stderr.write(
+                        f"Primary group {user_data['primary_group']} of user "
+                        f"{user_data['username']} not found"
                     )
-                    hpcuser = HpcUser(
-                        uuid=user_uuid,
-                        user=user,
-                        resources_requested={
-                            "tier1_home": user_data["resources_requested"]["tier1_home"],
-                        },
-                        resources_used={
-                            "tier1_home": user_data["resources_used"]["tier1_home"],
-                        },
-                        creator=worker_user,
-                        status=user_data["status"],
-                        home_directory=user_data["home_directory"],
-                        primary_group=hpcgroup,
-                        expiration=datetime.fromisoformat(user_data["expiration"]),
-                        login_shell=user_data["login_shell"],
-                        username=user_data["username"],
-                        uid=user_data["uid"],
+                    continue
+            else:
+                group_id = None
+
+            username = f"{ldap_user}{SUFFIX_MAPPING[suffix]}"
+            user = User(
+                first_name=user_data["first_name"].strip(),
+                last_name=user_data["last_name"].strip(),
+                name=user_data["full_name"].strip(),
+                display_name=user_data["display_name"].strip(),
+                email=user_data["email"],
+                is_staff=False,
+                is_superuser=False,
+                is_hpcadmin=False,
+                consented_to_terms=username in users_consented,
+                phone=user_data["phone_number"],
+                username=username,
+            )
+            entries.append((user_uuid, user_data, group_id, user))
+
+        User.objects.bulk_create([user for _, _, _, user in entries])
+        hpcusers = [
+            HpcUser(
+                uuid=user_uuid,
+                user=user,
+                resources_requested={
+                    "tier1_home": user_data["resources_requested"]["tier1_home"],
+                },
+                resources_used={
+                    "tier1_home": user_data["resources_used"]["tier1_home"],
+                },
+                creator=worker_user,
+                status=user_data["status"],
+                home_directory=user_data["home_directory"],
+                primary_group_id=group_id,
+                expiration=datetime.fromisoformat(user_data["expiration"]),
+                login_shell=user_data["login_shell"],
+                username=user_data["username"],
+                uid=user_data["uid"],
+            )
+            for user_uuid, user_data, group_id, user in entries
+        ]
+        for hpcuser in hpcusers:
+            hpcuser.update_quota_status()
+        HpcUser.objects.bulk_create_with_version(hpcusers)
+        self.hpcuser_ids.update({str(hpcuser.uuid): hpcuser.pk for hpcuser in hpcusers})
+
+    def import_group_owners(self, groups):
+        """Set owner and delegate of the groups, adding a new group version."""
+        owners = {}
+        for group_uuid, group_data in groups:
+            group_id = self.group_ids.get(str(group_uuid))
+            if group_id is None:
+                self.stderr.write(f"Group {group_uuid} not found")
+                continue
+            owner_id = self.hpcuser_ids.get(str(group_data["owner"]))
+            if owner_id is None:
+                self.stderr.write(
+                    f"Owner {group_data['owner']} of group {group_data['name']} not found"
+                )
+                continue
+            delegate_id = None
+            if group_data["delegate"]:
+                delegate_id = self.hpcuser_ids.get(str(group_data["delegate"]))
+                if delegate_id is None:
+                    self.stderr.write(
+                        f"Delegate {group_data['delegate']} of group {group_data['name']} not found"
                     )
-                    hpcuser.save_with_version()
-
-                for group_uuid, group_data in data.hpc_groups.items():
-                    hpcgroup = HpcGroup.objects.filter(uuid=group_uuid)
-                    if not hpcgroup:
-                        self.stderr.write(f"Group {group_uuid} not found")
-                        continue
-                    hpcgroup = hpcgroup.first()
-                    owner = HpcUser.objects.filter(uuid=group_data["owner"])
-                    if not owner:
-                        self.stderr.write(
-                            f"Owner {group_data['owner']} of group {group_data['name']} not found"
-                        )
-                        continue
-                    hpcgroup.owner = owner.first()
-                    if group_data["delegate"]:
-                        delegate = HpcUser.objects.filter(uuid=group_data["delegate"])
-                        if not delegate:
-                            self.stderr.write(
-                                f"Delegate {group_data['delegate']} of group "
-                                f"{group_data['name']} not found"
-                            )
-                            continue
-                        hpcgroup.delegate = delegate.first()
-                    hpcgroup.save_with_version()
-
-                for project_uuid, project_data in data.hpc_projects.items():
-                    hpcgroup = HpcGroup.objects.filter(uuid=project_data["group"])
-                    if not hpcgroup:
-                        self.stderr.write(
-                            f"Owning group {project_data['group']} of project "
-                            f"{project_data['name']} not found"
-                        )
-                        continue
-                    hpcgroup = hpcgroup.first()
-                    delegate = HpcUser.objects.filter(uuid=project_data["delegate"])
-                    delegate = delegate.first() if delegate else None
-                    hpcproject = HpcProject(
-                        uuid=project_uuid,
-                        name=project_data["name"],
-                        gid=project_data["gid"],
-                        folders=dict(project_data["folders"]),
-                        status=project_data["status"],
-                        creator=worker_user,
-                        group=hpcgroup,
-                        delegate=delegate,
-                        resources_requested=dict(project_data["resources_requested"]),
-                        resources_used=dict(project_data["resources_used"]),
-                        expiration=datetime.fromisoformat(project_data["expiration"]),
+                    continue
+            owners[group_id] = (owner_id, delegate_id)
+
+        hpcgroups = list(HpcGroup.objects.filter(pk__in=owners))
+        for hpcgroup in hpcgroups:
+            hpcgroup.owner_id, hpcgroup.delegate_id = owners[hpcgroup.pk]
+        HpcGroup.objects.bulk_update_with_version(hpcgroups, ["owner", "delegate"])
+
+    def import_projects(self, projects, worker_user):
+        """Create projects together with their members."""
+        hpcprojects = []
+        members = []
+        for project_uuid, project_data in projects:
+            group_id = self.group_ids.get(str(project_data["group"]))
+            if group_id is None:
+                self.stderr.write(
+                    f"Owning group {project_data['group']} of project "
+                    f"{project_data['name']} not found"
+                )
+                continue
+            hpcproject = HpcProject(
+                uuid=project_uuid,
+                name=project_data["name"],
+                gid=project_data["gid"],
+                folders=dict(project_data["folders"]),
+                status=project_data["status"],
+                creator=worker_user,
+                group_id=group_id,
+                delegate_id=self.hpcuser_ids.get(str(project_data["delegate"])),
+                resources_requested=dict(project_data["resources_requested"]),
+                resources_used=dict(project_data["resources_used"]),
+                expiration=datetime.fromisoformat(project_data["expiration"]),
+            )
+            hpcproject.update_quota_status()
+            hpcprojects.append(hpcproject)
+            member_ids = []
+            for member_uuid in project_data["members"]:
+                member_id = self.hpcuser_ids.get(str(member_uuid))
+                if member_id is None:
+                    self.stderr.write(
+                        f"Member {member_uuid} of project {project_data['name']} not found"
                     )
-                    hpcproject.save_with_version()
-                    for member_uuid in project_data["members"]:
-                        member = HpcUser.objects.filter(uuid=member_uuid)
-                        if not member:
-                            self.stderr.write(
-                                f"Member {member_uuid} of project {project_data['name']} not found"
-                            )
-                            continue
-                        hpcproject.members.add(member.first())
-                        hpcproject.version_history.last().members.add(member.first())
+                    continue
+                member_ids.append(member_id)
+            members.append(member_ids)
 
-        except Rollback:
-            pass
+        HpcProject.objects.bulk_create_with_version(hpcprojects, m2m={"members": members})
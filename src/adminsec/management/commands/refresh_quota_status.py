@@ -0,0 +1,16 @@
+"""Recompute the persisted quota status of users, groups and projects."""
+
+from django.core.management.base import BaseCommand
+
+from usersec.models import refresh_quota_status
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the persisted quota status, e.g. after changing QUOTA_WARNING_THRESHOLD "
+        "or QUOTA_WARNING_ABSOLUTE."
+    )
+
+    def handle(self, *args, **options):
+        for label, count in refresh_quota_status(force=True).items():
+            self.stderr.write(f"{label}: {count} quota status updated")
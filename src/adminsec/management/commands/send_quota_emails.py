@@ -31,22 +31,28 @@ class Command(BaseCommand):
             "red": HpcQuotaStatus.RED,
         }
 
-        response = [
-            e
-            for e in _send_quota_email(
-                level_map[options["level"]], dry_run=not options["no_dry_run"]
+        summary = _send_quota_email(level_map[options["level"]], dry_run=not options["no_dry_run"])
+
+        if summary is None:
+            self.stderr.write("Quota emails are disabled.")
+
+        elif options["no_dry_run"]:
+            self.stderr.write(
+                f"Quota emails sent: {summary['sent']} sent, "
+                f"{summary['skipped']} duplicates skipped, {len(summary['failed'])} failed."
             )
-            if isinstance(e, str)
-        ]
 
-        if options["no_dry_run"]:
-            self.stderr.write("Quota emails sent.")
+            for failure in summary["failed"]:
+                self.stderr.write(
+                    f"Failed: {', '.join(failure['to'])}, '{failure['subject']}': "
+                    f"{failure['error']}"
+                )
 
         else:
             self.stderr.write(
-                f"Dry run mode enabled. {len(response)} email(s) would have been sent."
+                f"Dry run mode enabled. {len(summary['messages'])} email(s) would have been sent."
             )
             self.stderr.write(f"Writing emails to file {EMAIL_FILE}")
 
             with open(EMAIL_FILE, "w") as file:
-                file.write(f"\n{'-' * 80}\n".join(response))
+                file.write(f"\n{'-' * 80}\n".join(summary["messages"]))
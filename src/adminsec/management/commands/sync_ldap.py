@@ -16,7 +16,10 @@ class Command(BaseCommand):
         self.stderr.write("Syncing LDAP...")
 
         # Sync LDAP
-        exception_count = _sync_ldap(write=options["write"], verbose=options["verbose"])
+        report = {}
+        exception_count = _sync_ldap(
+            write=options["write"], verbose=options["verbose"], report=report
+        )
 
         # Print exceptions
         for key, value in exception_count.items():
@@ -25,4 +28,26 @@ class Command(BaseCommand):
             else:
                 self.stderr.write(str(key))
 
+        # Print report
+        self.stderr.write(
+            f"{report['users_checked']} users checked, {report['users_changed']} users and "
+            f"{report['hpcusers_changed']} HPC users "
+            f"{'changed' if options['write'] else 'would be changed'}."
+        )
+
+        for key, value in sorted(report["user_fields"].items()):
+            self.stderr.write(f"  user.{key}: {value}")
+
+        for key, value in sorted(report["hpcuser_fields"].items()):
+            self.stderr.write(f"  hpcuser.{key}: {value}")
+
+        for key in ("disabled", "reenabled"):
+            if report[key]:
+                self.stderr.write(f"{key.capitalize()}: {', '.join(report[key])}")
+
+        self.stderr.write(
+            "Elapsed: "
+            + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in report["elapsed"].items())
+        )
+
         self.stderr.write("LDAP sync complete.")
@@ -13,3 +13,11 @@ class HpcaccessState:
     hpc_users: dict[UUID, HpcUser]
     hpc_groups: dict[UUID, HpcGroup]
     hpc_projects: dict[UUID, HpcProject]
+
+
+@dataclass(frozen=True)
+class HpcaccessStateDelta(HpcaccessState):
+    """Class to hold the changes of the HPC access system since a cursor."""
+
+    deleted: dict[str, list[UUID]]
+    cursor: str
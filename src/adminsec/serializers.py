@@ -2,7 +2,22 @@
 
 from rest_framework import serializers
 
-from usersec.serializers import HpcGroupSerializer, HpcProjectSerializer, HpcUserSerializer
+from usersec.serializers import (
+    HpcGroupSerializer,
+    HpcProjectSerializer,
+    HpcUserSerializer,
+    ResourceDataJSONField,
+    ResourceDataUserJSONField,
+)
+
+#: The resources of the object were updated.
+RESOURCE_USAGE_UPDATED = "updated"
+
+#: No object with the uuid exists.
+RESOURCE_USAGE_NOT_FOUND = "not_found"
+
+#: The uuid or the resources are invalid.
+RESOURCE_USAGE_INVALID = "invalid"
 
 
 class HpcaccessStateSerializer(serializers.Serializer):
@@ -11,3 +26,37 @@ class HpcaccessStateSerializer(serializers.Serializer):
     hpc_users = serializers.DictField(child=HpcUserSerializer())
     hpc_groups = serializers.DictField(child=HpcGroupSerializer())
     hpc_projects = serializers.DictField(child=HpcProjectSerializer())
+
+
+class HpcaccessStateDeltaSerializer(HpcaccessStateSerializer):
+    """Cluster status changes since a cursor, with the cursor for the next request."""
+
+    deleted = serializers.DictField(child=serializers.ListField(child=serializers.UUIDField()))
+    cursor = serializers.CharField()
+
+
+class ResourceUsageUpdateSerializer(serializers.Serializer):
+    """Resources used by users, groups, and projects, by uuid."""
+
+    hpc_users = serializers.DictField(child=ResourceDataUserJSONField(), required=False)
+    hpc_groups = serializers.DictField(child=ResourceDataJSONField(), required=False)
+    hpc_projects = serializers.DictField(child=ResourceDataJSONField(), required=False)
+
+
+class ResourceUsageResultSerializer(serializers.Serializer):
+    """Result of updating the resources used by one object."""
+
+    status = serializers.CharField(
+        help_text=(
+            f"{RESOURCE_USAGE_UPDATED}, {RESOURCE_USAGE_NOT_FOUND} or {RESOURCE_USAGE_INVALID}"
+        )
+    )
+    errors = serializers.DictField(required=False)
+
+
+class ResourceUsageResultsSerializer(serializers.Serializer):
+    """Results of updating the resources used by users, groups, and projects, by uuid."""
+
+    hpc_users = serializers.DictField(child=ResourceUsageResultSerializer())
+    hpc_groups = serializers.DictField(child=ResourceUsageResultSerializer())
+    hpc_projects = serializers.DictField(child=ResourceUsageResultSerializer())
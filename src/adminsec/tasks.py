@@ -1,17 +1,29 @@
 # Create your tasks here
 import logging
+import time
 from collections import defaultdict
 
+from celery import group
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F
 from django.utils import timezone
 
-from adminsec.email import send_notification_storage_quota
-from adminsec.ldap import LdapConnector
+from adminsec.email import (
+    build_notification_storage_quota,
+    build_notification_user_consent,
+    deliver_outbox,
+    send_messages,
+)
+from adminsec.ldap import LdapConnector, first_value
 from config.celery import app
 from usersec.models import (
     OBJECT_STATUS_EXPIRED,
+    USAGE_RESOLUTION_DAILY,
+    USAGE_RESOLUTION_HOURLY,
+    ConsentNotificationChunk,
+    ConsentNotificationJob,
     HpcGroup,
     HpcGroupChangeRequest,
     HpcGroupCreateRequest,
@@ -27,95 +39,229 @@ from usersec.models import (
     HpcUserChangeRequest,
     HpcUserCreateRequest,
     HpcUserDeleteRequest,
+    OutboxEmail,
+    ResourceUsageSample,
     TermsAndConditions,
+    get_quota_reports,
+    get_versioned_models,
+    refresh_quota_status,
 )
 
 User = get_user_model()
 
+#: Number of users disabled per transaction.
+DISABLE_USERS_BATCH_SIZE = 500
+
+#: Login shell of expired users.
+NOLOGIN_SHELL = "/usr/sbin/nologin"
+
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
-def _sync_ldap(write=False, verbose=False, ldapcon=None):
+#: Number of rows written per bulk update query when syncing with LDAP.
+SYNC_LDAP_BATCH_SIZE = 1000
+
+
+def _ldap_attributes_to_user_values(attributes):
+    """Map the LDAP attributes of a person to ``User`` field values.
+
+    Attributes not set in LDAP are left out, so the current values are kept.
+    """
+
+    values = {}
+    mapping = (
+        ("last_name", "sn", lambda v: v.strip()),
+        ("first_name", "givenName", lambda v: v.strip()),
+        ("email", "mail", str),
+        ("phone", "telephoneNumber", str),
+        ("uid", "uidNumber", int),
+        ("name", "cn", str),
+        ("display_name", "displayName", str),
+    )
+
+    for field, attribute, convert in mapping:
+        value = first_value(attributes.get(attribute))
+
+        if value:
+            values[field] = convert(value)
+
+    user_account_control = first_value(attributes.get("userAccountControl"))
+    disabled = True
+
+    if user_account_control:
+        disabled = bool(int(user_account_control) & 2)
+
+    values["is_active"] = not disabled
+
+    return values
+
+
+def _apply_values(obj, values):
+    """Set the given values on the object and return the names of the changed fields."""
+
+    changed = [field for field, value in values.items() if getattr(obj, field) != value]
+
+    for field in changed:
+        setattr(obj, field, values[field])
+
+    return changed
+
+
+def _sync_ldap(write=False, verbose=False, ldapcon=None, report=None):
+    """Sync user information with the LDAP(s) and return the counts of the exceptions raised.
+
+    If a dict is passed as ``report``, it is filled with a report of the changes found (and
+    written if ``write`` is set): the number of checked and changed users, the counts of
+    changed fields, the usernames of disabled and re-enabled users, and the time spent per
+    phase in seconds.
+
+    The users are always searched in the LDAP(s), the results refresh the lookup cache of
+    ``ldapcon`` if it is cached.
+    """
+
     if not ldapcon:
-        ldapcon = LdapConnector(logging=verbose)
+        ldapcon = LdapConnector(logging=verbose, cached=True)
+
+    if report is None:
+        report = {}
+
+    timer = time.monotonic()
+    report.update(
+        {
+            "users_checked": 0,
+            "users_changed": 0,
+            "hpcusers_changed": 0,
+            "user_fields": defaultdict(int),
+            "hpcuser_fields": defaultdict(int),
+            "disabled": [],
+            "reenabled": [],
+            "elapsed": {},
+        }
+    )
+
+    def _phase_done(phase):
+        nonlocal timer
+        current = time.monotonic()
+        report["elapsed"][phase] = current - timer
+        timer = current
 
     ldapcon.connect()
+    _phase_done("connect")
 
     exception_count = defaultdict(int)
+    users_by_domain = defaultdict(list)
 
     for user in User.objects.filter(
         is_superuser=False,
         is_staff=False,
         is_hpcadmin=False,
-    ):
+    ).prefetch_related("hpcuser_user"):
         try:
-            userinfo = ldapcon.get_user_info(user.username)
-            userAccountControl = userinfo.userAccountControl
-            phone = userinfo.telephoneNumber
-            uid = userinfo.uidNumber
-            first_name = userinfo.givenName
-            last_name = userinfo.sn
-            mail = userinfo.mail
-            name = userinfo.cn
-            display_name = userinfo.displayName
-            disabled = True
+            username, domain = ldapcon.split_username(user.username)
+        except ValueError as e:
+            exception_count[str(e)] += 1
+            continue
+
+        users_by_domain[domain].append((username, user))
+        report["users_checked"] += 1
 
-            if userAccountControl:
-                disabled = bool(int(userinfo.userAccountControl.value) & 2)
+    _phase_done("load")
 
-            if last_name:
-                user.last_name = last_name[0].strip()
+    changed_users = {}
+    changed_user_fields = set()
+    changed_hpcusers = {}
+    now = timezone.now()
 
-            if first_name:
-                user.first_name = first_name[0].strip()
+    for domain, domain_users in users_by_domain.items():
+        try:
+            userinfos, errors = ldapcon.get_user_infos(
+                domain, [username for username, _ in domain_users]
+            )
+        except Exception as e:
+            exception_count[str(e)] += len(domain_users)
+            continue
 
-            if mail:
-                user.email = mail[0]
+        ldapcon.cache_user_infos(domain, userinfos)
 
-            if phone:
-                user.phone = phone[0]
+        for error in errors.values():
+            exception_count[error] += 1
 
-            if uid:
-                user.uid = uid[0]
+        for username, user in domain_users:
+            if username not in userinfos:
+                continue
+
+            try:
+                values = _ldap_attributes_to_user_values(userinfos[username])
+            except Exception as e:
+                exception_count[str(e)] += 1
+                continue
 
-            if name:
-                user.name = name[0]
+            changed = _apply_values(user, values)
 
-            if display_name:
-                user.display_name = display_name[0]
+            if changed:
+                changed_users[user.pk] = user
+                changed_user_fields.update(changed)
 
-            user.is_active = not disabled
+                for field in changed:
+                    report["user_fields"][field] += 1
 
-            if user.hpcuser_user.exists():
-                hpcuser = user.hpcuser_user.first()
-                if disabled:
-                    hpcuser.status = "EXPIRED"
-                    hpcuser.login_shell = "/usr/sbin/nologin"
+                if "is_active" in changed:
+                    report["reenabled" if user.is_active else "disabled"].append(user.username)
+
+            for hpcuser in user.hpcuser_user.all():
+                if values["is_active"]:
+                    hpcuser_values = {"status": "ACTIVE", "login_shell": "/bin/bash"}
                 else:
-                    hpcuser.status = "ACTIVE"
-                    hpcuser.login_shell = "/bin/bash"
+                    hpcuser_values = {"status": "EXPIRED", "login_shell": "/usr/sbin/nologin"}
 
-                if write:
-                    hpcuser.save()
+                changed = _apply_values(hpcuser, hpcuser_values)
 
-            if write:
-                user.save()
+                if changed:
+                    hpcuser.date_modified = now
+                    changed_hpcusers[hpcuser.pk] = hpcuser
 
-        except Exception as e:
-            exception_count[str(e)] += 1
-            continue
+                    for field in changed:
+                        report["hpcuser_fields"][field] += 1
+
+    report["users_changed"] = len(changed_users)
+    report["hpcusers_changed"] = len(changed_hpcusers)
+    _phase_done("search")
+
+    if write and (changed_users or changed_hpcusers):
+        with transaction.atomic():
+            User.objects.bulk_update(
+                changed_users.values(),
+                sorted(changed_user_fields),
+                batch_size=SYNC_LDAP_BATCH_SIZE,
+            )
+            HpcUser.objects.bulk_update(
+                changed_hpcusers.values(),
+                ["status", "login_shell", "date_modified"],
+                batch_size=SYNC_LDAP_BATCH_SIZE,
+            )
+
+            # User details are part of the HPC user state, flag them as modified.
+            if changed_users:
+                HpcUser.objects.filter(user__in=changed_users.keys()).update(date_modified=now)
+
+    _phase_done("write")
+
+    report["user_fields"] = dict(report["user_fields"])
+    report["hpcuser_fields"] = dict(report["hpcuser_fields"])
 
     return exception_count
 
 
-def _generate_quota_reports():
+def _generate_quota_reports(status=None):
+    """Generate quota reports, only for objects with worst quota status ``status`` if given."""
     logger.info("Generating quota reports ...")
+    filters = {} if status is None else {"quota_status": status.value}
     return {
-        "users": {o: o.generate_quota_report() for o in HpcUser.objects.all()},
-        "projects": {o: o.generate_quota_report() for o in HpcProject.objects.all()},
-        "groups": {o: o.generate_quota_report() for o in HpcGroup.objects.all()},
+        "users": get_quota_reports(HpcUser.objects.filter(**filters)),
+        "projects": get_quota_reports(HpcProject.objects.filter(**filters)),
+        "groups": get_quota_reports(HpcGroup.objects.filter(**filters)),
     }
 
 
@@ -124,8 +270,9 @@ def _send_quota_email(status, dry_run=False):
         logger.info("Quota emails are disabled ... aborting.")
         return
 
-    reports = _generate_quota_reports()
-    response = []
+    refresh_quota_status()
+    reports = _generate_quota_reports(status)
+    messages = []
 
     for data in reports.values():
         for hpc_obj, report in data.items():
@@ -135,9 +282,26 @@ def _send_quota_email(status, dry_run=False):
                 continue
 
             if any([s == status for s in report["status"].values()]):
-                response.append(send_notification_storage_quota(hpc_obj, report, dry_run=dry_run))
+                message = build_notification_storage_quota(hpc_obj, report)
 
-    return response
+                if message:
+                    messages.append(message)
+
+    summary = send_messages(messages, dry_run=dry_run)
+    logger.info(
+        "Quota emails: %d sent, %d duplicates skipped, %d failed",
+        summary["sent"],
+        summary["skipped"],
+        len(summary["failed"]),
+    )
+
+    for failure in summary["failed"]:
+        logger.error(
+            f"Error sending quota email to {failure['to']}, '{failure['subject']}': "
+            f"{failure['error']}"
+        )
+
+    return summary
 
 
 @app.task(bind=True)
@@ -152,38 +316,225 @@ def send_quota_email_red(_self):
     _send_quota_email(HpcQuotaStatus.RED)
 
 
-@transaction.atomic
+@app.task(bind=True)
+def refresh_stored_quota_status(_self):
+    """Recompute the stored quota status after the warning thresholds changed."""
+    updated = refresh_quota_status()
+
+    if updated is not None:
+        logger.info("Quota status refreshed: %d objects updated", sum(updated.values()))
+
+    return updated
+
+
+@app.task(bind=True)
+def compact_usage_history(_self):
+    created = ResourceUsageSample.objects.compact()
+    logger.info(
+        "Usage history compacted: %d hourly and %d daily samples created",
+        created[USAGE_RESOLUTION_HOURLY],
+        created[USAGE_RESOLUTION_DAILY],
+    )
+    return created
+
+
+@app.task(bind=True)
+def compact_version_history(_self):
+    deleted = {
+        model.__name__: sum(
+            progress["deleted"] for progress in model.objects.compact_version_history()
+        )
+        for model in get_versioned_models()
+    }
+    logger.info("Version history compacted: %d versions removed", sum(deleted.values()))
+    return deleted
+
+
+@app.task(bind=True)
+def deliver_email_outbox(_self):
+    summary = deliver_outbox()
+    purged = OutboxEmail.objects.purge()
+    logger.info(
+        "Email outbox delivered: %d sent, %d retried, %d failed, %d purged",
+        summary["sent"],
+        summary["retried"],
+        summary["failed"],
+        purged,
+    )
+    return summary
+
+
+def _consent_notification_users():
+    return User.objects.exclude(is_hpcadmin=True).exclude(is_superuser=True).exclude(is_staff=True)
+
+
+def start_consent_notification(date_published):
+    """Create the job notifying the users about published terms and conditions.
+
+    The users are split into chunks of ``CONSENT_NOTIFICATION_CHUNK_SIZE`` that are sent in
+    parallel once the surrounding transaction commits.
+    """
+    pks = list(_consent_notification_users().order_by("pk").values_list("pk", flat=True))
+    size = settings.CONSENT_NOTIFICATION_CHUNK_SIZE
+    job = ConsentNotificationJob.objects.create(date_published=date_published, total=len(pks))
+    chunks = ConsentNotificationChunk.objects.bulk_create(
+        [
+            ConsentNotificationChunk(
+                job=job, first_user_id=pks[i], last_user_id=pks[min(i + size, len(pks)) - 1]
+            )
+            for i in range(0, len(pks), size)
+        ]
+    )
+    transaction.on_commit(
+        lambda: group(
+            send_consent_notification_chunk.s(chunk.pk) for chunk in chunks
+        ).apply_async(),
+        robust=True,
+    )
+    return job
+
+
+def _claim_consent_notification_chunk(chunk_pk):
+    """Claim the chunk for ``CONSENT_NOTIFICATION_LEASE`` seconds, ``None`` if done or claimed."""
+    with transaction.atomic():
+        chunk = ConsentNotificationChunk.objects.select_for_update().get(pk=chunk_pk)
+        now = timezone.now()
+
+        if chunk.date_done or (chunk.lease_until and chunk.lease_until > now):
+            # Sent by an earlier attempt or being sent by another task
+            return None
+
+        chunk.lease_until = now + timezone.timedelta(seconds=settings.CONSENT_NOTIFICATION_LEASE)
+        chunk.save(update_fields=["lease_until"])
+        return chunk
+
+
+@app.task(bind=True, autoretry_for=(Exception,), retry_backoff=True, max_retries=3)
+def send_consent_notification_chunk(_self, chunk_pk):
+    """Notify the users of the chunk in batches of ``EMAIL_BATCH_SIZE``.
+
+    The chunk is claimed in a short transaction and the emails are sent outside of it.  The
+    progress is saved after every batch, a retry continues after the last user notified.
+    """
+    chunk = _claim_consent_notification_chunk(chunk_pk)
+
+    if chunk is None:
+        return
+
+    users = _consent_notification_users().filter(
+        consented_to_terms=False, pk__gte=chunk.first_user_id, pk__lte=chunk.last_user_id
+    )
+
+    try:
+        while True:
+            batch = list(
+                users.filter(pk__gt=chunk.last_sent_user_id or 0).order_by("pk")[
+                    : settings.EMAIL_BATCH_SIZE
+                ]
+            )
+
+            if not batch:
+                break
+
+            messages = [build_notification_user_consent(user) for user in batch]
+            summary = send_messages(messages)
+
+            for failure in summary["failed"]:
+                logger.error(
+                    f"Error sending consent notification to {failure['to']}: {failure['error']}"
+                )
+
+            failed = len(summary["failed"])
+            sent = len(messages) - failed
+
+            with transaction.atomic():
+                chunk.last_sent_user_id = batch[-1].pk
+                chunk.sent += sent
+                chunk.failed += failed
+                chunk.lease_until = timezone.now() + timezone.timedelta(
+                    seconds=settings.CONSENT_NOTIFICATION_LEASE
+                )
+                chunk.save(update_fields=["last_sent_user_id", "sent", "failed", "lease_until"])
+                ConsentNotificationJob.objects.filter(pk=chunk.job_id).update(
+                    sent=F("sent") + sent, failed=F("failed") + failed
+                )
+    except Exception:
+        # Release the chunk for the retry
+        ConsentNotificationChunk.objects.filter(pk=chunk.pk).update(lease_until=None)
+        raise
+
+    chunk.date_done = timezone.now()
+    chunk.lease_until = None
+    chunk.save(update_fields=["date_done", "lease_until"])
+
+
 @app.task(bind=True)
 def disable_users_without_consent(_self):
+    """Disable the users that have not consented within the grace period after publication.
+
+    Users are processed in chunks of ``DISABLE_USERS_BATCH_SIZE``, each in a short transaction.
+    The HPC users of disabled users are expired with a new version.
+    """
+    summary = {"users": 0, "hpcusers": 0}
     terms = TermsAndConditions.objects.filter(date_published__isnull=False)
     if not terms.exists():
-        return
+        return summary
     if (
         terms.first().date_published + timezone.timedelta(days=settings.CONSENT_GRACE_PERIOD)
         > timezone.now()
     ):
-        return
-    users = (
-        User.objects.filter(consented_to_terms=False)
-        .exclude(is_hpcadmin=True)
-        .exclude(is_superuser=True)
-        .exclude(is_staff=True)
+        return summary
+
+    users = _consent_notification_users().filter(consented_to_terms=False)
+    last_pk = 0
+
+    while True:
+        pks = list(
+            users.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:DISABLE_USERS_BATCH_SIZE]
+        )
+
+        if not pks:
+            break
+
+        with transaction.atomic():
+            summary["users"] += User.objects.filter(pk__in=pks, is_active=True).update(
+                is_active=False
+            )
+            hpcusers = list(
+                HpcUser.objects.filter(user_id__in=pks).exclude(
+                    status=OBJECT_STATUS_EXPIRED, login_shell=NOLOGIN_SHELL
+                )
+            )
+
+            for hpcuser in hpcusers:
+                hpcuser.status = OBJECT_STATUS_EXPIRED
+                hpcuser.login_shell = NOLOGIN_SHELL
+
+            HpcUser.objects.bulk_update_with_version(hpcusers, ["status", "login_shell"])
+            summary["hpcusers"] += len(hpcusers)
+
+        last_pk = pks[-1]
+
+    logger.info(
+        "Users without consent disabled: %d users and %d HPC users",
+        summary["users"],
+        summary["hpcusers"],
     )
-    for user in users:
-        user.is_active = False
-        user.save()
-        try:
-            hpcuser = HpcUser.objects.get(user=user)
-            hpcuser.status = OBJECT_STATUS_EXPIRED
-            hpcuser.login_shell = "/usr/sbin/nologin"
-            hpcuser.save()
-        except HpcUser.DoesNotExist:
-            continue
+    return summary
 
 
 @app.task(bind=True)
 def sync_ldap(_self, write=False, verbose=False):
-    _sync_ldap(write, verbose)
+    report = {}
+    _sync_ldap(write, verbose, report=report)
+    logger.info(
+        "LDAP sync: %d users checked, %d users and %d HPC users changed",
+        report["users_checked"],
+        report["users_changed"],
+        report["hpcusers_changed"],
+    )
 
 
 @transaction.atomic
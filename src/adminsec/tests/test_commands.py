@@ -0,0 +1,327 @@
+import json
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from test_plus import TestCase
+
+from adminsec.models import HpcaccessState
+from adminsec.serializers import HpcaccessStateSerializer
+from adminsec.tasks import clean_db_of_hpc_objects
+from hpc_access.users.tests.factories import UserFactory
+from hpc_access.utils.json_stream import JsonStreamReader, iter_section
+from usersec.models import (
+    HpcGroup,
+    HpcGroupVersion,
+    HpcProject,
+    HpcProjectVersion,
+    HpcQuotaStatus,
+    HpcUser,
+    HpcUserVersion,
+)
+from usersec.tests.factories import HpcGroupFactory, HpcProjectFactory, HpcUserFactory
+
+
+class TestImportCommand(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.worker = UserFactory(username="hpc-worker", is_staff=True)
+        group = HpcGroupFactory()
+        owner = HpcUserFactory(primary_group=group)
+        member = HpcUserFactory(primary_group=group)
+        group.owner = owner
+        group.delegate = member
+        group.save()
+        project = HpcProjectFactory(group=group, delegate=member)
+        project.members.add(owner, member)
+
+        state = HpcaccessState(
+            hpc_users={o.uuid: o for o in HpcUser.objects.all()},
+            hpc_groups={o.uuid: o for o in HpcGroup.objects.all()},
+            hpc_projects={o.uuid: o for o in HpcProject.objects.all()},
+        )
+        self.data = json.loads(
+            json.dumps(HpcaccessStateSerializer(state).data, cls=DjangoJSONEncoder)
+        )
+        for user_data in self.data["hpc_users"].values():
+            user_data.update(first_name="John", last_name="Doe", display_name="Doe, John")
+        self.group_uuid = str(group.uuid)
+        self.owner_uuid = str(owner.uuid)
+        self.member_uuid = str(member.uuid)
+        self.project_uuid = str(project.uuid)
+        clean_db_of_hpc_objects()
+
+    def _call_import(self, *args):
+        stderr = StringIO()
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as jsonfile:
+            json.dump(self.data, jsonfile)
+            jsonfile.flush()
+            call_command("import", jsonfile.name, *args, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_import(self):
+        output = self._call_import("--write")
+
+        self.assertEqual(HpcUser.objects.count(), 2)
+        group = HpcGroup.objects.get(uuid=self.group_uuid)
+        self.assertEqual(str(group.owner.uuid), self.owner_uuid)
+        self.assertEqual(str(group.delegate.uuid), self.member_uuid)
+        self.assertEqual(group.current_version, 2)
+        self.assertEqual(HpcGroupVersion.objects.count(), 2)
+        self.assertEqual(group.get_latest_version().owner, group.owner)
+        member = HpcUser.objects.get(uuid=self.member_uuid)
+        self.assertEqual(member.primary_group, group)
+        self.assertEqual(member.user.username, member.username.replace("_c", "@CHARITE"))
+        self.assertEqual(member.version_history.count(), 1)
+        project = HpcProject.objects.get(uuid=self.project_uuid)
+        self.assertEqual(project.group, group)
+        self.assertEqual(project.delegate, member)
+        self.assertEqual(project.members.count(), 2)
+        self.assertEqual(HpcProjectVersion.objects.get().members.count(), 2)
+        self.assertIn("Elapsed: groups", output)
+
+    def test_import_batches(self):
+        output = self._call_import("--write", "--batch-size", "1")
+
+        self.assertEqual(HpcUser.objects.count(), 2)
+        self.assertEqual(HpcProject.objects.get().members.count(), 2)
+        self.assertIn("users: 1 entries processed", output)
+        self.assertIn("users: 2 entries processed", output)
+        self.assertIn("projects: 1 entries processed", output)
+
+    def test_import_missing_references(self):
+        self.data["hpc_groups"][self.group_uuid]["delegate"] = "unknown-delegate"
+        self.data["hpc_projects"][self.project_uuid]["members"].append("unknown-member")
+
+        output = self._call_import("--write")
+
+        group = HpcGroup.objects.get(uuid=self.group_uuid)
+        self.assertIsNone(group.owner)
+        self.assertEqual(group.current_version, 1)
+        self.assertIn("Delegate unknown-delegate of group", output)
+        self.assertIn("Member unknown-member of project", output)
+        self.assertEqual(HpcProject.objects.get().members.count(), 2)
+
+    def test_import_incremental(self):
+        projects = self.data.pop("hpc_projects")
+        self.data["hpc_projects"] = {}
+        self._call_import("--write")
+        self.data = {"hpc_users": {}, "hpc_groups": {}, "hpc_projects": projects}
+
+        output = self._call_import("--write")
+
+        project = HpcProject.objects.get(uuid=self.project_uuid)
+        self.assertEqual(str(project.group.uuid), self.group_uuid)
+        self.assertEqual(str(project.delegate.uuid), self.member_uuid)
+        self.assertEqual(project.members.count(), 2)
+        self.assertNotIn("not found", output)
+
+    def test_import_dry_run(self):
+        output = self._call_import()
+
+        self.assertEqual(HpcUser.objects.count(), 0)
+        self.assertEqual(HpcGroup.objects.count(), 0)
+        self.assertEqual(HpcProject.objects.count(), 0)
+        self.assertIn("Dry run succeeded", output)
+
+
+class TestRefreshQuotaStatusCommand(TestCase):
+    def test_refresh_quota_status(self):
+        group = HpcGroupFactory(
+            resources_requested={"tier1_work": 100}, resources_used={"tier1_work": 85}
+        )
+        stderr = StringIO()
+
+        with self.settings(QUOTA_WARNING_THRESHOLD=80, QUOTA_WARNING_ABSOLUTE=10**6):
+            call_command("refresh_quota_status", stderr=stderr)
+
+        group.refresh_from_db()
+        self.assertEqual(group.get_quota_status(), HpcQuotaStatus.YELLOW)
+        self.assertIn("usersec.HpcGroup: 1 quota status updated", stderr.getvalue())
+
+
+class TestCompactVersionHistoryCommand(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.hpcuser = HpcUserFactory()
+
+        for _ in range(3):
+            self.hpcuser.save_with_version()
+
+        HpcUserVersion.objects.update(date_created=timezone.now() - timedelta(days=365))
+
+    def _call_command(self, *args):
+        stderr = StringIO()
+        call_command("compact_version_history", *args, stderr=stderr)
+        return stderr.getvalue()
+
+    def test_dry_run(self):
+        output = self._call_command("--model", "HpcUser")
+
+        self.assertEqual(self.hpcuser.version_history.count(), 4)
+        self.assertIn(
+            f"HpcUser: 1 objects up to pk {self.hpcuser.pk}, 2 versions to remove", output
+        )
+        self.assertIn("Dry run succeeded", output)
+
+    def test_write(self):
+        output = self._call_command("--write")
+
+        self.assertEqual(self.hpcuser.version_history.count(), 2)
+        self.assertIn("HpcUser: done, 2 versions removed", output)
+        self.assertIn("Version history compacted: 2 versions removed.", output)
+
+    def test_retention_days(self):
+        self._call_command("--write", "--retention-days", "400")
+
+        self.assertEqual(self.hpcuser.version_history.count(), 4)
+
+    def test_start_after(self):
+        pk = self.hpcuser.pk
+        self._call_command("--write", "--model", "HpcUser", "--start-after", str(pk))
+
+        self.assertEqual(self.hpcuser.version_history.count(), 4)
+
+        self._call_command("--write", "--model", "HpcUser", "--start-after", str(pk - 1))
+
+        self.assertEqual(self.hpcuser.version_history.count(), 2)
+
+    def test_start_after_multiple_models(self):
+        output = self._call_command("--write", "--start-after", "1")
+
+        self.assertEqual(self.hpcuser.version_history.count(), 4)
+        self.assertIn("--start-after requires a single --model", output)
+
+
+class TestIterSection(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = {
+            "numbers": {"a": 1, "b": -12.5e3, "c": 123456789},
+            "nested": {
+                "x": {"list": [1, {"y": None}], "text": 'with "quotes", {braces} and \u00fc'},
+                "z": {},
+            },
+            "empty": {},
+            "scalar": "value",
+        }
+
+    def _iter_section(self, section, chunk_size):
+        return list(iter_section(StringIO(json.dumps(self.data, indent=2)), section, chunk_size))
+
+    def test_iter_section(self):
+        for chunk_size in (1, 3, 7, 4096):
+            for section in ("numbers", "nested", "empty"):
+                self.assertEqual(
+                    self._iter_section(section, chunk_size), list(self.data[section].items())
+                )
+
+    def test_iter_section_missing(self):
+        self.assertEqual(self._iter_section("missing", 5), [])
+
+    def test_iter_section_invalid(self):
+        with self.assertRaises(ValueError):
+            list(iter_section(StringIO('{"numbers": {"a": 1'), "numbers", 4))
+
+    def test_iter_section_skipped_arrays(self):
+        data = '{"list": [], "nested": [[1, "]"], {"a": [2]}], "numbers": {"a": 1}}'
+        for chunk_size in (1, 2, 4096):
+            self.assertEqual(list(iter_section(StringIO(data), "numbers", chunk_size)), [("a", 1)])
+
+    def test_iter_section_array(self):
+        with self.assertRaisesMessage(ValueError, "Expected '{' but found '['"):
+            list(iter_section(StringIO('{"numbers": [1, 2]}'), "numbers", 4))
+
+    def test_iter_section_truncated(self):
+        data = json.dumps(self.data)
+        for end in (0, 1, len(data) // 2, len(data) - 1):
+            with self.subTest(end=end):
+                with self.assertRaises(ValueError):
+                    list(iter_section(StringIO(data[:end]), "scalar", 3))
+
+
+class TestJsonStreamReader(TestCase):
+    def _reader(self, data, chunk_size=1):
+        return JsonStreamReader(StringIO(data), chunk_size)
+
+    def test_decode_string_escapes(self):
+        value = 'quote " backslash \\ brackets {[]} ü \U0001f600 \n'
+        data = json.dumps(value)
+        self.assertIn("\\u00fc", data)
+        for chunk_size in (1, 2, 3, 5, 4096):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._reader(data, chunk_size).decode(), value)
+
+    def test_decode_nested(self):
+        value = {"a": [1, {"b": [[], {}], "c": "]}"}], "d": {"e": {"f": None}}}
+        data = json.dumps(value)
+        for chunk_size in (1, 2, 3, 4096):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self._reader(data, chunk_size).decode(), value)
+
+    def test_decode_split_tokens(self):
+        for data, value in (
+            ("1234567", 1234567),
+            ("-12.5e-3", -12.5e-3),
+            ("true", True),
+            ("false", False),
+            ("null", None),
+        ):
+            for chunk_size in (1, 2, 3):
+                with self.subTest(data=data, chunk_size=chunk_size):
+                    reader = self._reader(f"[{data}, {data}]", chunk_size)
+                    self.assertEqual(reader.decode(), [value, value])
+                    reader = self._reader(data, chunk_size)
+                    self.assertEqual(reader.decode(), value)
+
+    def test_decode_sequence(self):
+        reader = self._reader(' 12 "a"\n[]  {} ', 2)
+        self.assertEqual([reader.decode() for _ in range(4)], [12, "a", [], {}])
+        with self.assertRaisesMessage(ValueError, "Unexpected end of JSON input"):
+            reader.decode()
+
+    def test_iter_keys(self):
+        reader = self._reader('{"a\\"{": 1, "b": {"c": [2]}, "\\u00fc": "x"}', 3)
+        entries = []
+        for key in reader.iter_keys():
+            if key == "b":
+                entries.extend(
+                    (key, nested_key, reader.decode()) for nested_key in reader.iter_keys()
+                )
+            else:
+                entries.append((key, reader.decode()))
+        self.assertEqual(entries, [('a"{', 1), ("b", "c", [2]), ("ü", "x")])
+
+    def test_iter_keys_empty(self):
+        self.assertEqual(list(self._reader(" { } ").iter_keys()), [])
+
+    def test_iter_keys_not_object(self):
+        with self.assertRaisesMessage(ValueError, "Expected '{' but found '['"):
+            list(self._reader("[]").iter_keys())
+
+    def test_iter_keys_invalid_key(self):
+        with self.assertRaisesMessage(ValueError, "Expected object key but found 1"):
+            list(self._reader('{1: "a"}').iter_keys())
+
+    def test_iter_keys_missing_colon(self):
+        with self.assertRaisesMessage(ValueError, "Expected ':' but found '1'"):
+            list(self._reader('{"a" 1}').iter_keys())
+
+    def test_iter_keys_missing_comma(self):
+        reader = self._reader('{"a": 1 "b": 2}')
+        with self.assertRaisesMessage(ValueError, "Expected ',' or '}' but found '\"'"):
+            for _ in reader.iter_keys():
+                reader.decode()
+
+    def test_decode_malformed(self):
+        for data in ("[1, 2", '"unterminated', "{'a': 1}", "nul", "[1,]"):
+            with self.subTest(data=data):
+                with self.assertRaises(json.JSONDecodeError):
+                    self._reader(data, 2).decode()
+
+    def test_decode_truncated(self):
+        with self.assertRaisesMessage(ValueError, "Unexpected end of JSON input"):
+            self._reader("   ").decode()
@@ -1,8 +1,20 @@
+from unittest.mock import patch
+
 from django.core import mail
+from django.core.mail import EmailMessage, get_connection
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+from test_plus import TestCase
 
 # TODO import and test new functions
 from adminsec.email import (
+    RateLimiter,
+    build_notification_storage_quota,
+    deliver_outbox,
     send_mail,
+    send_messages,
     send_notification_admin_request,
     send_notification_manager_group_created,
     send_notification_manager_group_request,
@@ -12,10 +24,17 @@ from adminsec.email import (
     send_notification_manager_request_denied,
     send_notification_manager_revision_required,
     send_notification_manager_user_decided_invitation,
+    send_notification_storage_quota,
     send_notification_user_consent,
     send_notification_user_invitation,
     send_notification_user_welcome_mail,
 )
+from usersec.models import (
+    OUTBOX_STATUS_FAILED,
+    OUTBOX_STATUS_PENDING,
+    OUTBOX_STATUS_SENT,
+    OutboxEmail,
+)
 from usersec.tests.factories import (
     HpcGroupCreateRequestFactory,
     HpcGroupInvitationFactory,
@@ -23,6 +42,7 @@ from usersec.tests.factories import (
     HpcProjectInvitationFactory,
     HpcUserChangeRequestFactory,
     HpcUserCreateRequestFactory,
+    OutboxEmailFactory,
 )
 from usersec.tests.test_views import TestViewBase
 
@@ -115,3 +135,227 @@ class TestEmail(TestViewBase):
         )
         self.assertEqual(ret, 1)
         self.assertEqual(len(mail.outbox), 1)
+
+    def test_build_notification_storage_quota(self):
+        message = build_notification_storage_quota(
+            self.hpc_member, self.hpc_member.generate_quota_report()
+        )
+        self.assertEqual(message.to, [self.hpc_member.user.email])
+        self.assertEqual(message.alternatives[0][1], "text/html")
+
+    def test_send_notification_storage_quota(self):
+        ret = send_notification_storage_quota(
+            self.hpc_member, self.hpc_member.generate_quota_report()
+        )
+        self.assertEqual(ret, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class TestSendMessages(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.messages = [
+            EmailMessage("Subject", "Content", to=["user1@example.com"]),
+            EmailMessage("Subject", "Content", to=["user2@example.com"]),
+            EmailMessage("Subject", "Content", to=["user1@example.com"]),
+        ]
+
+    def test_send_messages(self):
+        with patch("adminsec.email.get_connection", wraps=get_connection) as mock:
+            summary = send_messages(self.messages)
+
+        self.assertEqual(summary, {"sent": 2, "skipped": 1, "failed": [], "messages": []})
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(
+            [m.to for m in mail.outbox], [["user1@example.com"], ["user2@example.com"]]
+        )
+
+    def test_send_messages_batches(self):
+        with patch("adminsec.email.get_connection", wraps=get_connection) as mock:
+            summary = send_messages(self.messages, batch_size=1, workers=2)
+
+        self.assertEqual(summary["sent"], 2)
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_messages_failed(self):
+        send = EmailBackend.send_messages
+
+        def side_effect(backend, messages):
+            if messages[0].to == ["user1@example.com"]:
+                raise OSError("Recipient refused")
+            return send(backend, messages)
+
+        with patch.object(EmailBackend, "send_messages", autospec=True, side_effect=side_effect):
+            summary = send_messages(self.messages)
+
+        self.assertEqual(summary["sent"], 1)
+        self.assertEqual(
+            summary["failed"],
+            [{"to": ["user1@example.com"], "subject": "Subject", "error": "Recipient refused"}],
+        )
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_send_messages_connection_failed(self):
+        with patch.object(EmailBackend, "open", side_effect=OSError("Connection refused")):
+            summary = send_messages(self.messages)
+
+        self.assertEqual(summary["sent"], 0)
+        self.assertEqual(len(summary["failed"]), 2)
+        self.assertEqual(summary["failed"][1]["error"], "Connection refused")
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_messages_dry_run(self):
+        summary = send_messages(self.messages, dry_run=True)
+
+        self.assertEqual(summary["sent"], 0)
+        self.assertEqual(len(summary["messages"]), 2)
+        self.assertIn("To: user2@example.com", summary["messages"][1])
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_rate_limiter(self):
+        rate_limiter = RateLimiter(10)
+
+        with patch("adminsec.email.time.sleep") as mock:
+            for _ in range(3):
+                rate_limiter.wait()
+
+        self.assertEqual(mock.call_count, 2)
+        self.assertAlmostEqual(mock.call_args_list[1][0][0], 0.2, places=2)
+
+    def test_rate_limiter_unlimited(self):
+        with patch("adminsec.email.time.sleep") as mock:
+            RateLimiter(0).wait()
+
+        mock.assert_not_called()
+
+
+class TestEmailOutbox(TestCase):
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_send_mail_enqueue(self):
+        with patch("adminsec.tasks.deliver_email_outbox.delay") as mock:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                ret = send_mail("Subject", "Content", ["user@example.com"], alternative="<p>Hi</p>")
+
+        self.assertEqual(ret, 1)
+        self.assertEqual(len(callbacks), 1)
+        mock.assert_called_once_with()
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.recipients, ["user@example.com"])
+        self.assertEqual(email.body_html, "<p>Hi</p>")
+        self.assertEqual(email.status, OUTBOX_STATUS_PENDING)
+
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_send_mail_enqueue_single_delivery(self):
+        with patch("adminsec.tasks.deliver_email_outbox.delay") as mock:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                with transaction.atomic():
+                    send_mail("Subject", "Content", ["user@example.com"])
+                    send_mail("Subject", "Content", ["other@example.com"])
+
+        self.assertEqual(len(callbacks), 2)
+        mock.assert_called_once_with()
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+        with patch("adminsec.tasks.deliver_email_outbox.delay") as mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                send_mail("Subject", "Content", ["user@example.com"])
+
+        mock.assert_called_once_with()
+
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_send_mail_enqueue_after_rollback(self):
+        with patch("adminsec.tasks.deliver_email_outbox.delay") as mock:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        send_mail("Subject", "Content", ["user@example.com"])
+                        raise RuntimeError("Rollback")
+                except RuntimeError:
+                    pass
+
+                send_mail("Subject", "Content", ["other@example.com"])
+
+        mock.assert_called_once_with()
+        self.assertEqual(OutboxEmail.objects.get().recipients, ["other@example.com"])
+
+    @override_settings(EMAIL_OUTBOX_LEASE=600)
+    def test_deliver_outbox_claimed(self):
+        email = OutboxEmailFactory()
+        atomic_blocks = len(connection.atomic_blocks)
+        sending = []
+
+        def send_messages(backend, messages):
+            sending.append(
+                (len(connection.atomic_blocks), OutboxEmail.objects.get(pk=email.pk).next_attempt)
+            )
+            return len(messages)
+
+        with patch.object(EmailBackend, "send_messages", send_messages):
+            summary = deliver_outbox()
+
+        self.assertEqual(summary["sent"], 1)
+        self.assertEqual(sending[0][0], atomic_blocks)
+        self.assertGreater(sending[0][1], timezone.now() + timezone.timedelta(seconds=500))
+        email.refresh_from_db()
+        self.assertEqual(email.status, OUTBOX_STATUS_SENT)
+
+    def test_deliver_outbox(self):
+        OutboxEmailFactory(body_html="<p>Content</p>")
+        OutboxEmailFactory(recipients=["other@example.com"])
+        OutboxEmailFactory(next_attempt=timezone.now() + timezone.timedelta(minutes=5))
+
+        with patch("adminsec.email.get_connection", wraps=get_connection) as mock:
+            summary = deliver_outbox()
+
+        self.assertEqual(summary, {"sent": 2, "retried": 0, "failed": 0})
+        self.assertEqual(mock.call_count, 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].alternatives, [("<p>Content</p>", "text/html")])
+        self.assertEqual(mail.outbox[1].to, ["other@example.com"])
+        self.assertEqual(OutboxEmail.objects.filter(status=OUTBOX_STATUS_SENT).count(), 2)
+
+    def test_deliver_outbox_batches(self):
+        OutboxEmailFactory.create_batch(3)
+
+        with patch("adminsec.email.get_connection", wraps=get_connection) as mock:
+            summary = deliver_outbox(batch_size=2)
+
+        self.assertEqual(summary["sent"], 3)
+        self.assertEqual(mock.call_count, 2)
+
+    @override_settings(EMAIL_OUTBOX_RETRY_DELAY=60, EMAIL_OUTBOX_MAX_ATTEMPTS=3)
+    def test_deliver_outbox_retry(self):
+        email = OutboxEmailFactory(attempts=1)
+
+        with patch.object(EmailBackend, "send_messages", side_effect=OSError("Unavailable")):
+            summary = deliver_outbox()
+
+        self.assertEqual(summary, {"sent": 0, "retried": 1, "failed": 0})
+        email.refresh_from_db()
+        self.assertEqual(email.status, OUTBOX_STATUS_PENDING)
+        self.assertEqual(email.attempts, 2)
+        self.assertEqual(email.error, "Unavailable")
+        self.assertGreater(email.next_attempt, timezone.now() + timezone.timedelta(seconds=100))
+
+        email.next_attempt = timezone.now()
+        email.save()
+
+        with patch.object(EmailBackend, "send_messages", side_effect=OSError("Unavailable")):
+            summary = deliver_outbox()
+
+        self.assertEqual(summary, {"sent": 0, "retried": 0, "failed": 1})
+        email.refresh_from_db()
+        self.assertEqual(email.status, OUTBOX_STATUS_FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_purge(self):
+        OutboxEmailFactory(
+            status=OUTBOX_STATUS_SENT, date_sent=timezone.now() - timezone.timedelta(days=365)
+        )
+        OutboxEmailFactory(status=OUTBOX_STATUS_SENT, date_sent=timezone.now())
+        OutboxEmailFactory()
+
+        self.assertEqual(OutboxEmail.objects.purge(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 2)
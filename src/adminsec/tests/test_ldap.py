@@ -1,7 +1,14 @@
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.test import TestCase, override_settings
 
-from adminsec.ldap import LdapConnector
+from adminsec.ldap import (
+    LdapConnector,
+    LdapUserNotFound,
+    get_cache_stats,
+    reset_cache_stats,
+    reset_connection_pool,
+)
 
 ENABLE_LDAP = True
 ENABLE_LDAP_SECONDARY = True
@@ -43,6 +50,9 @@ LDAP_DEFAULT_MOCKS = {
     "AUTH_LDAP2_USERNAME_DOMAIN": AUTH_LDAP2_USERNAME_DOMAIN,
 }
 
+#: Settings for cached lookups with hit and miss counters.
+LDAP_CACHED_MOCKS = {**LDAP_DEFAULT_MOCKS, "LDAP_CACHE_STATS": True}
+
 
 USERNAME = "user"
 USERNAME2 = "user2"
@@ -171,3 +181,224 @@ class TestLdapConnector(TestCase):
             Exception, rf"No user found for username: some_other_user@{AUTH_LDAP2_USERNAME_DOMAIN}"
         ):
             self.ldap.get_user_info(f"some_other_user@{AUTH_LDAP2_USERNAME_DOMAIN}")
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_get_user_infos(self):
+        self.ldap.connect()
+
+        infos, errors = self.ldap.get_user_infos(
+            AUTH_LDAP_USERNAME_DOMAIN, [USERNAME, "some_other_user"], chunk_size=1
+        )
+
+        self.assertEqual(list(infos.keys()), [USERNAME])
+        self.assertEqual(infos[USERNAME]["mail"], [USER_MAIL_INSTITUTE])
+        self.assertEqual(
+            errors,
+            {
+                "some_other_user": (
+                    f"No user found for username: some_other_user@{AUTH_LDAP_USERNAME_DOMAIN}"
+                )
+            },
+        )
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_get_user_infos_wrong_domain(self):
+        self.ldap.connect()
+
+        with self.assertRaisesRegex(
+            ImproperlyConfigured, r"Domain SOME-OTHER-DOMAIN not valid\. Maybe LDAP not activated\?"
+        ):
+            self.ldap.get_user_infos("SOME-OTHER-DOMAIN", [USERNAME])
+
+
+class TestLdapConnectorPooled(TestCase):
+    """Tests for LdapConnector with pooled connections."""
+
+    def setUp(self):
+        super().setUp()
+        reset_connection_pool()
+        self.setup_calls = 0
+
+        def setup_test_data_server(connection):
+            self.setup_calls += 1
+            for bind_dn, password in (
+                (AUTH_LDAP_BIND_DN, AUTH_LDAP_BIND_PASSWORD),
+                (AUTH_LDAP2_BIND_DN, AUTH_LDAP2_BIND_PASSWORD),
+            ):
+                connection.strategy.add_entry(
+                    bind_dn, {"sAMAccountName": "admin", "userPassword": password}
+                )
+            connection.strategy.add_entry(
+                "cn=user,ou=test," + AUTH_LDAP_USER_SEARCH_BASE,
+                {
+                    "objectclass": "person",
+                    "mail": USER_MAIL_INSTITUTE,
+                    "sAMAccountName": USERNAME,
+                },
+            )
+
+        self.setup_test_data_server = setup_test_data_server
+
+    def tearDown(self):
+        reset_connection_pool()
+        super().tearDown()
+
+    def make_connector(self, pooled=True):
+        return LdapConnector(
+            test_mode=True,
+            test_setup_server1=self.setup_test_data_server,
+            test_setup_server2=self.setup_test_data_server,
+            pooled=pooled,
+        )
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_connect_reuses_connections(self):
+        ldap = self.make_connector()
+        ldap.connect()
+        other = self.make_connector()
+        other.connect()
+
+        self.assertIs(ldap.connection1, other.connection1)
+        self.assertIs(ldap.connection2, other.connection2)
+        self.assertEqual(self.setup_calls, 2)
+
+        username, domain = other.get_ldap_username_domain_by_mail(USER_MAIL_INSTITUTE)
+        self.assertEqual(username, USERNAME)
+        self.assertEqual(domain, AUTH_LDAP_USERNAME_DOMAIN)
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_connect_rebinds_closed_connection(self):
+        ldap = self.make_connector()
+        ldap.connect()
+        ldap.connection1.unbind()
+
+        other = self.make_connector()
+        other.connect()
+
+        self.assertIsNot(ldap.connection1, other.connection1)
+        self.assertIs(ldap.connection2, other.connection2)
+        self.assertTrue(other.connection1.bound)
+        self.assertEqual(self.setup_calls, 3)
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_connect_not_pooled(self):
+        ldap = self.make_connector(pooled=False)
+        ldap.connect()
+        other = self.make_connector(pooled=False)
+        other.connect()
+
+        self.assertIsNot(ldap.connection1, other.connection1)
+        self.assertEqual(self.setup_calls, 4)
+
+
+class TestLdapConnectorCached(TestCase):
+    """Tests for LdapConnector with cached lookups."""
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        reset_cache_stats()
+
+        def setup_test_data_server(connection):
+            for bind_dn, password in (
+                (AUTH_LDAP_BIND_DN, AUTH_LDAP_BIND_PASSWORD),
+                (AUTH_LDAP2_BIND_DN, AUTH_LDAP2_BIND_PASSWORD),
+            ):
+                connection.strategy.add_entry(
+                    bind_dn, {"sAMAccountName": "admin", "userPassword": password}
+                )
+            connection.strategy.add_entry(
+                "cn=user,ou=test," + AUTH_LDAP_USER_SEARCH_BASE,
+                {
+                    "objectclass": "person",
+                    "mail": USER_MAIL_INSTITUTE,
+                    "sAMAccountName": USERNAME,
+                },
+            )
+
+        self.ldap = LdapConnector(
+            test_mode=True,
+            test_setup_server1=setup_test_data_server,
+            test_setup_server2=setup_test_data_server,
+            cached=True,
+        )
+
+    def tearDown(self):
+        cache.clear()
+        super().tearDown()
+
+    @override_settings(**LDAP_CACHED_MOCKS)
+    def test_get_ldap_username_domain_by_mail(self):
+        self.ldap.connect()
+
+        for _ in range(3):
+            username, domain = self.ldap.get_ldap_username_domain_by_mail(USER_MAIL_INSTITUTE)
+            self.assertEqual(username, USERNAME)
+            self.assertEqual(domain, AUTH_LDAP_USERNAME_DOMAIN)
+
+        self.assertEqual(get_cache_stats()["mail"], {"hits": 2, "misses": 1})
+
+    @override_settings(**LDAP_CACHED_MOCKS)
+    def test_get_ldap_username_domain_by_mail_served_from_cache(self):
+        self.ldap.connect()
+        self.ldap.get_ldap_username_domain_by_mail(USER_MAIL_INSTITUTE)
+        self.ldap.connection1.unbind()
+
+        username, _domain = self.ldap.get_ldap_username_domain_by_mail(USER_MAIL_INSTITUTE.upper())
+
+        self.assertEqual(username, USERNAME)
+
+    @override_settings(**LDAP_CACHED_MOCKS)
+    def test_get_ldap_username_domain_by_mail_not_found(self):
+        self.ldap.connect()
+        mail = "some@" + INSTITUTE_EMAIL_DOMAINS.split(",")[0]
+
+        for _ in range(2):
+            with self.assertRaisesRegex(LdapUserNotFound, "No user found"):
+                self.ldap.get_ldap_username_domain_by_mail(mail)
+
+        self.assertEqual(get_cache_stats()["mail"], {"hits": 1, "misses": 1})
+
+    @override_settings(**{**LDAP_CACHED_MOCKS, "LDAP_CACHE_NEGATIVE_TIMEOUT": 0})
+    def test_get_ldap_username_domain_by_mail_not_found_negative_timeout(self):
+        self.ldap.connect()
+        mail = "some@" + INSTITUTE_EMAIL_DOMAINS.split(",")[0]
+
+        for _ in range(2):
+            with self.assertRaisesRegex(LdapUserNotFound, "No user found"):
+                self.ldap.get_ldap_username_domain_by_mail(mail)
+
+        self.assertEqual(get_cache_stats()["mail"], {"hits": 0, "misses": 2})
+
+    @override_settings(**LDAP_CACHED_MOCKS)
+    def test_get_user_info(self):
+        self.ldap.connect()
+
+        for _ in range(2):
+            userinfo = self.ldap.get_user_info(f"{USERNAME}@{AUTH_LDAP_USERNAME_DOMAIN}")
+            self.assertEqual(userinfo.mail.value, USER_MAIL_INSTITUTE)
+            self.assertFalse(userinfo.telephoneNumber)
+
+        self.assertEqual(get_cache_stats()["user"], {"hits": 1, "misses": 1})
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test_get_user_info_without_stats(self):
+        self.ldap.connect()
+
+        for _ in range(2):
+            self.ldap.get_user_info(f"{USERNAME}@{AUTH_LDAP_USERNAME_DOMAIN}")
+
+        self.assertEqual(get_cache_stats()["user"], {"hits": 0, "misses": 0})
+
+    @override_settings(**LDAP_CACHED_MOCKS)
+    def test_cache_user_infos(self):
+        self.ldap.connect()
+        infos, _errors = self.ldap.get_user_infos(AUTH_LDAP_USERNAME_DOMAIN, [USERNAME])
+        self.ldap.cache_user_infos(AUTH_LDAP_USERNAME_DOMAIN, infos)
+        self.ldap.connection1.unbind()
+
+        userinfo = self.ldap.get_user_info(f"{USERNAME}@{AUTH_LDAP_USERNAME_DOMAIN}")
+
+        self.assertEqual(userinfo.mail.value, USER_MAIL_INSTITUTE)
+        self.assertEqual(get_cache_stats()["user"], {"hits": 1, "misses": 0})
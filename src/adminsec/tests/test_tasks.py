@@ -1,7 +1,10 @@
 from datetime import timedelta
+from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend
 from django.test import override_settings
 from django.utils import timezone
 from test_plus import TestCase
@@ -13,9 +16,15 @@ from adminsec.tasks import (
     _send_quota_email,
     _sync_ldap,
     clean_db_of_hpc_objects,
+    compact_usage_history,
+    compact_version_history,
+    deliver_email_outbox,
     disable_users_without_consent,
+    refresh_stored_quota_status,
+    send_consent_notification_chunk,
     send_quota_email_red,
     send_quota_email_yellow,
+    start_consent_notification,
 )
 from adminsec.tests.test_ldap import (
     AUTH_LDAP2_BIND_DN,
@@ -35,6 +44,9 @@ from adminsec.tests.test_ldap import (
 from usersec.models import (
     OBJECT_STATUS_ACTIVE,
     OBJECT_STATUS_EXPIRED,
+    USAGE_RESOLUTION_DAILY,
+    USAGE_RESOLUTION_HOURLY,
+    USAGE_RESOLUTION_RAW,
     HpcGroup,
     HpcGroupChangeRequest,
     HpcGroupCreateRequest,
@@ -49,6 +61,8 @@ from usersec.models import (
     HpcUser,
     HpcUserChangeRequest,
     HpcUserCreateRequest,
+    HpcUserVersion,
+    ResourceUsageSample,
 )
 from usersec.tests.factories import (
     HpcGroupChangeRequestFactory,
@@ -65,6 +79,8 @@ from usersec.tests.factories import (
     HpcUserCreateRequestFactory,
     HpcUserDeleteRequestFactory,
     HpcUserFactory,
+    OutboxEmailFactory,
+    ResourceUsageSampleFactory,
     TermsAndConditionsFactory,
 )
 
@@ -151,9 +167,31 @@ class TestSyncLdap(TestCase):
 
     @override_settings(**LDAP_DEFAULT_MOCKS)
     def test__sync_ldap(self):
-        exception_count = _sync_ldap(ldapcon=self.ldap, write=True)
+        report = {}
+        exception_count = _sync_ldap(ldapcon=self.ldap, write=True, report=report)
 
         self.assertEqual(exception_count, {})
+        self.assertEqual(report["users_checked"], 2)
+        self.assertEqual(report["users_changed"], 2)
+        self.assertEqual(report["hpcusers_changed"], 2)
+        self.assertEqual(
+            report["user_fields"],
+            {
+                "first_name": 2,
+                "last_name": 2,
+                "email": 2,
+                "phone": 2,
+                "uid": 2,
+                "name": 2,
+                "is_active": 2,
+            },
+        )
+        self.assertEqual(report["hpcuser_fields"], {"status": 2, "login_shell": 2})
+        self.assertEqual(report["disabled"], [])
+        self.assertEqual(
+            sorted(report["reenabled"]), sorted([self.user1.username, self.user2.username])
+        )
+        self.assertEqual(list(report["elapsed"].keys()), ["connect", "load", "search", "write"])
 
         self.user1.refresh_from_db()
         self.user2.refresh_from_db()
@@ -178,6 +216,20 @@ class TestSyncLdap(TestCase):
         self.assertTrue(self.user2.is_active)
         self.assertEqual(self.hpcuser2.status, "ACTIVE")
 
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test__sync_ldap_refreshes_cache(self):
+        cache.clear()
+        self.ldap.cached = True
+
+        _sync_ldap(ldapcon=self.ldap)
+        self.ldap.connection1.unbind()
+
+        userinfo = self.ldap.get_user_info(self.user1.username)
+        cache.clear()
+
+        self.assertEqual(userinfo.mail.value, USER_MAIL_INSTITUTE)
+        self.assertEqual(userinfo.telephoneNumber.value, "54321")
+
     @override_settings(**LDAP_OTHER_DOMAIN_MOCK)
     def test__sync_ldap_invalid_domain(self):
         exception_count = _sync_ldap(ldapcon=self.ldap, write=True)
@@ -245,6 +297,54 @@ class TestSyncLdap(TestCase):
         self.assertTrue(self.user2.is_active)
         self.assertEqual(self.hpcuser2.status, "ACTIVE")
 
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test__sync_ldap_invalid_username_format(self):
+        self.user1.username = USERNAME
+        self.user1.save()
+
+        exception_count = _sync_ldap(ldapcon=self.ldap, write=True)
+
+        self.assertEqual(
+            exception_count,
+            {f"Username must be in the form username@DOMAIN (violator: '{USERNAME}')": 1},
+        )
+
+        self.user2.refresh_from_db()
+        self.assertEqual(self.user2.email, USER_MAIL_INSTITUTE2)
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test__sync_ldap_no_write(self):
+        exception_count = _sync_ldap(ldapcon=self.ldap)
+
+        self.assertEqual(exception_count, {})
+
+        self.user1.refresh_from_db()
+        self.hpcuser1.refresh_from_db()
+
+        self.assertEqual(self.user1.email, "user1@wrong.mail")
+        self.assertFalse(self.user1.is_active)
+        self.assertEqual(self.hpcuser1.status, "INITIAL")
+
+    @override_settings(**LDAP_DEFAULT_MOCKS)
+    def test__sync_ldap_unchanged_not_written(self):
+        _sync_ldap(ldapcon=self.ldap, write=True)
+        self.hpcuser1.refresh_from_db()
+        date_modified = self.hpcuser1.date_modified
+
+        report = {}
+
+        # Only the user query and the prefetch of the HPC users; nothing is written.
+        with self.assertNumQueries(2):
+            exception_count = _sync_ldap(ldapcon=self.ldap, write=True, report=report)
+
+        self.assertEqual(exception_count, {})
+        self.assertEqual(report["users_checked"], 2)
+        self.assertEqual(report["users_changed"], 0)
+        self.assertEqual(report["hpcusers_changed"], 0)
+        self.assertEqual(report["user_fields"], {})
+        self.hpcuser1.refresh_from_db()
+        self.assertEqual(self.hpcuser1.date_modified, date_modified)
+
 
 class TestSendQuotaEmail(TestCase):
     """Tests for _send_quota_email."""
@@ -310,6 +410,15 @@ class TestSendQuotaEmail(TestCase):
         self.hpc_project.members.add(self.hpc_owner)
         self.hpc_project.get_latest_version().members.add(self.hpc_owner)
 
+    def test_refresh_stored_quota_status(self):
+        cache.clear()
+        refresh_stored_quota_status()
+
+        self.assertIsNone(refresh_stored_quota_status())
+
+        with self.settings(QUOTA_WARNING_THRESHOLD=80, QUOTA_WARNING_ABSOLUTE=10**6):
+            self.assertIn("usersec.HpcGroup", refresh_stored_quota_status())
+
     def test_generate_quota_reports(self):
         expected = {
             "users": {o: o.generate_quota_report() for o in [self.hpc_owner, self.hpc_member]},
@@ -319,11 +428,31 @@ class TestSendQuotaEmail(TestCase):
         reports = _generate_quota_reports()
         self.assertEqual(reports, expected)
 
+    def test_generate_quota_reports_status(self):
+        expected = {
+            "users": {o: o.generate_quota_report() for o in [self.hpc_owner]},
+            "projects": {o: o.generate_quota_report() for o in [self.hpc_project]},
+            "groups": {},
+        }
+        reports = _generate_quota_reports(HpcQuotaStatus.RED)
+        self.assertEqual(reports, expected)
+
     @override_settings(SEND_QUOTA_EMAILS=True)
     def test__send_quota_email_red(self):
         _send_quota_email(HpcQuotaStatus.RED)
         self.assertEqual(len(mail.outbox), 2)
 
+    @override_settings(SEND_QUOTA_EMAILS=True)
+    def test__send_quota_email_summary(self):
+        summary = _send_quota_email(HpcQuotaStatus.RED)
+        self.assertEqual(summary["sent"], 2)
+        self.assertEqual(summary["failed"], [])
+
+    def test__send_quota_email_dry_run(self):
+        summary = _send_quota_email(HpcQuotaStatus.RED, dry_run=True)
+        self.assertEqual(len(summary["messages"]), 2)
+        self.assertEqual(len(mail.outbox), 0)
+
     @override_settings(SEND_QUOTA_EMAILS=True)
     def test__send_quota_email_red_with_delegate(self):
         self.hpc_project.delegate = self.hpc_member
@@ -484,6 +613,24 @@ class DisableUsersWithoutConsent(TestCase):
 
         self.assertEqual(User.objects.filter(is_active=False).count(), 0)
 
+    def test_disable_users_without_consent_summary(self):
+        self.terms_all = TermsAndConditionsFactory(
+            date_published=timezone.now() - timedelta(days=40)
+        )
+
+        with patch("adminsec.tasks.DISABLE_USERS_BATCH_SIZE", 1):
+            summary = disable_users_without_consent()
+
+        self.assertEqual(summary, {"users": 2, "hpcusers": 1})
+        self.hpc_user1.refresh_from_db()
+        self.assertEqual(self.hpc_user1.current_version, 2)
+        self.assertEqual(self.hpc_user1.get_latest_version().status, OBJECT_STATUS_EXPIRED)
+
+        # Nothing left to change on the next run
+        self.assertEqual(disable_users_without_consent(), {"users": 0, "hpcusers": 0})
+        self.hpc_user1.refresh_from_db()
+        self.assertEqual(self.hpc_user1.current_version, 2)
+
 
 class CleanDbOfHpcObjects(TestCase):
     """Tests for clean_db_of_hpc_objects."""
@@ -593,3 +740,165 @@ class CleanDbOfHpcObjects(TestCase):
         self.assertEqual(HpcProjectInvitation.objects.count(), 0)
         self.assertEqual(HpcGroupInvitation.objects.count(), 0)
         self.assertEqual(User.objects.count(), 2)
+
+
+class CompactUsageHistory(TestCase):
+    """Tests for compact_usage_history."""
+
+    def test_compact_usage_history(self):
+        ResourceUsageSampleFactory(date=timezone.now() - timedelta(days=30))
+        ResourceUsageSampleFactory(date=timezone.now())
+
+        created = compact_usage_history()
+
+        self.assertEqual(created, {USAGE_RESOLUTION_HOURLY: 1, USAGE_RESOLUTION_DAILY: 0})
+        self.assertEqual(
+            sorted(ResourceUsageSample.objects.values_list("resolution", flat=True)),
+            [USAGE_RESOLUTION_HOURLY, USAGE_RESOLUTION_RAW],
+        )
+
+
+class CompactVersionHistory(TestCase):
+    """Tests for compact_version_history."""
+
+    def test_compact_version_history(self):
+        hpcuser = HpcUserFactory()
+
+        for _ in range(3):
+            hpcuser.save_with_version()
+
+        HpcUserVersion.objects.update(date_created=timezone.now() - timedelta(days=365))
+
+        deleted = compact_version_history()
+
+        self.assertEqual(deleted["HpcUser"], 2)
+        self.assertEqual(deleted["HpcGroup"], 0)
+        self.assertEqual(
+            list(hpcuser.version_history.order_by("version").values_list("version", flat=True)),
+            [1, 4],
+        )
+
+
+class DeliverEmailOutbox(TestCase):
+    """Tests for deliver_email_outbox."""
+
+    def test_deliver_email_outbox(self):
+        OutboxEmailFactory()
+
+        summary = deliver_email_outbox()
+
+        self.assertEqual(summary, {"sent": 1, "retried": 0, "failed": 0})
+        self.assertEqual(len(mail.outbox), 1)
+
+
+@override_settings(CONSENT_NOTIFICATION_CHUNK_SIZE=2)
+class ConsentNotification(TestCase):
+    """Tests for start_consent_notification and send_consent_notification_chunk."""
+
+    def setUp(self):
+        self.users = [self.make_user(f"user{i}") for i in range(3)]
+        self.user_hpcadmin = self.make_user("hpcadmin")
+        self.user_hpcadmin.is_hpcadmin = True
+        self.user_hpcadmin.save()
+
+    def test_start_consent_notification(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            job = start_consent_notification(timezone.now())
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(job.total, 3)
+        self.assertEqual(
+            list(job.chunk_set.order_by("pk").values_list("first_user_id", "last_user_id")),
+            [(self.users[0].pk, self.users[1].pk), (self.users[2].pk, self.users[2].pk)],
+        )
+        job.refresh_from_db()
+        self.assertEqual(job.sent, 3)
+        self.assertEqual(job.get_progress(), 100)
+        self.assertTrue(job.is_done())
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), sorted(u.email for u in self.users))
+
+    def test_send_consent_notification_chunk_idempotent(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            job = start_consent_notification(timezone.now())
+
+        chunk = job.chunk_set.order_by("pk").first()
+        send_consent_notification_chunk(chunk.pk)
+        send_consent_notification_chunk(chunk.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(job.sent, 2)
+        self.assertEqual(job.get_progress(), 66)
+        self.assertFalse(job.is_done())
+
+    @override_settings(EMAIL_BATCH_SIZE=1)
+    def test_send_consent_notification_chunk_retry(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            job = start_consent_notification(timezone.now())
+
+        chunk = job.chunk_set.order_by("pk").first()
+
+        with patch(
+            "adminsec.tasks.send_messages",
+            side_effect=[{"failed": []}, RuntimeError("Interrupted")],
+        ):
+            with self.assertRaises(RuntimeError):
+                send_consent_notification_chunk(chunk.pk)
+
+        chunk.refresh_from_db()
+        self.assertEqual(chunk.last_sent_user_id, self.users[0].pk)
+        self.assertIsNone(chunk.lease_until)
+        self.assertIsNone(chunk.date_done)
+
+        send_consent_notification_chunk(chunk.pk)
+
+        chunk.refresh_from_db()
+        job.refresh_from_db()
+        self.assertEqual([m.to[0] for m in mail.outbox], [self.users[1].email])
+        self.assertEqual(chunk.sent, 2)
+        self.assertEqual(job.sent, 2)
+        self.assertIsNotNone(chunk.date_done)
+
+    def test_send_consent_notification_chunk_claimed(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            job = start_consent_notification(timezone.now())
+
+        chunk = job.chunk_set.order_by("pk").first()
+        chunk.lease_until = timezone.now() + timedelta(minutes=5)
+        chunk.save()
+
+        send_consent_notification_chunk(chunk.pk)
+
+        self.assertEqual(len(mail.outbox), 0)
+        chunk.lease_until = timezone.now() - timedelta(minutes=5)
+        chunk.save()
+
+        send_consent_notification_chunk(chunk.pk)
+
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_consent_notification_chunk_consented(self):
+        self.users[0].consented_to_terms = True
+        self.users[0].save()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            job = start_consent_notification(timezone.now())
+
+        job.refresh_from_db()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(job.sent, 2)
+        self.assertTrue(job.is_done())
+        self.assertEqual(job.get_progress(), 100)
+
+    def test_send_consent_notification_chunk_failed(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            job = start_consent_notification(timezone.now())
+
+        with patch.object(EmailBackend, "send_messages", side_effect=OSError("Unavailable")):
+            for chunk in job.chunk_set.all():
+                send_consent_notification_chunk(chunk.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.failed, 3)
+        self.assertTrue(job.is_done())
+        self.assertEqual(job.sent, 0)
@@ -5,10 +5,12 @@ from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.messages import get_messages
 from django.core import mail
+from django.core.cache import cache
 from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+from adminsec.tasks import refresh_stored_quota_status
 from adminsec.views import (
     convert_to_posix,
     django_to_hpc_username,
@@ -21,6 +23,7 @@ from usersec.models import (
     REQUEST_STATUS_RETRACTED,
     TERMS_AUDIENCE_PI,
     TERMS_AUDIENCE_USER,
+    ConsentNotificationJob,
     HpcGroup,
     HpcGroupCreateRequest,
     HpcGroupInvitation,
@@ -2312,11 +2315,12 @@ class TestTermsAndConditionsPublishView(TestViewBase):
             self.assertTrue(self.user.consented_to_terms)
             self.assertTrue(self.user_owner.consented_to_terms)
 
-            response = self.client.post(
-                reverse(
-                    "adminsec:termsandconditions-publish",
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse(
+                        "adminsec:termsandconditions-publish",
+                    )
                 )
-            )
 
             self.assertRedirects(
                 response,
@@ -2344,6 +2348,25 @@ class TestTermsAndConditionsPublishView(TestViewBase):
                 .count(),
             )
 
+            job = ConsentNotificationJob.objects.get()
+            self.assertEqual(job.date_published, self.terms.date_published)
+            self.assertEqual(job.sent, len(mail.outbox))
+            self.assertTrue(job.is_done())
+
+    def test_post_progress(self):
+        with self.login(self.user_hpcadmin):
+            with self.captureOnCommitCallbacks(execute=False):
+                self.client.post(reverse("adminsec:termsandconditions-publish"))
+
+            self.assertEqual(len(mail.outbox), 0)
+
+            response = self.client.get(reverse("adminsec:termsandconditions-list"))
+
+            job = response.context["consent_notification"]
+            self.assertFalse(job.is_done())
+            self.assertEqual(job.get_progress(), 0)
+            self.assertContains(response, f"0 sent,\n  0 failed\n  of {job.total} users.")
+
 
 class TestFunctions(TestViewBase):
     """Test non-view related functions."""
@@ -2393,3 +2416,53 @@ class TestFunctions(TestViewBase):
     def test_convert_to_posix(self):
         name = "LeéèÄAöo"
         self.assertEqual(convert_to_posix(name), "LeeeAAoo")
+
+
+class TestOverQuotaView(TestViewBase):
+    """Tests for OverQuotaView."""
+
+    def test_get(self):
+        self.hpc_owner.resources_used = dict(self.hpc_owner.resources_requested)
+        self.hpc_owner.save()
+        self.hpc_group.resources_used = {
+            tier: 0.95 * value for tier, value in self.hpc_group.resources_requested.items()
+        }
+        self.hpc_group.save()
+
+        with self.login(self.user_hpcadmin):
+            response = self.client.get(reverse("adminsec:storage-overquota"))
+
+            self.assertEqual(response.status_code, 200)
+            sections = dict(response.context["sections"])
+            self.assertEqual(list(sections["Users"]), [self.hpc_owner])
+            self.assertEqual(list(sections["Groups"]), [self.hpc_group])
+            self.assertEqual(list(sections["Projects"]), [])
+            self.assertContains(response, "RED")
+            self.assertContains(response, "YELLOW")
+
+    def test_get_thresholds_changed_refreshed(self):
+        cache.clear()
+        self.hpc_group.resources_used = {
+            tier: 0.85 * value for tier, value in self.hpc_group.resources_requested.items()
+        }
+        self.hpc_group.save()
+
+        with self.login(self.user_hpcadmin):
+            response = self.client.get(reverse("adminsec:storage-overquota"))
+            self.assertEqual(list(dict(response.context["sections"])["Groups"]), [])
+
+            with self.settings(QUOTA_WARNING_THRESHOLD=80, QUOTA_WARNING_ABSOLUTE=10**6):
+                response = self.client.get(reverse("adminsec:storage-overquota"))
+                # The view only reads the stored status
+                self.assertEqual(list(dict(response.context["sections"])["Groups"]), [])
+
+                refresh_stored_quota_status()
+                response = self.client.get(reverse("adminsec:storage-overquota"))
+
+            self.assertEqual(list(dict(response.context["sections"])["Groups"]), [self.hpc_group])
+
+    def test_get_fail(self):
+        with self.login(self.user):
+            response = self.client.get(reverse("adminsec:storage-overquota"))
+
+            self.assertRedirects(response, reverse("home"), fetch_redirect_response=False)
@@ -4,16 +4,30 @@ We mainly test the permissions here, the rest is mostly of smoke test
 quality.
 """
 
+import json
+from datetime import timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.test import APIClient
 from test_plus import TestCase
 
-from usersec.models import REQUEST_STATUS_ACTIVE
+from usersec.models import (
+    REQUEST_STATUS_ACTIVE,
+    HpcGroup,
+    HpcProject,
+    HpcQuotaStatus,
+    HpcUser,
+    ResourceUsageSample,
+)
 from usersec.tests.factories import (
     HpcGroupCreateRequestFactory,
     HpcGroupFactory,
     HpcProjectCreateRequestFactory,
     HpcProjectFactory,
     HpcUserFactory,
+    ResourceUsageSampleFactory,
 )
 
 
@@ -57,10 +71,34 @@ class ApiTestCase(TestCase):
             status=REQUEST_STATUS_ACTIVE,
         )
 
+    def assert_constant_queries(self, url_name):
+        """Assert that the number of queries does not grow with more objects."""
+        with self.login(self.user_admin):
+            with CaptureQueriesContext(connection) as queries:
+                self.get(url_name)
+            self.response_200()
+
+            for _ in range(3):
+                group = HpcGroupFactory()
+                hpcuser = HpcUserFactory(primary_group=group)
+                group.owner = hpcuser
+                group.delegate = hpcuser
+                group.save()
+                project = HpcProjectFactory(group=group, delegate=hpcuser)
+                project.members.add(hpcuser, self.hpcuser_user)
+
+            with self.assertNumQueries(len(queries)):
+                self.get(url_name)
+            self.response_200()
+
 
 class TestHpcUserListApiView(ApiTestCase):
     """Tests for the HpcUserListApiView."""
 
+    def test_get_num_queries(self):
+        """Test the number of queries does not depend on the number of objects."""
+        self.assert_constant_queries("adminsec:api-hpcuser-list")
+
     def test_get_succeed(self):
         """Test the GET method (staff users can do)."""
         for user in [self.user_staff, self.user_admin]:
@@ -85,6 +123,41 @@ class TestHpcUserListApiView(ApiTestCase):
                 else:
                     self.response_403()
 
+    def test_get_not_modified(self):
+        """Test the GET method with If-None-Match."""
+        with self.login(self.user_staff):
+            self.get("adminsec:api-hpcuser-list")
+            etag = self.last_response["ETag"]
+
+            with self.assertNumQueries(5):
+                self.get("adminsec:api-hpcuser-list", extra={"HTTP_IF_NONE_MATCH": etag})
+            self.assertEqual(self.last_response.status_code, 304)
+            self.assertEqual(self.last_response["ETag"], etag)
+            self.assertEqual(self.last_response.content, b"")
+
+            self.get("adminsec:api-hpcuser-list", data={"page_size": 1})
+            self.assertNotEqual(self.last_response["ETag"], etag)
+
+            self.hpcuser_user.save()
+            self.get("adminsec:api-hpcuser-list", extra={"HTTP_IF_NONE_MATCH": etag})
+            self.response_200()
+            self.assertNotEqual(self.last_response["ETag"], etag)
+
+    def test_get_not_modified_user_changed(self):
+        """Test the GET method with If-None-Match after the Django user of an HPC user changed."""
+        with self.login(self.user_staff):
+            self.get("adminsec:api-hpcuser-list")
+            etag = self.last_response["ETag"]
+
+            self.hpcuser_user.user.name = "Changed Name"
+            self.hpcuser_user.user.save()
+            self.get("adminsec:api-hpcuser-list", extra={"HTTP_IF_NONE_MATCH": etag})
+            self.response_200()
+            self.assertNotEqual(self.last_response["ETag"], etag)
+            self.assertIn(
+                "Changed Name", [user["full_name"] for user in self.last_response.json()["results"]]
+            )
+
 
 class TestHpcUserRetrieveUpdateApiView(ApiTestCase):
     """Tests for the HpcUserRetrieveUpdateApiView."""
@@ -112,6 +185,23 @@ class TestHpcUserRetrieveUpdateApiView(ApiTestCase):
                 )
                 self.response_200()
 
+    def test_patch_quota_status(self):
+        """Test the PATCH method updates the quota status."""
+        data = {
+            "resources_used": {"tier1_home": self.hpcuser_user.resources_requested["tier1_home"]}
+        }
+        with self.login(self.user_admin):
+            self.patch(
+                "adminsec:api-hpcuser-retrieveupdate",
+                hpcuser=self.hpcuser_user.uuid,
+                data=data,
+                extra={"format": "json"},
+            )
+            self.response_200()
+
+        self.hpcuser_user.refresh_from_db()
+        self.assertEqual(self.hpcuser_user.get_quota_status(), HpcQuotaStatus.RED)
+
     def test_patch_fail(self):
         """Test the PATCH method (non-staff cannot do)."""
         for user in [self.user_user]:
@@ -135,6 +225,10 @@ class TestHpcUserRetrieveUpdateApiView(ApiTestCase):
 class TestHpcGroupListApiView(ApiTestCase):
     """Tests for the HpcGroupListApiView."""
 
+    def test_get_num_queries(self):
+        """Test the number of queries does not depend on the number of objects."""
+        self.assert_constant_queries("adminsec:api-hpcgroup-list")
+
     def test_get_succeed(self):
         """Test the GET method (staff users can do)."""
         for user in [self.user_staff, self.user_admin]:
@@ -188,6 +282,26 @@ class TestHpcGroupRetrieveUpdateApiView(ApiTestCase):
                 )
                 self.response_200()
 
+    def test_patch_no_version(self):
+        """Test the PATCH method of fields other than the used resources creates no version."""
+        versions = self.hpcuser_group.version_history.count()
+
+        with self.login(self.user_admin):
+            self.patch(
+                "adminsec:api-hpcgroup-retrieveupdate",
+                hpcgroup=self.hpcuser_group.uuid,
+                data={"gid": 4321},
+                extra={"format": "json"},
+            )
+            self.response_200()
+
+        self.hpcuser_group.refresh_from_db()
+        self.assertEqual(self.hpcuser_group.gid, 4321)
+        self.assertEqual(self.hpcuser_group.version_history.count(), versions)
+        self.assertFalse(
+            ResourceUsageSample.objects.filter(object_uuid=self.hpcuser_group.uuid).exists()
+        )
+
     def test_patch_fail(self):
         """Test the PATCH method (non-staff cannot do)."""
         for user in [self.user_user]:
@@ -215,6 +329,10 @@ class TestHpcGroupRetrieveUpdateApiView(ApiTestCase):
 class TestHpcProjectListApiView(ApiTestCase):
     """Tests for the HpcProjectListApiView."""
 
+    def test_get_num_queries(self):
+        """Test the number of queries does not depend on the number of objects."""
+        self.assert_constant_queries("adminsec:api-hpcproject-list")
+
     def test_get_succeed(self):
         """Test the GET method (staff users can do)."""
         for user in [self.user_staff, self.user_admin]:
@@ -625,3 +743,356 @@ class TestHpcProjectCreateRequestRetrieveUpdateApiView(ApiTestCase):
                     self.response_405()
                 else:
                     self.response_403()
+
+
+class TestHpcaccessStateApiView(ApiTestCase):
+    """Tests for the HpcaccessStateApiView."""
+
+    def test_get_num_queries(self):
+        """Test the number of queries does not depend on the number of objects."""
+        self.assert_constant_queries("adminsec:api-hpcaccess-state")
+
+    def test_get_succeed(self):
+        """Test the GET method (staff users and HPC admins can do)."""
+        for user in [self.user_staff, self.user_admin, self.user_hpcadmin]:
+            with self.login(user):
+                self.get("adminsec:api-hpcaccess-state")
+                self.response_200()
+                self.assertEqual(
+                    set(self.last_response.json()["hpc_users"]), {str(self.hpcuser_user.uuid)}
+                )
+
+    def test_get_fail(self):
+        """Test the GET method (normal users cannot do)."""
+        with self.login(self.user_user):
+            self.get("adminsec:api-hpcaccess-state")
+            self.response_403()
+
+    def test_get_not_modified(self):
+        """Test the GET method with If-None-Match."""
+        with self.login(self.user_hpcadmin):
+            self.get("adminsec:api-hpcaccess-state")
+            etag = self.last_response["ETag"]
+
+            self.get("adminsec:api-hpcaccess-state", extra={"HTTP_IF_NONE_MATCH": etag})
+            self.assertEqual(self.last_response.status_code, 304)
+
+            self.hpcuser_project.members.add(self.hpcuser_user)
+            self.get("adminsec:api-hpcaccess-state", extra={"HTTP_IF_NONE_MATCH": etag})
+            self.response_200()
+
+            HpcGroupFactory()
+            self.get("adminsec:api-hpcaccess-state", extra={"HTTP_IF_NONE_MATCH": "*"})
+            self.assertEqual(self.last_response.status_code, 304)
+
+
+class TestHpcaccessStateStreamApiView(ApiTestCase):
+    """Tests for the HpcaccessStateStreamApiView."""
+
+    def _get_stream(self):
+        self.get("adminsec:api-hpcaccess-state-stream")
+        self.response_200()
+        return json.loads(b"".join(self.last_response.streaming_content))
+
+    def test_get_succeed(self):
+        """Test the GET method returns the same document as the non-streaming view."""
+        self.hpcuser_project.members.add(self.hpcuser_user)
+        for user in [self.user_staff, self.user_admin, self.user_hpcadmin]:
+            with self.login(user):
+                self.get("adminsec:api-hpcaccess-state")
+                expected = self.last_response.json()
+                self.assertEqual(self._get_stream(), expected)
+
+    def test_get_num_queries(self):
+        """Test the number of queries does not depend on the number of objects."""
+        with self.login(self.user_admin):
+            with self.assertNumQueries(8):
+                self._get_stream()
+            for _ in range(3):
+                project = HpcProjectFactory(group=self.hpcuser_group)
+                project.members.add(HpcUserFactory(primary_group=self.hpcuser_group))
+            with self.assertNumQueries(8):
+                self._get_stream()
+
+    def test_get_fail(self):
+        """Test the GET method (normal users cannot do)."""
+        with self.login(self.user_user):
+            self.get("adminsec:api-hpcaccess-state-stream")
+            self.response_403()
+
+
+class TestHpcaccessStateDeltaApiView(ApiTestCase):
+    """Tests for the HpcaccessStateDeltaApiView."""
+
+    def setUp(self):
+        super().setUp()
+        past = timezone.now() - timedelta(days=1)
+        for model in (HpcUser, HpcGroup, HpcProject):
+            model.objects.update(date_modified=past)
+        self.since = (past + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+    def test_get_all(self):
+        """Test the GET method without cursor returns all objects."""
+        with self.login(self.user_hpcadmin):
+            self.get("adminsec:api-hpcaccess-state-delta")
+            self.response_200()
+            data = self.last_response.json()
+            self.assertEqual(set(data["hpc_users"]), {str(self.hpcuser_user.uuid)})
+            self.assertEqual(set(data["hpc_groups"]), {str(self.hpcuser_group.uuid)})
+            self.assertEqual(set(data["hpc_projects"]), {str(self.hpcuser_project.uuid)})
+            self.assertEqual(
+                data["deleted"], {"hpc_users": [], "hpc_groups": [], "hpc_projects": []}
+            )
+            self.assertTrue(data["cursor"])
+
+    def test_get_since(self):
+        """Test the GET method with cursor only returns changed objects."""
+        with self.login(self.user_hpcadmin):
+            self.get("adminsec:api-hpcaccess-state-delta", data={"since": self.since})
+            self.response_200()
+            data = self.last_response.json()
+            self.assertEqual(data["hpc_users"], {})
+            self.assertEqual(data["hpc_groups"], {})
+            self.assertEqual(data["hpc_projects"], {})
+
+            self.hpcuser_user.delete_with_version()
+            self.hpcuser_project.members.add(self.hpcuser_user)
+
+            self.get("adminsec:api-hpcaccess-state-delta", data={"since": data["cursor"]})
+            self.response_200()
+            data = self.last_response.json()
+            self.assertEqual(set(data["hpc_users"]), {str(self.hpcuser_user.uuid)})
+            self.assertEqual(data["hpc_users"][str(self.hpcuser_user.uuid)]["status"], "DELETED")
+            self.assertEqual(data["hpc_groups"], {})
+            self.assertEqual(set(data["hpc_projects"]), {str(self.hpcuser_project.uuid)})
+
+    def test_get_since_hard_deleted(self):
+        """Test the GET method with cursor reports objects removed from the database."""
+        project_uuid = self.hpcuser_project.uuid
+        self.hpcuser_project.delete()
+
+        with self.login(self.user_hpcadmin):
+            self.get("adminsec:api-hpcaccess-state-delta", data={"since": self.since})
+            self.response_200()
+            data = self.last_response.json()
+            self.assertEqual(data["hpc_projects"], {})
+            self.assertEqual(
+                data["deleted"],
+                {"hpc_users": [], "hpc_groups": [], "hpc_projects": [str(project_uuid)]},
+            )
+
+    def test_get_since_user_changed(self):
+        """Test the GET method with cursor reports HPC users whose Django user changed."""
+        user = self.hpcuser_user.user
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
+
+        with self.login(self.user_hpcadmin):
+            self.get("adminsec:api-hpcaccess-state-delta", data={"since": self.since})
+            self.response_200()
+            self.assertEqual(self.last_response.json()["hpc_users"], {})
+
+            user.email = "changed@example.com"
+            user.save()
+
+            self.get("adminsec:api-hpcaccess-state-delta", data={"since": self.since})
+            self.response_200()
+            data = self.last_response.json()
+            self.assertEqual(set(data["hpc_users"]), {str(self.hpcuser_user.uuid)})
+            self.assertEqual(
+                data["hpc_users"][str(self.hpcuser_user.uuid)]["email"], "changed@example.com"
+            )
+
+    def test_get_invalid_cursor(self):
+        """Test the GET method with an invalid cursor."""
+        with self.login(self.user_hpcadmin):
+            for since in ("invalid", "2024-13-01T00:00:00Z", "2024-01-01T00:00:00"):
+                self.get("adminsec:api-hpcaccess-state-delta", data={"since": since})
+                self.response_400()
+
+    def test_get_fail(self):
+        """Test the GET method (normal users cannot do)."""
+        with self.login(self.user_user):
+            self.get("adminsec:api-hpcaccess-state-delta")
+            self.response_403()
+
+
+class TestResourceUsageHistoryApiView(ApiTestCase):
+    """Tests for the ResourceUsageHistoryApiView."""
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+        self.samples = [
+            ResourceUsageSampleFactory(
+                object_uuid=self.hpcuser_group.uuid,
+                tier=tier,
+                used=days,
+                date=self.now - timedelta(days=days),
+            )
+            for tier in ("tier1_work", "tier1_scratch")
+            for days in (3, 2, 1)
+        ]
+        ResourceUsageSampleFactory(object_uuid=self.hpcuser_project.uuid)
+
+    def _get(self, **data):
+        self.get("adminsec:api-usagehistory-list", object_uuid=self.hpcuser_group.uuid, data=data)
+        self.response_200()
+        return [(r["tier"], r["used"]) for r in self.last_response.json()["results"]]
+
+    def test_get(self):
+        """Test the GET method returns the samples of the object oldest first."""
+        with self.login(self.user_hpcadmin):
+            self.assertEqual(
+                self._get(tier="tier1_work"),
+                [("tier1_work", 3.0), ("tier1_work", 2.0), ("tier1_work", 1.0)],
+            )
+            self.assertEqual(len(self._get()), 6)
+
+    def test_get_range(self):
+        """Test the GET method limited to a date range."""
+        start = (self.now - timedelta(days=2)).isoformat()
+        end = (self.now - timedelta(days=1)).isoformat()
+        with self.login(self.user_hpcadmin):
+            self.assertEqual(
+                sorted(self._get(start=start, end=end)),
+                [("tier1_scratch", 2.0), ("tier1_work", 2.0)],
+            )
+
+    def test_get_invalid_date(self):
+        """Test the GET method with an invalid date."""
+        with self.login(self.user_hpcadmin):
+            for start in ("invalid", "2024-01-01T00:00:00"):
+                self.get(
+                    "adminsec:api-usagehistory-list",
+                    object_uuid=self.hpcuser_group.uuid,
+                    data={"start": start},
+                )
+                self.response_400()
+
+    def test_get_fail(self):
+        """Test the GET method (normal users cannot do)."""
+        with self.login(self.user_user):
+            self.get("adminsec:api-usagehistory-list", object_uuid=self.hpcuser_group.uuid)
+            self.response_403()
+
+    def test_patch_records_usage(self):
+        """Test that reported usage is appended to the history."""
+        data = {"resources_used": {"tier1_work": 0.7, "tier1_scratch": 0.2}}
+        with self.login(self.user_admin):
+            for _ in range(2):
+                self.patch(
+                    "adminsec:api-hpcproject-retrieveupdate",
+                    hpcproject=self.hpcuser_project.uuid,
+                    data=data,
+                    extra={"format": "json"},
+                )
+                self.response_200()
+
+        samples = ResourceUsageSample.objects.filter(object_uuid=self.hpcuser_project.uuid)
+        self.assertEqual(samples.filter(object_type="hpcproject", tier="tier1_work").count(), 2)
+
+    def test_patch_without_usage(self):
+        """Test that updates without usage do not touch the history."""
+        with self.login(self.user_admin):
+            self.patch(
+                "adminsec:api-hpcproject-retrieveupdate",
+                hpcproject=self.hpcuser_project.uuid,
+                data={},
+            )
+            self.response_200()
+
+        self.assertEqual(
+            ResourceUsageSample.objects.filter(object_uuid=self.hpcuser_project.uuid).count(), 1
+        )
+
+
+class TestResourceUsageBulkUpdateApiView(ApiTestCase):
+    """Tests for the ResourceUsageBulkUpdateApiView."""
+
+    def _post(self, data):
+        self.post("adminsec:api-resourceusage-bulkupdate", data=data, extra={"format": "json"})
+
+    def test_post(self):
+        """Test the POST method updates all objects in one go."""
+        unknown = "00000000-0000-0000-0000-000000000000"
+        data = {
+            "hpc_users": {str(self.hpcuser_user.uuid): {"tier1_home": 1.0}},
+            "hpc_groups": {
+                str(self.hpcuser_group.uuid): {"tier1_work": 0.95},
+                unknown: {"tier1_work": 1.0},
+            },
+            "hpc_projects": {
+                str(self.hpcuser_project.uuid): {"tier1_work": "many"},
+                "invalid": {"tier1_work": 1.0},
+            },
+        }
+        with self.login(self.user_hpcadmin):
+            with self.assertNumQueries(22):
+                self._post(data)
+            self.response_200()
+            results = self.last_response.json()
+
+        self.assertEqual(results["hpc_users"], {str(self.hpcuser_user.uuid): {"status": "updated"}})
+        self.assertEqual(
+            results["hpc_groups"],
+            {str(self.hpcuser_group.uuid): {"status": "updated"}, unknown: {"status": "not_found"}},
+        )
+        project_result = results["hpc_projects"][str(self.hpcuser_project.uuid)]
+        self.assertEqual(project_result["status"], "invalid")
+        self.assertIn("tier1_work", project_result["errors"])
+        self.assertEqual(results["hpc_projects"]["invalid"]["status"], "invalid")
+
+        self.hpcuser_user.refresh_from_db()
+        self.assertEqual(self.hpcuser_user.resources_used, {"tier1_home": 1.0})
+        self.assertEqual(self.hpcuser_user.get_quota_status(), HpcQuotaStatus.RED)
+        self.hpcuser_group.refresh_from_db()
+        self.assertEqual(self.hpcuser_group.resources_used, {"tier1_work": 0.95})
+        self.assertEqual(self.hpcuser_group.get_quota_status(), HpcQuotaStatus.YELLOW)
+        self.assertEqual(self.hpcuser_group.version_history.count(), 1)
+        self.assertEqual(
+            ResourceUsageSample.objects.filter(object_uuid=self.hpcuser_group.uuid).count(), 1
+        )
+        self.assertFalse(
+            ResourceUsageSample.objects.filter(object_uuid=self.hpcuser_project.uuid).exists()
+        )
+
+    def test_post_same_versions_as_patch(self):
+        """Test the POST method leaves the same version history as a PATCH of the object."""
+        resources_used = {"tier1_work": 0.95}
+
+        for policy in ("version", "coalesce", "skip"):
+            patched = HpcGroupFactory()
+            posted = HpcGroupFactory()
+
+            with self.settings(VERSION_USAGE_POLICY=policy), self.login(self.user_admin):
+                self.patch(
+                    "adminsec:api-hpcgroup-retrieveupdate",
+                    hpcgroup=patched.uuid,
+                    data={"resources_used": resources_used},
+                    extra={"format": "json"},
+                )
+                self.response_200()
+                self._post({"hpc_groups": {str(posted.uuid): resources_used}})
+                self.response_200()
+
+            histories = [
+                list(
+                    obj.version_history.order_by("version").values_list("version", "resources_used")
+                )
+                for obj in (patched, posted)
+            ]
+            self.assertEqual(histories[0], histories[1], policy)
+            self.assertEqual(len(histories[0]), 2 if policy == "version" else 1, policy)
+
+    def test_post_invalid(self):
+        """Test the POST method with a malformed request."""
+        with self.login(self.user_hpcadmin):
+            self._post({"hpc_users": ["invalid"]})
+            self.response_400()
+
+    def test_post_fail(self):
+        """Test the POST method (normal users cannot do)."""
+        with self.login(self.user_user):
+            self._post({})
+            self.response_403()
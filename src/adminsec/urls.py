@@ -278,6 +278,11 @@ urlpatterns_ui = [
         view=views.StorageByHpcGroupView.as_view(),
         name="storage-hpcgroup",
     ),
+    path(
+        "storage/overquota",
+        view=views.OverQuotaView.as_view(),
+        name="storage-overquota",
+    ),
 ]
 
 urlpatterns_api = [
@@ -332,6 +337,28 @@ urlpatterns_api = [
         view=views_api.HpcaccessStateApiView.as_view(),
         name="api-hpcaccess-state",
     ),
+    path(
+        "api/hpcaccessstate/stream/",
+        view=views_api.HpcaccessStateStreamApiView.as_view(),
+        name="api-hpcaccess-state-stream",
+    ),
+    path(
+        "api/hpcaccessstate/delta/",
+        view=views_api.HpcaccessStateDeltaApiView.as_view(),
+        name="api-hpcaccess-state-delta",
+    ),
+    # API endpoints for the resource usage
+    path(
+        "api/resourceusage/",
+        view=views_api.ResourceUsageBulkUpdateApiView.as_view(),
+        name="api-resourceusage-bulkupdate",
+    ),
+    # API endpoints for the usage history
+    path(
+        "api/usagehistory/<uuid:object_uuid>/",
+        view=views_api.ResourceUsageHistoryApiView.as_view(),
+        name="api-usagehistory-list",
+    ),
 ]
 
 urlpatterns = urlpatterns_ui + urlpatterns_api
@@ -43,11 +43,11 @@ from adminsec.email import (
     send_notification_manager_request_approved,
     send_notification_manager_request_denied,
     send_notification_manager_revision_required,
-    send_notification_user_consent,
     send_notification_user_invitation,
     send_notification_user_welcome_mail,
 )
 from adminsec.ldap import LdapConnector
+from adminsec.tasks import start_consent_notification
 from hpc_access.users.models import User
 from usersec.forms import (
     HpcGroupChangeRequestForm,
@@ -60,6 +60,7 @@ from usersec.forms import (
 )
 from usersec.models import (
     OBJECT_STATUS_ACTIVE,
+    ConsentNotificationJob,
     HpcGroup,
     HpcGroupChangeRequest,
     HpcGroupCreateRequest,
@@ -69,6 +70,7 @@ from usersec.models import (
     HpcProjectChangeRequest,
     HpcProjectCreateRequest,
     HpcProjectInvitation,
+    HpcQuotaStatus,
     HpcUser,
     HpcUserChangeRequest,
     HpcUserCreateRequest,
@@ -90,6 +92,7 @@ from usersec.views import (
     MSG_PART_USER_UPDATE,
     MSG_REQUEST_FAILURE,
     HpcPermissionMixin,
+    QuotaReportMixin,
 )
 
 LDAP_ENABLED = settings.ENABLE_LDAP
@@ -196,7 +199,7 @@ class AdminView(HpcPermissionMixin, TemplateView):
         return context
 
 
-class HpcGroupDetailView(HpcPermissionMixin, DetailView):
+class HpcGroupDetailView(HpcPermissionMixin, QuotaReportMixin, DetailView):
     """HPC group view."""
 
     model = HpcGroup
@@ -546,7 +549,7 @@ class HpcUserCreateRequestApproveView(HpcPermissionMixin, DeleteView):
         obj = self.get_object()
 
         try:
-            ldapcon = LdapConnector()
+            ldapcon = LdapConnector(pooled=True, cached=True)
             ldapcon.connect()
             username, domain = ldapcon.get_ldap_username_domain_by_mail(obj.email)
 
@@ -782,7 +785,7 @@ class HpcGroupChangeRequestDenyView(HpcPermissionMixin, DeleteView):
         return HttpResponseRedirect(reverse("adminsec:overview"))
 
 
-class HpcProjectDetailView(HpcPermissionMixin, DetailView):
+class HpcProjectDetailView(HpcPermissionMixin, QuotaReportMixin, DetailView):
     """HpcProjectDetail view."""
 
     model = HpcProject
@@ -1532,6 +1535,9 @@ class TermsAndConditionsListView(HpcPermissionMixin, ListView):
         )
         data["users_consent"] = users.filter(consented_to_terms=True)
         data["users_missing_consent"] = users.filter(consented_to_terms=False)
+        data["consent_notification"] = ConsentNotificationJob.objects.order_by(
+            "-date_created"
+        ).first()
         return data
 
 
@@ -1589,17 +1595,12 @@ class TermsAndConditionsPublishView(HpcPermissionMixin, FormMixin, View):
             return self.form_invalid(form)
 
     def form_valid(self, _form):
-        TermsAndConditions.objects.all().update(date_published=timezone.now())
+        date_published = timezone.now()
+        TermsAndConditions.objects.all().update(date_published=date_published)
         User.objects.all().update(consented_to_terms=False)
 
         if settings.SEND_EMAIL:
-            for user in (
-                User.objects.all()
-                .exclude(is_hpcadmin=True)
-                .exclude(is_superuser=True)
-                .exclude(is_staff=True)
-            ):
-                send_notification_user_consent(user)
+            start_consent_notification(date_published)
 
         return HttpResponseRedirect(self.success_url)
 
@@ -1624,3 +1625,34 @@ class StorageByHpcGroupView(HpcPermissionMixin, ListView):
         ctx = super().get_context_data(*args, **kwargs)
         ctx["object_list"] = self.object_list
         return ctx
+
+
+class OverQuotaView(HpcPermissionMixin, TemplateView):
+    """Users, groups and projects in quota status YELLOW or RED."""
+
+    permission_required = "adminsec.is_hpcadmin"
+    template_name = "adminsec/over_quota.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        filters = {"quota_status__gte": HpcQuotaStatus.YELLOW.value}
+        ordering = ("-quota_status", "pk")
+        context["sections"] = (
+            (
+                "Users",
+                HpcUser.objects.filter(**filters).select_related("user").order_by(*ordering),
+            ),
+            (
+                "Groups",
+                HpcGroup.objects.filter(**filters)
+                .select_related("owner", "delegate")
+                .order_by(*ordering),
+            ),
+            (
+                "Projects",
+                HpcProject.objects.filter(**filters)
+                .select_related("group__owner", "delegate")
+                .order_by(*ordering),
+            ),
+        )
+        return context
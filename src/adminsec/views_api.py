@@ -1,7 +1,14 @@
 """DRF views for the adminsec app."""
 
 import re
-
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import (
     ListAPIView,
@@ -10,21 +17,35 @@ from rest_framework.generics import (
     get_object_or_404,
 )
 from rest_framework.permissions import IsAdminUser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
 from adminsec.constants import (
     RE_FOLDER,
     RE_NAME,
 )
-from adminsec.models import HpcaccessState
+from adminsec.models import HpcaccessState, HpcaccessStateDelta
 from adminsec.permissions_api import IsHpcAdminUser
-from adminsec.serializers import HpcaccessStateSerializer
-from hpc_access.utils.rest_framework import CursorPagination
+from adminsec.serializers import (
+    RESOURCE_USAGE_INVALID,
+    RESOURCE_USAGE_NOT_FOUND,
+    RESOURCE_USAGE_UPDATED,
+    HpcaccessStateDeltaSerializer,
+    HpcaccessStateSerializer,
+    ResourceUsageResultsSerializer,
+    ResourceUsageUpdateSerializer,
+)
+from hpc_access.utils.rest_framework import ConditionalGetMixin, CursorPagination
 from usersec.models import (
+    DeletedHpcObject,
     HpcGroup,
     HpcGroupCreateRequest,
     HpcProject,
     HpcProjectCreateRequest,
     HpcUser,
+    ResourceUsageSample,
+    record_usage_samples,
 )
 from usersec.serializers import (
     HpcGroupCreateRequestSerializer,
@@ -32,23 +53,99 @@ from usersec.serializers import (
     HpcProjectCreateRequestSerializer,
     HpcProjectSerializer,
     HpcUserSerializer,
+    ResourceDataSerializer,
+    ResourceDataUserSerializer,
+    ResourceUsageSampleSerializer,
 )
 
+#: Number of rows fetched per database round trip when streaming the cluster state.
+STATE_STREAM_CHUNK_SIZE = 500
+
+#: Changes this long before a delta cursor are returned again, to cover transactions that
+#: committed after the cursor was handed out.
+STATE_DELTA_OVERLAP = timedelta(seconds=60)
+
+#: Format of the delta cursor.
+STATE_DELTA_CURSOR_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+def get_hpcuser_queryset():
+    """Return HPC users with the relations rendered by ``HpcUserSerializer``."""
+    return HpcUser.objects.select_related("user", "primary_group")
+
+
+def get_hpcgroup_queryset():
+    """Return HPC groups with the relations rendered by ``HpcGroupSerializer``."""
+    return HpcGroup.objects.select_related("owner", "delegate")
+
+
+def get_hpcproject_queryset():
+    """Return HPC projects with the relations rendered by ``HpcProjectSerializer``."""
+    return HpcProject.objects.select_related("group", "delegate").prefetch_related("members")
+
+
+def get_hpcaccess_state_querysets():
+    """Return the sections of the cluster state with querysets and serializers."""
+    return (
+        ("hpc_users", get_hpcuser_queryset(), HpcUserSerializer),
+        ("hpc_groups", get_hpcgroup_queryset(), HpcGroupSerializer),
+        ("hpc_projects", get_hpcproject_queryset(), HpcProjectSerializer),
+    )
+
+
+def parse_date_param(request, name):
+    """Return the timezone aware date passed as query parameter ``name`` or ``None``."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+
+    try:
+        date = parse_datetime(value)
+    except ValueError:
+        date = None
+
+    if date is None or date.tzinfo is None:
+        raise ValidationError({name: f"Invalid date: {value}"})
+
+    return date
+
+
+class RecordUsageMixin:
+    """Write reported ``resources_used`` like the bulk usage update and append it to the usage
+    history on update.
+
+    Other fields are saved without a version.  The used resources are written with
+    ``bulk_update_with_version``, so ``VERSION_USAGE_POLICY`` applies to them.
+    """
+
+    def perform_update(self, serializer):
+        reports_usage = "resources_used" in serializer.validated_data
+        resources_used = serializer.validated_data.pop("resources_used", None)
+        super().perform_update(serializer)
+
+        if reports_usage:
+            instance = serializer.instance
+            instance.resources_used = resources_used
+            type(instance).objects.bulk_update_with_version([instance], ["resources_used"])
+            record_usage_samples([instance])
+
 
 class HpcUserListPagination(CursorPagination):
     ordering = "username"
 
 
-class HpcUserListApiView(ListAPIView):
+class HpcUserListApiView(ConditionalGetMixin, ListAPIView):
     """API view for listing all users."""
 
-    queryset = HpcUser.objects.all().order_by("username")
+    etag_querysets = (HpcUser.objects.all(),)
+
+    queryset = get_hpcuser_queryset().order_by("username")
     serializer_class = HpcUserSerializer
     permission_classes = [IsAdminUser]
     pagination_class = HpcUserListPagination
 
 
-class HpcUserRetrieveUpdateApiView(RetrieveUpdateAPIView):
+class HpcUserRetrieveUpdateApiView(RecordUsageMixin, RetrieveUpdateAPIView):
     """API view for retrieving, updating and deleting a user."""
 
     queryset = HpcUser.objects.all()
@@ -64,16 +161,18 @@ class HpcGroupListPagination(CursorPagination):
     ordering = "name"
 
 
-class HpcGroupListApiView(ListAPIView):
+class HpcGroupListApiView(ConditionalGetMixin, ListAPIView):
     """API view for listing all groups."""
 
-    queryset = HpcGroup.objects.all()
+    etag_querysets = (HpcGroup.objects.all(),)
+
+    queryset = get_hpcgroup_queryset()
     serializer_class = HpcGroupSerializer
     permission_classes = [IsAdminUser]
     pagination_class = HpcGroupListPagination
 
 
-class HpcGroupRetrieveUpdateApiView(RetrieveUpdateAPIView):
+class HpcGroupRetrieveUpdateApiView(RecordUsageMixin, RetrieveUpdateAPIView):
     """API view for retrieving, updating and deleting a user."""
 
     queryset = HpcGroup.objects.all()
@@ -89,16 +188,18 @@ class HpcProjectListPagination(CursorPagination):
     ordering = "name"
 
 
-class HpcProjectListApiView(ListAPIView):
+class HpcProjectListApiView(ConditionalGetMixin, ListAPIView):
     """API view for listing all groups."""
 
-    queryset = HpcProject.objects.all()
+    etag_querysets = (HpcProject.objects.all(),)
+
+    queryset = get_hpcproject_queryset()
     serializer_class = HpcProjectSerializer
     permission_classes = [IsAdminUser]
     pagination_class = HpcProjectListPagination
 
 
-class HpcProjectRetrieveUpdateApiView(RetrieveUpdateAPIView):
+class HpcProjectRetrieveUpdateApiView(RecordUsageMixin, RetrieveUpdateAPIView):
     """API view for retrieving, updating and deleting a user."""
 
     queryset = HpcProject.objects.all()
@@ -219,14 +320,212 @@ class HpcProjectCreateRequestRetrieveUpdateApiView(RetrieveUpdateAPIView):
         super().perform_update(serializer)
 
 
-class HpcaccessStateApiView(RetrieveAPIView):
+class HpcaccessStateApiView(ConditionalGetMixin, RetrieveAPIView):
     """API view for retrieving the cluster status (users, groups, and projects)."""
 
+    etag_querysets = (HpcUser.objects.all(), HpcGroup.objects.all(), HpcProject.objects.all())
+
     serializer_class = HpcaccessStateSerializer
     permission_classes = [IsAdminUser | IsHpcAdminUser]
 
     def get_object(self):
-        hpc_users = {user.uuid: user for user in HpcUser.objects.all()}
-        hpc_groups = {group.uuid: group for group in HpcGroup.objects.all()}
-        hpc_projects = {project.uuid: project for project in HpcProject.objects.all()}
-        return HpcaccessState(hpc_users, hpc_groups, hpc_projects)
+        return HpcaccessState(
+            **{
+                section: {obj.uuid: obj for obj in queryset}
+                for section, queryset, _ in get_hpcaccess_state_querysets()
+            }
+        )
+
+
+class HpcaccessStateStreamApiView(APIView):
+    """API view for streaming the cluster status (users, groups, and projects).
+
+    Returns the same JSON document as ``HpcaccessStateApiView`` but renders it object by
+    object while iterating over the database in chunks.
+    """
+
+    permission_classes = [IsAdminUser | IsHpcAdminUser]
+
+    @extend_schema(responses=HpcaccessStateSerializer)
+    def get(self, request, *args, **kwargs):
+        return StreamingHttpResponse(self.stream(), content_type="application/json")
+
+    def stream(self):
+        renderer = JSONRenderer()
+        yield b"{"
+        for i, (section, queryset, serializer_class) in enumerate(get_hpcaccess_state_querysets()):
+            yield b"%s%s:{" % (b"," if i else b"", renderer.render(section))
+            separator = b""
+            for obj in queryset.order_by("pk").iterator(chunk_size=STATE_STREAM_CHUNK_SIZE):
+                data = serializer_class(obj).data
+                yield b"%s%s:%s" % (
+                    separator,
+                    renderer.render(str(obj.uuid)),
+                    renderer.render(data),
+                )
+                separator = b","
+            yield b"}"
+        yield b"}"
+
+
+class HpcaccessStateDeltaApiView(RetrieveAPIView):
+    """API view for retrieving the users, groups, and projects changed since a cursor.
+
+    Pass the ``cursor`` of the previous response as ``since`` to only receive objects created
+    or modified after it, deleted objects are included with status ``DELETED``. Objects
+    removed from the database are listed by uuid per section in ``deleted``. Without
+    ``since`` all objects are returned.
+    """
+
+    serializer_class = HpcaccessStateDeltaSerializer
+    permission_classes = [IsAdminUser | IsHpcAdminUser]
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("since", str, description="Cursor returned by the last request.")
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_object(self):
+        cursor = timezone.now()
+        filters = {}
+        since_date = parse_date_param(self.request, "since")
+        sections = get_hpcaccess_state_querysets()
+        deleted = {section: [] for section, _, _ in sections}
+
+        if since_date:
+            filters["date_modified__gt"] = since_date - STATE_DELTA_OVERLAP
+            sections_by_type = {
+                queryset.model._meta.model_name: section for section, queryset, _ in sections
+            }
+            tombstones = DeletedHpcObject.objects.filter(
+                date_deleted__gt=since_date - STATE_DELTA_OVERLAP
+            ).values_list("object_type", "object_uuid")
+
+            for object_type, object_uuid in tombstones:
+                deleted[sections_by_type[object_type]].append(object_uuid)
+
+        return HpcaccessStateDelta(
+            **{
+                section: {obj.uuid: obj for obj in queryset.filter(**filters)}
+                for section, queryset, _ in sections
+            },
+            deleted=deleted,
+            cursor=cursor.strftime(STATE_DELTA_CURSOR_FORMAT),
+        )
+
+
+class ResourceUsageHistoryPagination(CursorPagination):
+    ordering = "date"
+    page_size = 1000
+    max_page_size = 10000
+
+
+class ResourceUsageHistoryApiView(ListAPIView):
+    """API view for listing the usage history of a user, group or project.
+
+    Samples of all resolutions are returned oldest first, optionally limited to a ``tier``
+    and to the range from ``start`` (inclusive) to ``end`` (exclusive).
+    """
+
+    serializer_class = ResourceUsageSampleSerializer
+    permission_classes = [IsAdminUser | IsHpcAdminUser]
+    pagination_class = ResourceUsageHistoryPagination
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("tier", str, description="Only return samples of this tier."),
+            OpenApiParameter("start", str, description="Only return samples from this date."),
+            OpenApiParameter("end", str, description="Only return samples before this date."),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        filters = {"object_uuid": self.kwargs["object_uuid"]}
+        tier = self.request.query_params.get("tier")
+        start = parse_date_param(self.request, "start")
+        end = parse_date_param(self.request, "end")
+
+        if tier:
+            filters["tier"] = tier
+
+        if start:
+            filters["date__gte"] = start
+
+        if end:
+            filters["date__lt"] = end
+
+        return ResourceUsageSample.objects.filter(**filters)
+
+
+class ResourceUsageBulkUpdateApiView(APIView):
+    """API view for reporting the resources used by many users, groups, and projects at once.
+
+    The resources of each object are validated on their own and replace its
+    ``resources_used`` like a PATCH of the object does.  All valid updates are written with
+    ``bulk_update_with_version`` in a single transaction, the result of each object is
+    returned by uuid.
+    """
+
+    permission_classes = [IsAdminUser | IsHpcAdminUser]
+
+    #: Sections of the request with their models and serializers of the resources.
+    sections = (
+        ("hpc_users", HpcUser, ResourceDataUserSerializer),
+        ("hpc_groups", HpcGroup, ResourceDataSerializer),
+        ("hpc_projects", HpcProject, ResourceDataSerializer),
+    )
+
+    @extend_schema(request=ResourceUsageUpdateSerializer, responses=ResourceUsageResultsSerializer)
+    def post(self, request, *args, **kwargs):
+        serializer = ResourceUsageUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        now = timezone.now()
+
+        with transaction.atomic():
+            results = {
+                section: self.update_resources_used(
+                    model, resource_serializer, serializer.validated_data.get(section, {}), now
+                )
+                for section, model, resource_serializer in self.sections
+            }
+
+        return Response(ResourceUsageResultsSerializer(results).data)
+
+    def update_resources_used(self, model, resource_serializer, updates, now):
+        """Validate and write ``updates`` mapping uuids of ``model`` objects to resources."""
+        results = {}
+        valid = {}
+
+        for key, resources_used in updates.items():
+            try:
+                key = str(uuid.UUID(key))
+            except ValueError:
+                results[key] = {"status": RESOURCE_USAGE_INVALID, "errors": {"uuid": "Invalid."}}
+                continue
+
+            resource = resource_serializer(data=resources_used, partial=True)
+            if resource.is_valid():
+                valid[key] = resource.validated_data
+            else:
+                results[key] = {"status": RESOURCE_USAGE_INVALID, "errors": resource.errors}
+
+        objs = list(model.objects.filter(uuid__in=valid))
+
+        for obj in objs:
+            key = str(obj.uuid)
+            obj.resources_used = valid.pop(key)
+            results[key] = {"status": RESOURCE_USAGE_UPDATED}
+
+        for key in valid:
+            results[key] = {"status": RESOURCE_USAGE_NOT_FOUND}
+
+        model.objects.bulk_update_with_version(objs, ["resources_used"])
+        record_usage_samples(objs, date=now)
+
+        return results
@@ -0,0 +1,113 @@
+"""Incremental reading of large JSON documents."""
+
+import json
+
+#: Number of characters read from the file at once.
+READ_CHUNK_SIZE = 64 * 1024
+
+#: Characters skipped between JSON tokens.
+WHITESPACE = " \t\n\r"
+
+#: Characters that cannot follow a complete JSON number.
+NUMBER_CONTINUATION = "0123456789.eE+-"
+
+
+class JsonStreamReader:
+    """Read a JSON document from a file object piece by piece.
+
+    Only the structure of objects is walked incrementally via ``iter_keys()``; values are
+    decoded one at a time with ``decode()``, so memory usage is bounded by the largest
+    single value instead of the whole document.
+    """
+
+    def __init__(self, fileobj, chunk_size=READ_CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self):
+        """Append the next chunk to the buffer, dropping consumed characters."""
+        chunk = self.fileobj.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def _expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def decode(self):
+        """Decode and return the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # Numbers and literals at the end of the buffer may continue in the next chunk.
+            truncated = end == len(self.buffer) or (
+                isinstance(value, int | float) and self.buffer[end] in NUMBER_CONTINUATION
+            )
+            if truncated and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_keys(self):
+        """Yield the keys of the JSON object at the current position.
+
+        After each key, the caller must consume the corresponding value, either with
+        ``decode()`` or by walking it with a nested ``iter_keys()``.
+        """
+        self._expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            if not isinstance(key, str):
+                raise ValueError(f"Expected object key but found {key!r}")
+            self._expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' or '}}' but found {char!r}")
+
+
+def iter_section(fileobj, section, chunk_size=READ_CHUNK_SIZE):
+    """Yield ``(key, value)`` entries of the object stored under ``section`` of the top-level
+    JSON object in ``fileobj``, decoding one entry at a time.
+    """
+    reader = JsonStreamReader(fileobj, chunk_size)
+    for key in reader.iter_keys():
+        if key == section:
+            for entry_key in reader.iter_keys():
+                yield entry_key, reader.decode()
+            return
+        elif reader.peek() == "{":
+            # Skip other sections entry by entry to keep memory bounded.
+            for _ in reader.iter_keys():
+                reader.decode()
+        else:
+            reader.decode()
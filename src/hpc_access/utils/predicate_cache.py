@@ -0,0 +1,94 @@
+"""Request-scoped memoization of django-rules predicate results."""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import getfullargspec
+
+#: Predicate results of the current request, ``None`` outside of ``predicate_cache()``.
+_cache = ContextVar("predicate_cache", default=None)
+
+#: Key part of arguments whose results are not memoized.
+_UNCACHEABLE = object()
+
+
+def _object_key(obj):
+    if obj is None:
+        return None
+
+    if not hasattr(obj, "_meta") or obj.pk is None:
+        return _UNCACHEABLE
+
+    return obj._meta.label, obj.pk
+
+
+def memoize(fn):
+    """Memoize the results of the predicate ``fn`` by user and object within a request.
+
+    Apply below ``@rules.predicate``, the arguments of ``fn`` are kept so that django-rules
+    passes the same arguments as before.
+    """
+
+    def lookup(*args):
+        cache = _cache.get()
+        key = (fn.__module__, fn.__qualname__, *map(_object_key, args))
+
+        if cache is None or _UNCACHEABLE in key:
+            return fn(*args)
+
+        if key not in cache:
+            cache[key] = fn(*args)
+
+        return cache[key]
+
+    if len(getfullargspec(fn).args) == 1:
+
+        @wraps(fn)
+        def wrapper(user):
+            return lookup(user)
+
+    else:
+
+        @wraps(fn)
+        def wrapper(user, obj):
+            return lookup(user, obj)
+
+    return wrapper
+
+
+@contextmanager
+def predicate_cache():
+    """Memoize the results of predicates decorated with ``memoize()`` within the block."""
+    token = _cache.set({})
+
+    try:
+        yield
+    finally:
+        _cache.reset(token)
+
+
+def is_predicate_cache_active():
+    """Return whether predicate results are currently memoized."""
+    return _cache.get() is not None
+
+
+def clear_predicate_cache(**_kwargs):
+    """Drop the memoized results, connected to the signals of the models the predicates read.
+
+    Bulk updates do not send signals.
+    """
+    cache = _cache.get()
+
+    if cache:
+        cache.clear()
+
+
+class PredicateCacheMiddleware:
+    """Memoize the predicate results for the duration of each request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with predicate_cache():
+            return self.get_response(request)
@@ -1,4 +1,10 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
 from rest_framework.pagination import CursorPagination as CursorPagination_
+from rest_framework.response import Response
 
 
 class CursorPagination(CursorPagination_):
@@ -10,3 +16,36 @@ class CursorPagination(CursorPagination_):
     page_size_query_param = "page_size"
     max_page_size = 1000
     template = "rest_framework/pagination/previous_and_next.html"
+
+
+class ConditionalGetMixin:
+    """Answer ``If-None-Match`` with 304 before any serialization happens.
+
+    The ETag is derived from the request path, query string and response format, plus the row
+    count and latest ``date_modified`` of each queryset in ``etag_querysets``, one aggregate
+    query each. Changes of related objects rendered in the response must touch
+    ``date_modified``, e.g. saving a Django user touches its HPC users.
+    """
+
+    #: Querysets the response is derived from.
+    etag_querysets = ()
+
+    def get_etag(self, request):
+        parts = [request.get_full_path(), request.accepted_renderer.format]
+        for queryset in self.etag_querysets:
+            result = queryset.all().aggregate(count=Count("pk"), latest=Max("date_modified"))
+            latest = result["latest"].isoformat() if result["latest"] else ""
+            parts.append(f"{queryset.model._meta.label}:{result['count']}:{latest}")
+        return quote_etag(hashlib.sha256("|".join(parts).encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+
+        if etag in if_none_match or "*" in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = super().get(request, *args, **kwargs)
+
+        response["ETag"] = etag
+        return response
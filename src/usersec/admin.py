@@ -1,6 +1,7 @@
 from django.contrib import admin  # noqa
 
 from usersec.models import (
+    ConsentNotificationJob,
     HpcGroup,
     HpcGroupChangeRequest,
     HpcGroupChangeRequestVersion,
@@ -25,6 +26,7 @@ from usersec.models import (
     HpcUserDeleteRequest,
     HpcUserDeleteRequestVersion,
     HpcUserVersion,
+    OutboxEmail,
 )
 
 # HpcUser related
@@ -71,3 +73,9 @@ admin.site.register(HpcProjectChangeRequestVersion)
 
 admin.site.register(HpcProjectDeleteRequest)
 admin.site.register(HpcProjectDeleteRequestVersion)
+
+# Email related
+# ------------------------------------------------------------------------------
+
+admin.site.register(OutboxEmail)
+admin.site.register(ConsentNotificationJob)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UsersecConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "usersec"
+
+    def ready(self):
+        import usersec.signals  # noqa F401
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:31
+
+from django.db import migrations, models
+
+
+def seed_counters(apps, schema_editor):
+    IdCounter = apps.get_model("usersec", "IdCounter")
+    for model_name, id_type in (
+        ("HpcUser", "uid"),
+        ("HpcGroup", "gid"),
+        ("HpcProject", "gid"),
+    ):
+        model = apps.get_model("usersec", model_name)
+        current = model.objects.aggregate(current=models.Max(id_type))["current"] or 0
+        IdCounter.objects.get_or_create(
+            name=f"{model_name.lower()}_{id_type}", defaults={"last_value": current}
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0031_hpcuser_uid_hpcuserversion_uid"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        help_text="Name of the counter", max_length=64, unique=True
+                    ),
+                ),
+                (
+                    "last_value",
+                    models.IntegerField(default=0, help_text="Last value handed out"),
+                ),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0032_idcounter"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="hpcgroupinvitationversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_8e347d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcgroupversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_df7ae7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcprojectcreaterequestversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_c69de2_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcprojectinvitationversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_d52d63_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcprojectversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_3987dc_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcusercreaterequestversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_360d5c_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcuserversion",
+            index=models.Index(
+                fields=["belongs_to", "version"], name="usersec_hpc_belongs_18c9cf_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.17 on 2026-10-16 23:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0033_version_belongs_to_version_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="hpcgroup",
+            index=models.Index(
+                fields=["date_modified"], name="usersec_hpc_date_mo_f54b88_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcproject",
+            index=models.Index(
+                fields=["date_modified"], name="usersec_hpc_date_mo_f00088_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcuser",
+            index=models.Index(
+                fields=["date_modified"], name="usersec_hpc_date_mo_48d395_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,150 @@
+# Generated by Django 4.2.17 on 2026-10-17 00:18
+
+import django.contrib.postgres.indexes
+from django.conf import settings
+from django.db import migrations, models
+
+#: Quota status values, GREEN, YELLOW and RED.
+GREEN, YELLOW, RED = 1, 2, 3
+
+
+def compute_quota_status(requested_val, used_val):
+    if requested_val == 0 or used_val == 0:
+        return GREEN
+
+    if used_val >= requested_val:
+        return RED
+
+    if used_val >= max(
+        requested_val * settings.QUOTA_WARNING_THRESHOLD / 100,
+        requested_val - settings.QUOTA_WARNING_ABSOLUTE,
+    ):
+        return YELLOW
+
+    return GREEN
+
+
+def set_quota_status(apps, schema_editor):
+    for model_name in ("HpcUser", "HpcGroup", "HpcProject"):
+        model = apps.get_model("usersec", model_name)
+        objs = list(model.objects.only("resources_requested", "resources_used"))
+        for obj in objs:
+            requested = obj.resources_requested or {}
+            used = obj.resources_used or {}
+            obj.quota_status_tiers = {
+                tier: compute_quota_status(requested[tier], used[tier])
+                for tier in sorted(requested.keys() & used.keys())
+            }
+            obj.quota_status = max(obj.quota_status_tiers.values(), default=None)
+        model.objects.bulk_update(
+            objs, ["quota_status", "quota_status_tiers"], batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0034_date_modified_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="hpcgroup",
+            name="quota_status",
+            field=models.IntegerField(
+                blank=True,
+                choices=[(1, "GREEN"), (2, "YELLOW"), (3, "RED")],
+                editable=False,
+                help_text="Worst quota status over all tiers",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="hpcgroup",
+            name="quota_status_tiers",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                help_text="Quota status per tier",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hpcproject",
+            name="quota_status",
+            field=models.IntegerField(
+                blank=True,
+                choices=[(1, "GREEN"), (2, "YELLOW"), (3, "RED")],
+                editable=False,
+                help_text="Worst quota status over all tiers",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="hpcproject",
+            name="quota_status_tiers",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                help_text="Quota status per tier",
+            ),
+        ),
+        migrations.AddField(
+            model_name="hpcuser",
+            name="quota_status",
+            field=models.IntegerField(
+                blank=True,
+                choices=[(1, "GREEN"), (2, "YELLOW"), (3, "RED")],
+                editable=False,
+                help_text="Worst quota status over all tiers",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="hpcuser",
+            name="quota_status_tiers",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                editable=False,
+                help_text="Quota status per tier",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcgroup",
+            index=models.Index(
+                fields=["quota_status"], name="usersec_hpc_quota_s_fd8fec_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcgroup",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["quota_status_tiers"], name="usersec_hpc_quota_s_71f9f6_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcproject",
+            index=models.Index(
+                fields=["quota_status"], name="usersec_hpc_quota_s_f9d2f9_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcproject",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["quota_status_tiers"], name="usersec_hpc_quota_s_f8073d_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcuser",
+            index=models.Index(
+                fields=["quota_status"], name="usersec_hpc_quota_s_08b9f7_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="hpcuser",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["quota_status_tiers"], name="usersec_hpc_quota_s_ad3c68_gin"
+            ),
+        ),
+        migrations.RunPython(set_quota_status, migrations.RunPython.noop),
+    ]
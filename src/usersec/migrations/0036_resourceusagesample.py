@@ -0,0 +1,61 @@
+# Generated by Django 4.2.17 on 2026-10-17 00:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0035_quota_status"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResourceUsageSample",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "object_type",
+                    models.CharField(
+                        help_text="Model name of the object", max_length=16
+                    ),
+                ),
+                ("object_uuid", models.UUIDField(help_text="UUID of the object")),
+                ("tier", models.CharField(help_text="Storage tier", max_length=64)),
+                ("used", models.FloatField(help_text="Used resources in the tier")),
+                (
+                    "resolution",
+                    models.CharField(
+                        choices=[
+                            ("raw", "raw"),
+                            ("hourly", "hourly"),
+                            ("daily", "daily"),
+                        ],
+                        default="raw",
+                        help_text="Resolution of the sample",
+                        max_length=16,
+                    ),
+                ),
+                ("date", models.DateTimeField(help_text="Date of the sample")),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["object_uuid", "tier", "date"],
+                        name="usersec_res_object__9afa21_idx",
+                    ),
+                    models.Index(
+                        fields=["resolution", "date"],
+                        name="usersec_res_resolut_915d20_idx",
+                    ),
+                ],
+            },
+        ),
+    ]
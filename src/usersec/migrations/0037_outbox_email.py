@@ -0,0 +1,93 @@
+# Generated by Django 4.2.17 on 2026-10-17 00:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0036_resourceusagesample"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEmail",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_created",
+                    models.DateTimeField(
+                        auto_now_add=True, help_text="DateTime of creation"
+                    ),
+                ),
+                (
+                    "from_email",
+                    models.CharField(help_text="Sender address", max_length=254),
+                ),
+                (
+                    "recipients",
+                    models.JSONField(default=list, help_text="Recipient addresses"),
+                ),
+                ("subject", models.TextField(help_text="Subject line")),
+                ("body", models.TextField(help_text="Plain text body")),
+                (
+                    "body_html",
+                    models.TextField(blank=True, default="", help_text="HTML body"),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "PENDING"),
+                            ("SENT", "SENT"),
+                            ("FAILED", "FAILED"),
+                        ],
+                        default="PENDING",
+                        help_text="Delivery status",
+                        max_length=16,
+                    ),
+                ),
+                (
+                    "attempts",
+                    models.IntegerField(
+                        default=0, help_text="Number of failed delivery attempts"
+                    ),
+                ),
+                (
+                    "next_attempt",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="DateTime of the next delivery attempt",
+                    ),
+                ),
+                (
+                    "date_sent",
+                    models.DateTimeField(
+                        blank=True, help_text="DateTime of delivery", null=True
+                    ),
+                ),
+                (
+                    "error",
+                    models.TextField(
+                        blank=True, default="", help_text="Error of the last attempt"
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["status", "next_attempt"],
+                        name="usersec_out_status_c51f68_idx",
+                    )
+                ],
+            },
+        ),
+    ]
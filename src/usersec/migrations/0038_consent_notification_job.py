@@ -0,0 +1,106 @@
+# Generated by Django 4.2.17 on 2026-10-17 00:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0037_outbox_email"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ConsentNotificationJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "date_created",
+                    models.DateTimeField(
+                        auto_now_add=True, help_text="DateTime of creation"
+                    ),
+                ),
+                (
+                    "date_published",
+                    models.DateTimeField(help_text="Date of the publication"),
+                ),
+                (
+                    "total",
+                    models.IntegerField(
+                        default=0, help_text="Number of users to notify"
+                    ),
+                ),
+                (
+                    "sent",
+                    models.IntegerField(
+                        default=0, help_text="Number of notifications sent"
+                    ),
+                ),
+                (
+                    "failed",
+                    models.IntegerField(
+                        default=0, help_text="Number of notifications failed"
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ConsentNotificationChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "first_user_id",
+                    models.IntegerField(help_text="Primary key of the first user"),
+                ),
+                (
+                    "last_user_id",
+                    models.IntegerField(help_text="Primary key of the last user"),
+                ),
+                (
+                    "sent",
+                    models.IntegerField(
+                        default=0, help_text="Number of notifications sent"
+                    ),
+                ),
+                (
+                    "failed",
+                    models.IntegerField(
+                        default=0, help_text="Number of notifications failed"
+                    ),
+                ),
+                (
+                    "date_done",
+                    models.DateTimeField(
+                        blank=True,
+                        help_text="DateTime the chunk has been sent",
+                        null=True,
+                    ),
+                ),
+                (
+                    "job",
+                    models.ForeignKey(
+                        help_text="Job the chunk belongs to",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunk_set",
+                        to="usersec.consentnotificationjob",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.17 on 2026-10-17 09:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0038_consent_notification_job"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DeletedHpcObject",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "object_type",
+                    models.CharField(
+                        help_text="Model name of the object", max_length=16
+                    ),
+                ),
+                ("object_uuid", models.UUIDField(help_text="UUID of the object")),
+                (
+                    "date_deleted",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="DateTime of deletion",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["date_deleted"], name="usersec_del_date_de_b7b447_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.17 on 2026-10-17 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("usersec", "0039_deletedhpcobject"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="consentnotificationchunk",
+            name="last_sent_user_id",
+            field=models.IntegerField(
+                blank=True, help_text="Primary key of the last user notified", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="consentnotificationchunk",
+            name="lease_until",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="DateTime until the chunk is claimed by a task",
+                null=True,
+            ),
+        ),
+    ]
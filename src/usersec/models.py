@@ -1,11 +1,19 @@
 import re
 import uuid as uuid_object
+from datetime import timedelta
+from datetime import timezone as dt_timezone
 from enum import Enum, unique
+from itertools import groupby
+from operator import itemgetter
 
 from django.apps import apps
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
 from django.db import models, transaction
+from django.db.models.functions import Trunc
 from django.urls import reverse
+from django.utils import timezone
 
 from adminsec.constants import TIER_USER_HOME
 from hpc_access.users.models import User
@@ -109,15 +117,88 @@ LOGIN_SHELL_CHOICES = [
 
 RE_EMAIL = r"^\S+@\S+\.\S+$"
 
+#: Number of rows written per query by the bulk versioned operations.
+BULK_VERSION_BATCH_SIZE = 500
+
+#: Fields not copied from an object to its version objects.
+VERSION_EXCLUDED_FIELDS = (
+    "id",
+    "uuid",
+    "current_version",
+    "date_created",
+    "quota_status",
+    "quota_status_tiers",
+)
+
+
+#: Fields holding reported usage, changes limited to them are subject to the usage policy.
+VERSION_USAGE_FIELDS = ("resources_used",)
+
+#: Usage-only changes create a new version object like any other change.
+VERSION_USAGE_POLICY_VERSION = "version"
+
+#: Usage-only changes are written into the latest version object.
+VERSION_USAGE_POLICY_COALESCE = "coalesce"
+
+#: Usage-only changes do not touch the version objects, the usage history keeps them.
+VERSION_USAGE_POLICY_SKIP = "skip"
+
+#: Number of objects whose version history is compacted per transaction.
+VERSION_COMPACT_BATCH_SIZE = 500
+
+#: Fields of the version objects that do not make a version differ from its successor.
+VERSION_COMPACT_IGNORED_FIELDS = ("id", "uuid", "version", "date_created", "date_modified")
+
+
+def select_versions_to_compact(versions, before):
+    """Return the ids of the ``versions`` of a single object that compaction removes.
+
+    ``versions`` are dicts of the versioned fields ordered by version.  A version is removed
+    if it was created before ``before`` and all of its fields but those in
+    ``VERSION_COMPACT_IGNORED_FIELDS`` equal the ones of its successor.  The first and the
+    last version, versions changing the status and versions carrying a comment are kept.
+    """
+    ids = []
+
+    def fields(version):
+        return {k: v for k, v in version.items() if k not in VERSION_COMPACT_IGNORED_FIELDS}
+
+    for i, version in enumerate(versions[1:-1], start=1):
+        if (
+            version["date_created"] < before
+            and version["status"] == versions[i - 1]["status"]
+            and not version.get("comment")
+            and fields(version) == fields(versions[i + 1])
+        ):
+            ids.append(version["id"])
+
+    return ids
+
+
+def get_versioned_models():
+    """Return the models of the app that keep a version history."""
+    return [
+        model
+        for model in apps.get_app_config(APP_NAME).get_models()
+        if issubclass(model, VersionManagerMixin)
+    ]
+
 
 def _get_next_id(model, id_type):
-    _id = 0
-    for o in model.objects.all():
-        if getattr(o, id_type) is None:
-            continue
-        if getattr(o, id_type) > _id:
-            _id = getattr(o, id_type)
-    return _id + 1
+    """Allocate the next free id of ``id_type`` for ``model``.
+
+    The counter row is locked for the rest of the surrounding transaction so that concurrent
+    allocations are serialized.  Ids assigned by other means (e.g., imports) are taken into
+    account by comparing against the current maximum in the database.
+    """
+    with transaction.atomic():
+        counter, _ = IdCounter.objects.select_for_update().get_or_create(
+            name=f"{model._meta.model_name}_{id_type}"
+        )
+        current = model.objects.aggregate(current=models.Max(id_type))["current"] or 0
+        counter.last_value = max(counter.last_value, current) + 1
+        counter.save(update_fields=["last_value"])
+    return counter.last_value
 
 
 def get_next_hpcuser_uid():
@@ -140,8 +221,11 @@ def get_next_hpcproject_gid():
 class VersionManager(models.Manager):
     """Functions for creating, updating and deleting objects with version objects."""
 
+    def version_class(self):
+        return get_model(APP_NAME, f"{self.model.__name__}Version")
+
     def version_model(self, **kwargs):
-        return get_model(APP_NAME, f"{self.model.__name__}Version")(**kwargs)
+        return self.version_class()(**kwargs)
 
     @transaction.atomic
     def create_with_version(self, **kwargs):
@@ -163,6 +247,222 @@ class VersionManager(models.Manager):
 
         return obj
 
+    def _version_objects(self, objs):
+        """Build unsaved version objects snapshotting the current state of ``objs``."""
+        version_model = self.version_class()
+        fields = [
+            field.attname
+            for field in self.model._meta.concrete_fields
+            if field.name not in VERSION_EXCLUDED_FIELDS
+        ]
+        return [
+            version_model(
+                **{name: getattr(obj, name) for name in fields},
+                version=obj.current_version,
+                belongs_to=obj,
+            )
+            for obj in objs
+        ]
+
+    def _m2m_fields(self):
+        """Names of many-to-many fields shared by the model and its version model."""
+        version_m2m = {field.name for field in self.version_class()._meta.many_to_many}
+        return [field.name for field in self.model._meta.many_to_many if field.name in version_m2m]
+
+    def _bulk_add_m2m(self, pairs, field_name, batch_size):
+        """Write ``(instance, related ids)`` pairs into the through table of ``field_name``."""
+        if not pairs:
+            return
+
+        field = pairs[0][0]._meta.get_field(field_name)
+        through = field.remote_field.through
+        source = field.m2m_field_name() + "_id"
+        target = field.m2m_reverse_field_name() + "_id"
+        through.objects.bulk_create(
+            [
+                through(**{source: instance.pk, target: related_id})
+                for instance, related_ids in pairs
+                for related_id in related_ids
+            ],
+            batch_size=batch_size,
+        )
+
+    @transaction.atomic
+    def bulk_create_with_version(self, objs, m2m=None, batch_size=BULK_VERSION_BATCH_SIZE):
+        """
+        Create the unsaved ``objs`` together with their first version objects in bulk.
+
+        ``m2m`` optionally maps many-to-many field names to a list of related objects (or their
+        primary keys) per entry in ``objs``, e.g. ``{"members": [[hpcuser1], [hpcuser1, 2]]}``.
+        The relations are written for the objects and their version objects alike.
+        """
+        objs = list(objs)
+
+        for obj in objs:
+            obj.current_version = obj.current_version or 1
+
+        self.bulk_create(objs, batch_size=batch_size)
+        version_objs = self._version_objects(objs)
+        self.version_class().objects.bulk_create(version_objs, batch_size=batch_size)
+
+        for field_name, related in (m2m or {}).items():
+            related_ids = [[getattr(r, "pk", r) for r in entry] for entry in related]
+            self._bulk_add_m2m(list(zip(objs, related_ids, strict=True)), field_name, batch_size)
+            self._bulk_add_m2m(
+                list(zip(version_objs, related_ids, strict=True)), field_name, batch_size
+            )
+
+        return objs
+
+    @transaction.atomic
+    def bulk_update_with_version(self, objs, fields, batch_size=BULK_VERSION_BATCH_SIZE):
+        """
+        Write ``fields`` of the already changed ``objs`` and add a new version object for
+        each of them in bulk. Many-to-many relations are copied to the new versions.
+        """
+        objs = list(objs)
+
+        if not objs:
+            return objs
+
+        version_model = self.version_class()
+        now = timezone.now()
+        fields = list(fields)
+
+        if hasattr(self.model, "update_quota_status") and set(fields) & set(
+            QUOTA_STATUS_SOURCE_FIELDS
+        ):
+            for obj in objs:
+                obj.update_quota_status()
+            fields += ["quota_status", "quota_status_tiers"]
+
+        if (
+            set(fields) <= {*VERSION_USAGE_FIELDS, "quota_status", "quota_status_tiers"}
+            and settings.VERSION_USAGE_POLICY != VERSION_USAGE_POLICY_VERSION
+        ):
+            return self._bulk_update_usage(objs, fields, batch_size, now)
+
+        latest = dict(
+            version_model.objects.filter(belongs_to__in=objs)
+            .values_list("belongs_to")
+            .annotate(latest=models.Max("version"))
+        )
+
+        for obj in objs:
+            obj.current_version = latest.get(obj.pk, 0) + 1
+            obj.date_modified = now
+
+        self.bulk_update(
+            objs,
+            list(dict.fromkeys([*fields, "current_version", "date_modified"])),
+            batch_size=batch_size,
+        )
+        version_objs = self._version_objects(objs)
+        version_model.objects.bulk_create(version_objs, batch_size=batch_size)
+
+        for field_name in self._m2m_fields():
+            field = self.model._meta.get_field(field_name)
+            source = field.m2m_field_name() + "_id"
+            target = field.m2m_reverse_field_name() + "_id"
+            related_ids = {}
+
+            for source_id, target_id in field.remote_field.through.objects.filter(
+                **{f"{source}__in": [obj.pk for obj in objs]}
+            ).values_list(source, target):
+                related_ids.setdefault(source_id, []).append(target_id)
+
+            self._bulk_add_m2m(
+                [(v, related_ids.get(v.belongs_to_id, [])) for v in version_objs],
+                field_name,
+                batch_size,
+            )
+
+        return objs
+
+    def _bulk_update_usage(self, objs, fields, batch_size, now):
+        """Write usage-only changes of ``objs`` according to ``VERSION_USAGE_POLICY``."""
+        for obj in objs:
+            obj.date_modified = now
+
+        self.bulk_update(objs, [*fields, "date_modified"], batch_size=batch_size)
+
+        if settings.VERSION_USAGE_POLICY == VERSION_USAGE_POLICY_COALESCE:
+            usage_fields = [field for field in fields if field in VERSION_USAGE_FIELDS]
+            by_pk = {obj.pk: obj for obj in objs}
+            version_objs = list(
+                self.version_class().objects.filter(
+                    belongs_to__in=objs, version=models.F("belongs_to__current_version")
+                )
+            )
+
+            for version_obj in version_objs:
+                for field in usage_fields:
+                    setattr(version_obj, field, getattr(by_pk[version_obj.belongs_to_id], field))
+                version_obj.date_modified = now
+
+            self.version_class().objects.bulk_update(
+                version_objs, [*usage_fields, "date_modified"], batch_size=batch_size
+            )
+
+        return objs
+
+    def compact_version_history(
+        self, before=None, start_after=0, batch_size=VERSION_COMPACT_BATCH_SIZE, dry_run=False
+    ):
+        """Remove the versions created before ``before`` that only repeat their successor, see
+        ``select_versions_to_compact``.
+
+        Objects are processed in batches ordered by primary key, each batch in its own
+        transaction, so that a run can be interrupted and resumed with ``start_after``.
+        Yields the progress after every batch.
+        """
+        if before is None:
+            before = timezone.now() - timedelta(days=settings.VERSION_HISTORY_RETENTION_DAYS)
+
+        version_class = self.version_class()
+        fields = [field.attname for field in version_class._meta.concrete_fields]
+        m2m_fields = version_class._meta.many_to_many
+        last_pk = start_after
+
+        while True:
+            pks = list(
+                self.filter(pk__gt=last_pk).order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+
+            if not pks:
+                return
+
+            with transaction.atomic():
+                versions = list(
+                    version_class.objects.filter(belongs_to_id__in=pks)
+                    .order_by("belongs_to_id", "version")
+                    .values(*fields)
+                )
+
+                for field in m2m_fields:
+                    source = field.m2m_field_name() + "_id"
+                    target = field.m2m_reverse_field_name() + "_id"
+                    related_ids = {}
+
+                    for source_id, target_id in field.remote_field.through.objects.filter(
+                        **{f"{source}__in": [version["id"] for version in versions]}
+                    ).values_list(source, target):
+                        related_ids.setdefault(source_id, set()).add(target_id)
+
+                    for version in versions:
+                        version[field.name] = related_ids.get(version["id"], set())
+
+                ids = []
+
+                for _, history in groupby(versions, key=itemgetter("belongs_to_id")):
+                    ids += select_versions_to_compact(list(history), before)
+
+                if ids and not dry_run:
+                    version_class.objects.filter(id__in=ids).delete()
+
+            last_pk = pks[-1]
+            yield {"last_pk": last_pk, "objects": len(pks), "deleted": len(ids)}
+
     # def update_with_version(self, **kwargs):
     #     # TODO: update all from queryset with the given values
     #     pass
@@ -192,20 +492,42 @@ class VersionManagerMixin:
     """Mixin for version functionality."""
 
     def get_latest_version(self):
-        max_obj = None
-
         if not self.current_version:
-            return max_obj
+            return None
 
-        for obj in self.version_history.filter(version__gte=self.current_version):
-            if max_obj is None or max_obj.version > obj.version:
-                max_obj = obj
+        return (
+            self.version_history.filter(version__gte=self.current_version)
+            .order_by("-version")
+            .first()
+        )
 
-        return max_obj
+    def get_usage_only_changes(self, version_obj):
+        """Return the usage fields changed since ``version_obj`` if nothing else changed."""
+        changed = {
+            field.name
+            for field in self._meta.concrete_fields
+            if field.name not in (*VERSION_EXCLUDED_FIELDS, "date_modified")
+            and getattr(self, field.attname) != getattr(version_obj, field.attname)
+        }
+        return changed if changed and changed <= set(VERSION_USAGE_FIELDS) else set()
 
     @transaction.atomic
     def save_with_version(self):
         latest = self.get_latest_version()
+
+        if latest and settings.VERSION_USAGE_POLICY != VERSION_USAGE_POLICY_VERSION:
+            changed = self.get_usage_only_changes(latest)
+
+            if changed:
+                self.save()
+
+                if settings.VERSION_USAGE_POLICY == VERSION_USAGE_POLICY_COALESCE:
+                    for field in changed:
+                        setattr(latest, field, getattr(self, field))
+                    latest.save(update_fields=[*changed, "date_modified"])
+
+                return self
+
         self.current_version = (latest.version + 1) if latest else 1
         self.save()
 
@@ -215,7 +537,7 @@ class VersionManagerMixin:
         version_obj.belongs_to = self
 
         for field in self._meta.fields:
-            if field.name in ("id", "uuid", "current_version", "date_created"):
+            if field.name in VERSION_EXCLUDED_FIELDS:
                 continue
 
             setattr(version_obj, field.name, getattr(self, field.name))
@@ -328,75 +650,237 @@ class HpcQuotaStatus(Enum):
         return self.value < other.value
 
 
+#: Choices of the persisted quota status.
+QUOTA_STATUS_CHOICES = [(status.value, status.name) for status in HpcQuotaStatus]
+
+#: Fields the persisted quota status is derived from.
+QUOTA_STATUS_SOURCE_FIELDS = ("resources_requested", "resources_used")
+
+
+#: Prefix of the cache keys of quota reports.
+QUOTA_REPORT_CACHE_PREFIX = "usersec.quota_report"
+
+
+def compute_quota_status(requested_val, used_val):
+    """Compute the quota status of a single tier."""
+    if requested_val == 0 or used_val == 0:
+        # if requested_val is 0, CEPHFS provides unlimited quota => status always green
+        # if used_val is 0, the user has not used any resources => cut short
+        return HpcQuotaStatus.GREEN
+
+    if used_val >= requested_val:
+        return HpcQuotaStatus.RED
+
+    if used_val >= max(
+        requested_val * settings.QUOTA_WARNING_THRESHOLD / 100,
+        requested_val - settings.QUOTA_WARNING_ABSOLUTE,
+    ):
+        return HpcQuotaStatus.YELLOW
+
+    return HpcQuotaStatus.GREEN
+
+
+def compute_quota_report(resources_requested, resources_used, folders):
+    """Compute the quota report for the given requested and used resources."""
+    resources_requested = resources_requested or {}
+    resources_used = resources_used or {}
+    requested = set(resources_requested.keys())
+    used = set(resources_used.keys())
+    available = requested & used
+    if not available:
+        return {
+            "used": {},
+            "requested": {},
+            "percentage": {},
+            "status": {},
+            "folders": {},
+            "warnings": ["No resources available."],
+        }
+    result = {
+        "used": {a: resources_used[a] for a in available},
+        "requested": {a: resources_requested[a] for a in available},
+        "percentage": {},
+        "status": {},
+        "folders": {a: folders[a] for a in available},
+        "warnings": [],
+    }
+
+    for key in used - requested:
+        result["warnings"].append(f"Resource {key} is used, but not found in requested resources")
+
+    for key in requested - used:
+        result["warnings"].append(f"Resource {key} is requested, but not found in used resources")
+
+    for key in available:
+        used_val = resources_used.get(key)
+        requested_val = resources_requested.get(key)
+
+        result["percentage"][key] = round(100 * used_val / requested_val) if requested_val else 0
+        result["status"][key] = compute_quota_status(requested_val, used_val)
+
+    return result
+
+
 class CheckQuotaMixin:
+    """Quota reports and the persisted quota status of objects with resources.
+
+    Models using the mixin provide the ``quota_status`` and ``quota_status_tiers`` fields,
+    which are refreshed on every save.
+    """
+
+    def save(self, *args, **kwargs):
+        self.update_quota_status()
+        update_fields = kwargs.get("update_fields")
+
+        if update_fields is not None and set(QUOTA_STATUS_SOURCE_FIELDS) & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "quota_status", "quota_status_tiers"}
+
+        super().save(*args, **kwargs)
+
+    def update_quota_status(self):
+        """Set the worst quota status and the quota status per tier from the resources."""
+        requested = self.resources_requested or {}
+        used = self.resources_used or {}
+        self.quota_status_tiers = {
+            tier: compute_quota_status(requested[tier], used[tier]).value
+            for tier in sorted(requested.keys() & used.keys())
+        }
+        self.quota_status = max(self.quota_status_tiers.values(), default=None)
+
+    def get_quota_status(self):
+        """Return the persisted worst quota status or ``None`` without resources."""
+        return HpcQuotaStatus(self.quota_status) if self.quota_status else None
+
+    def get_quota_status_tiers(self):
+        """Return the persisted quota status by tier."""
+        return {
+            tier: HpcQuotaStatus(status) for tier, status in (self.quota_status_tiers or {}).items()
+        }
+
+    def get_quota_folders(self):
+        """Return the folders of the object by tier."""
+        if isinstance(self, get_model(APP_NAME, "HpcUser")):
+            return {TIER_USER_HOME: self.home_directory}
+        return getattr(self, "folders", {})
+
+    def get_quota_report_cache_key(self):
+        """Return the cache key of the quota report of the saved object."""
+        return ":".join(
+            map(
+                str,
+                (
+                    QUOTA_REPORT_CACHE_PREFIX,
+                    self._meta.label_lower,
+                    self.pk,
+                    self.date_modified.timestamp(),
+                    settings.QUOTA_WARNING_THRESHOLD,
+                    settings.QUOTA_WARNING_ABSOLUTE,
+                ),
+            )
+        )
+
     def generate_quota_report(self):
-        """Generate a quota report for the object."""
+        """Generate a quota report for the object.
+
+        The report is computed once per object instance and only recomputed when the
+        resources, folders or thresholds change.
+        """
         if not hasattr(self, "resources_requested") or not hasattr(self, "resources_used"):
             # Sanity check - probably wrong use of mixin
             raise AttributeError("Object does not have resources_requested or resources_used")
 
-        requested = set((self.resources_requested or {}).keys())
-        used = set((self.resources_used or {}).keys())
-        available = requested & used
-        if not available:
-            return {
-                "used": {},
-                "requested": {},
-                "percentage": {},
-                "status": {},
-                "folders": {},
-                "warnings": ["No resources available."],
-            }
-        folders = (
-            {TIER_USER_HOME: self.home_directory}
-            if isinstance(self, get_model(APP_NAME, "HpcUser"))
-            else getattr(self, "folders", {})
-        )
-        result = {
-            "used": {a: self.resources_used[a] for a in available},
-            "requested": {a: self.resources_requested[a] for a in available},
-            "percentage": {},
-            "status": {},
-            "folders": {a: folders[a] for a in available},
-            "warnings": [],
-        }
+        key = self._get_quota_report_key()
+        cached = getattr(self, "_quota_report", None)
 
-        for key in used - requested:
-            result["warnings"].append(
-                f"Resource {key} is used, but not found in requested resources"
+        if cached is None or cached[0] != key:
+            report = compute_quota_report(
+                self.resources_requested, self.resources_used, self.get_quota_folders()
             )
-
-        for key in requested - used:
-            result["warnings"].append(
-                f"Resource {key} is requested, but not found in used resources"
+            cached = self._quota_report = (key, report)
+
+        return cached[1]
+
+    def _get_quota_report_key(self):
+        return repr(
+            (
+                self.resources_requested,
+                self.resources_used,
+                self.get_quota_folders(),
+                settings.QUOTA_WARNING_THRESHOLD,
+                settings.QUOTA_WARNING_ABSOLUTE,
             )
+        )
 
-        for key in available:
-            used_val = self.resources_used.get(key)
-            requested_val = self.resources_requested.get(key)
 
-            if requested_val == 0 or used_val == 0:
-                # if requested_val is 0, CEPHFS provides unlimited quota => status always green
-                # if used_val is 0, the user has not used any resources => cut short
-                result["percentage"][key] = 0
-                result["status"][key] = HpcQuotaStatus.GREEN
-                continue
+def get_quota_reports(objs):
+    """Return the quota reports of the saved ``objs`` as a dict keyed by object.
+
+    Reports are shared through the Django cache, keyed on the object's ``date_modified``.
+    The cached reports are fetched in one round trip and only missing ones are computed.
+    Cached reports are also kept on the objects, so later calls of
+    ``generate_quota_report()``, e.g. from templates, do not compute them again.
+    """
+    objs = list(objs)
+    keys = {obj: obj.get_quota_report_cache_key() for obj in objs}
+    cached = cache.get_many(keys.values())
+    reports = {}
+    missing = {}
+
+    for obj, key in keys.items():
+        if key in cached:
+            reports[obj] = cached[key]
+            obj._quota_report = (obj._get_quota_report_key(), cached[key])
+        else:
+            reports[obj] = missing[key] = obj.generate_quota_report()
+
+    if missing:
+        cache.set_many(missing, settings.QUOTA_REPORT_CACHE_TIMEOUT)
+
+    return reports
+
+
+#: Cache key of the quota warning thresholds the persisted quota status was computed with.
+QUOTA_STATUS_THRESHOLDS_CACHE_KEY = "usersec.quota_status_thresholds"
+
+#: Number of objects whose quota status is recomputed per query.
+QUOTA_STATUS_BATCH_SIZE = 1000
+
+
+def refresh_quota_status(force=False):
+    """Recompute the persisted quota status of all users, groups and projects.
 
-            result["percentage"][key] = round(100 * used_val / requested_val)
+    The status is persisted on save only, so it is recomputed when the quota warning
+    thresholds differ from the ones of the last run (or are unknown after the cache was
+    cleared).  Only rows with a changed status are written.  Returns the number of updated
+    rows per model label, ``None`` if the status is up to date.
+    """
+    thresholds = (settings.QUOTA_WARNING_THRESHOLD, settings.QUOTA_WARNING_ABSOLUTE)
 
-            if used_val >= requested_val:
-                result["status"][key] = HpcQuotaStatus.RED
+    if not force and cache.get(QUOTA_STATUS_THRESHOLDS_CACHE_KEY) == thresholds:
+        return None
 
-            elif used_val >= max(
-                requested_val * settings.QUOTA_WARNING_THRESHOLD / 100,
-                requested_val - settings.QUOTA_WARNING_ABSOLUTE,
-            ):
-                result["status"][key] = HpcQuotaStatus.YELLOW
+    updated = {}
 
-            else:
-                result["status"][key] = HpcQuotaStatus.GREEN
+    for model in (HpcUser, HpcGroup, HpcProject):
+        changed = []
+        objs = model.objects.only(
+            "resources_requested", "resources_used", "quota_status", "quota_status_tiers"
+        ).order_by("pk")
 
-        return result
+        for obj in objs.iterator(chunk_size=QUOTA_STATUS_BATCH_SIZE):
+            current = (obj.quota_status, obj.quota_status_tiers)
+            obj.update_quota_status()
+
+            if (obj.quota_status, obj.quota_status_tiers) != current:
+                changed.append(obj)
+
+        model.objects.bulk_update(
+            changed, ["quota_status", "quota_status_tiers"], batch_size=QUOTA_STATUS_BATCH_SIZE
+        )
+        updated[model._meta.label] = len(changed)
+
+    cache.set(QUOTA_STATUS_THRESHOLDS_CACHE_KEY, thresholds, None)
+    return updated
 
 
 def parse_email(email):
@@ -675,10 +1159,32 @@ class HpcUser(
 
     class Meta:
         unique_together = ("username",)
+        indexes = [
+            models.Index(fields=["date_modified"]),
+            models.Index(fields=["quota_status"]),
+            GinIndex(fields=["quota_status_tiers"]),
+        ]
 
     #: Currently active version of the user object.
     current_version = models.IntegerField(help_text="Currently active version of the user object")
 
+    #: Worst quota status over all tiers, derived from the resources on save.
+    quota_status = models.IntegerField(
+        choices=QUOTA_STATUS_CHOICES,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Worst quota status over all tiers",
+    )
+
+    #: Quota status per tier, derived from the resources on save.
+    quota_status_tiers = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Quota status per tier",
+    )
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}("
@@ -738,6 +1244,7 @@ class HpcUserVersion(HpcUserAbstract):
 
     class Meta:
         unique_together = ("username", "version")
+        indexes = [models.Index(fields=["belongs_to", "version"])]
 
     #: Version number of the user object.
     version = models.IntegerField(help_text="Version of this user object")
@@ -857,10 +1364,32 @@ class HpcGroup(
 
     class Meta:
         unique_together = ("name",)
+        indexes = [
+            models.Index(fields=["date_modified"]),
+            models.Index(fields=["quota_status"]),
+            GinIndex(fields=["quota_status_tiers"]),
+        ]
 
     #: Currently active version of the group object.
     current_version = models.IntegerField(help_text="Currently active version of the group object")
 
+    #: Worst quota status over all tiers, derived from the resources on save.
+    quota_status = models.IntegerField(
+        choices=QUOTA_STATUS_CHOICES,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Worst quota status over all tiers",
+    )
+
+    #: Quota status per tier, derived from the resources on save.
+    quota_status_tiers = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Quota status per tier",
+    )
+
     def __repr__(self):
         return (
             f"{self.__class__.__name__}("
@@ -893,6 +1422,7 @@ class HpcGroupVersion(HpcGroupAbstract):
 
     class Meta:
         unique_together = ("name", "version")
+        indexes = [models.Index(fields=["belongs_to", "version"])]
 
     #: Version number of the group object.
     version = models.IntegerField(help_text="Version number of this group object")
@@ -1017,12 +1547,34 @@ class HpcProject(
 
     class Meta:
         unique_together = ("name",)
+        indexes = [
+            models.Index(fields=["date_modified"]),
+            models.Index(fields=["quota_status"]),
+            GinIndex(fields=["quota_status_tiers"]),
+        ]
 
     #: Currently active version of the project object.
     current_version = models.IntegerField(
         help_text="Currently active version of the project object"
     )
 
+    #: Worst quota status over all tiers, derived from the resources on save.
+    quota_status = models.IntegerField(
+        choices=QUOTA_STATUS_CHOICES,
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Worst quota status over all tiers",
+    )
+
+    #: Quota status per tier, derived from the resources on save.
+    quota_status_tiers = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text="Quota status per tier",
+    )
+
     def __repr__(self):
         return (
             "{}(id={},name={},group={},delegate={},gid={},status={},members={},creator={},"
@@ -1059,6 +1611,7 @@ class HpcProjectVersion(HpcProjectAbstract):
 
     class Meta:
         unique_together = ("name", "version")
+        indexes = [models.Index(fields=["belongs_to", "version"])]
 
     #: Version number of the project object.
     version = models.IntegerField(help_text="Version number of this project object")
@@ -1484,6 +2037,9 @@ class HpcUserCreateRequest(RequestManagerMixin, VersionManagerMixin, HpcUserCrea
 class HpcUserCreateRequestVersion(HpcUserCreateRequestAbstract):
     """HpcUserCreateRequestVersion model"""
 
+    class Meta:
+        indexes = [models.Index(fields=["belongs_to", "version"])]
+
     #: Version number of the user create request object.
     version = models.IntegerField(help_text="Version number of this user create request object")
 
@@ -1712,6 +2268,9 @@ class HpcProjectCreateRequest(
 class HpcProjectCreateRequestVersion(HpcProjectCreateRequestAbstract):
     """HpcProjectCreateRequestVersion model"""
 
+    class Meta:
+        indexes = [models.Index(fields=["belongs_to", "version"])]
+
     #: Version number of the project create request object.
     version = models.IntegerField(help_text="Version number of this project create request object")
 
@@ -1923,6 +2482,9 @@ class HpcProjectInvitation(VersionManagerMixin, HpcProjectInvitationAbstract):
 class HpcProjectInvitationVersion(HpcProjectInvitationAbstract):
     """HpcProjectInvitationVersion model."""
 
+    class Meta:
+        indexes = [models.Index(fields=["belongs_to", "version"])]
+
     #: Version number of the project invitation object.
     version = models.IntegerField(help_text="Version number of this project invitation object")
 
@@ -1971,6 +2533,9 @@ class HpcGroupInvitation(VersionManagerMixin, HpcGroupInvitationAbstract):
 class HpcGroupInvitationVersion(HpcGroupInvitationAbstract):
     """HpcGroupInvitationVersion model."""
 
+    class Meta:
+        indexes = [models.Index(fields=["belongs_to", "version"])]
+
     #: Version number of the group invitation object.
     version = models.IntegerField(help_text="Version number of this group invitation object")
 
@@ -1989,6 +2554,256 @@ class HpcGroupInvitationVersion(HpcGroupInvitationAbstract):
 # ------------------------------------------------------------------------------
 
 
+class IdCounter(models.Model):
+    """Last POSIX id handed out per object type, used as allocation lock."""
+
+    #: Name of the counter, e.g. ``hpcuser_uid``.
+    name = models.CharField(max_length=64, unique=True, help_text="Name of the counter")
+
+    #: Last value handed out.
+    last_value = models.IntegerField(default=0, help_text="Last value handed out")
+
+    def __str__(self):
+        return f"{self.name}={self.last_value}"
+
+
+#: Usage sample as reported.
+USAGE_RESOLUTION_RAW = "raw"
+
+#: Average usage over an hour.
+USAGE_RESOLUTION_HOURLY = "hourly"
+
+#: Average usage over a day.
+USAGE_RESOLUTION_DAILY = "daily"
+
+#: Resolutions of usage samples.
+USAGE_RESOLUTION_CHOICES = [
+    (USAGE_RESOLUTION_RAW, USAGE_RESOLUTION_RAW),
+    (USAGE_RESOLUTION_HOURLY, USAGE_RESOLUTION_HOURLY),
+    (USAGE_RESOLUTION_DAILY, USAGE_RESOLUTION_DAILY),
+]
+
+
+def record_usage_samples(objs, date=None):
+    """Append the current ``resources_used`` of the users, groups or projects ``objs`` to the
+    usage history.
+    """
+    date = date or timezone.now()
+    return ResourceUsageSample.objects.bulk_create(
+        [
+            ResourceUsageSample(
+                object_type=obj._meta.model_name,
+                object_uuid=obj.uuid,
+                tier=tier,
+                used=used,
+                date=date,
+            )
+            for obj in objs
+            for tier, used in (obj.resources_used or {}).items()
+            if used is not None
+        ],
+        batch_size=BULK_VERSION_BATCH_SIZE,
+    )
+
+
+class ResourceUsageSampleManager(models.Manager):
+    """Downsampling of the usage history."""
+
+    def _downsample(self, source, target, kind, before):
+        """Replace samples of resolution ``source`` older than ``before`` by their averages
+        per ``kind`` (``hour`` or ``day``) with resolution ``target``.
+        """
+        samples = self.filter(resolution=source, date__lt=before)
+        buckets = (
+            samples.annotate(bucket=Trunc("date", kind, tzinfo=dt_timezone.utc))
+            .values("object_type", "object_uuid", "tier", "bucket")
+            .annotate(average=models.Avg("used"))
+            .order_by()
+        )
+        created = self.bulk_create(
+            [
+                self.model(
+                    object_type=bucket["object_type"],
+                    object_uuid=bucket["object_uuid"],
+                    tier=bucket["tier"],
+                    used=bucket["average"],
+                    resolution=target,
+                    date=bucket["bucket"],
+                )
+                for bucket in buckets.iterator()
+            ],
+            batch_size=BULK_VERSION_BATCH_SIZE,
+        )
+        samples.delete()
+        return len(created)
+
+    @transaction.atomic
+    def compact(self, now=None):
+        """Downsample raw samples to hourly and hourly samples to daily averages once they
+        are older than the configured retention.  Returns the number of samples created
+        per resolution.
+        """
+        now = (now or timezone.now()).astimezone(dt_timezone.utc)
+        # Align the cutoffs to whole buckets so that no bucket is split between runs.
+        hourly_before = (now - timedelta(days=settings.USAGE_HISTORY_RAW_DAYS)).replace(
+            minute=0, second=0, microsecond=0
+        )
+        daily_before = (now - timedelta(days=settings.USAGE_HISTORY_HOURLY_DAYS)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        return {
+            USAGE_RESOLUTION_HOURLY: self._downsample(
+                USAGE_RESOLUTION_RAW, USAGE_RESOLUTION_HOURLY, "hour", hourly_before
+            ),
+            USAGE_RESOLUTION_DAILY: self._downsample(
+                USAGE_RESOLUTION_HOURLY, USAGE_RESOLUTION_DAILY, "day", daily_before
+            ),
+        }
+
+
+class ResourceUsageSample(models.Model):
+    """Resources used by a user, group or project in one tier at one point in time.
+
+    Raw samples are appended on every usage report and downsampled by ``compact()``.
+    """
+
+    #: Set custom manager
+    objects = ResourceUsageSampleManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["object_uuid", "tier", "date"]),
+            models.Index(fields=["resolution", "date"]),
+        ]
+
+    #: Model name of the object, e.g. ``hpcgroup``.
+    object_type = models.CharField(max_length=16, help_text="Model name of the object")
+
+    #: UUID of the object.
+    object_uuid = models.UUIDField(help_text="UUID of the object")
+
+    #: Storage tier.
+    tier = models.CharField(max_length=64, help_text="Storage tier")
+
+    #: Used resources in the tier.
+    used = models.FloatField(help_text="Used resources in the tier")
+
+    #: Resolution of the sample.
+    resolution = models.CharField(
+        max_length=16,
+        choices=USAGE_RESOLUTION_CHOICES,
+        default=USAGE_RESOLUTION_RAW,
+        help_text="Resolution of the sample",
+    )
+
+    #: Date of the sample, the start of the period for downsampled samples.
+    date = models.DateTimeField(help_text="Date of the sample")
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_uuid} {self.tier}={self.used} ({self.date})"
+
+
+#: Email waiting for delivery.
+OUTBOX_STATUS_PENDING = "PENDING"
+
+#: Email delivered to the mail server.
+OUTBOX_STATUS_SENT = "SENT"
+
+#: Email given up after the maximum number of attempts.
+OUTBOX_STATUS_FAILED = "FAILED"
+
+#: Outbox email statuses.
+OUTBOX_STATUS_CHOICES = [
+    (OUTBOX_STATUS_PENDING, OUTBOX_STATUS_PENDING),
+    (OUTBOX_STATUS_SENT, OUTBOX_STATUS_SENT),
+    (OUTBOX_STATUS_FAILED, OUTBOX_STATUS_FAILED),
+]
+
+
+class OutboxEmailManager(models.Manager):
+    """Custom manager for outbox emails."""
+
+    def due(self, now=None):
+        """Return the pending emails whose next delivery attempt is due."""
+        return self.filter(
+            status=OUTBOX_STATUS_PENDING, next_attempt__lte=now or timezone.now()
+        ).order_by("id")
+
+    def purge(self, now=None):
+        """Delete the emails sent longer ago than ``EMAIL_OUTBOX_RETENTION_DAYS``."""
+        before = (now or timezone.now()) - timedelta(days=settings.EMAIL_OUTBOX_RETENTION_DAYS)
+        return self.filter(status=OUTBOX_STATUS_SENT, date_sent__lt=before).delete()[0]
+
+
+class OutboxEmail(models.Model):
+    """Rendered email stored with the transaction that triggered it, delivered by a worker."""
+
+    #: Set custom manager
+    objects = OutboxEmailManager()
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt"])]
+
+    #: Date of creation.
+    date_created = models.DateTimeField(auto_now_add=True, help_text="DateTime of creation")
+
+    #: Sender address.
+    from_email = models.CharField(max_length=254, help_text="Sender address")
+
+    #: Recipient addresses.
+    recipients = models.JSONField(default=list, help_text="Recipient addresses")
+
+    #: Subject line.
+    subject = models.TextField(help_text="Subject line")
+
+    #: Plain text body.
+    body = models.TextField(help_text="Plain text body")
+
+    #: HTML body sent as alternative to the plain text body.
+    body_html = models.TextField(blank=True, default="", help_text="HTML body")
+
+    #: Delivery status.
+    status = models.CharField(
+        max_length=16,
+        choices=OUTBOX_STATUS_CHOICES,
+        default=OUTBOX_STATUS_PENDING,
+        help_text="Delivery status",
+    )
+
+    #: Number of failed delivery attempts.
+    attempts = models.IntegerField(default=0, help_text="Number of failed delivery attempts")
+
+    #: Date of the next delivery attempt.
+    next_attempt = models.DateTimeField(
+        default=timezone.now, help_text="DateTime of the next delivery attempt"
+    )
+
+    #: Date of delivery.
+    date_sent = models.DateTimeField(null=True, blank=True, help_text="DateTime of delivery")
+
+    #: Error of the last failed delivery attempt.
+    error = models.TextField(blank=True, default="", help_text="Error of the last attempt")
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.recipients)} ({self.status})"
+
+    def mark_sent(self, now):
+        self.status = OUTBOX_STATUS_SENT
+        self.date_sent = now
+        self.error = ""
+
+    def mark_failed(self, error, now):
+        """Record a failed attempt and schedule the next one with exponential backoff."""
+        self.attempts += 1
+        self.error = error
+
+        if self.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+            self.status = OUTBOX_STATUS_FAILED
+        else:
+            delay = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.next_attempt = now + timedelta(seconds=delay)
+
+
 #: Object is initialized.
 TERMS_AUDIENCE_USER = "user"
 
@@ -2035,3 +2850,108 @@ class TermsAndConditions(HpcObjectAbstract):
 
     def __str__(self):
         return self.title
+
+
+class ConsentNotificationJob(models.Model):
+    """Notification of the users about published terms and conditions, sent in chunks."""
+
+    #: Date of creation.
+    date_created = models.DateTimeField(auto_now_add=True, help_text="DateTime of creation")
+
+    #: Date of the publication the users are notified about.
+    date_published = models.DateTimeField(help_text="Date of the publication")
+
+    #: Number of users to notify.
+    total = models.IntegerField(default=0, help_text="Number of users to notify")
+
+    #: Number of notifications sent.
+    sent = models.IntegerField(default=0, help_text="Number of notifications sent")
+
+    #: Number of notifications failed.
+    failed = models.IntegerField(default=0, help_text="Number of notifications failed")
+
+    def __str__(self):
+        return f"Consent notification of {self.date_published}: {self.get_processed()}/{self.total}"
+
+    def get_processed(self):
+        return self.sent + self.failed
+
+    def get_progress(self):
+        """Return the percentage of processed notifications."""
+        if self.is_done():
+            return 100
+
+        return min(int(100 * self.get_processed() / self.total), 99)
+
+    def is_done(self):
+        """Return whether all chunks have been sent.
+
+        Users consenting before their chunk is sent are not notified, so the number of processed
+        notifications can stay below the total.
+        """
+        return not self.chunk_set.filter(date_done__isnull=True).exists()
+
+
+class ConsentNotificationChunk(models.Model):
+    """Range of users of a consent notification job sent by one task."""
+
+    #: Job the chunk belongs to.
+    job = models.ForeignKey(
+        ConsentNotificationJob,
+        on_delete=models.CASCADE,
+        related_name="chunk_set",
+        help_text="Job the chunk belongs to",
+    )
+
+    #: Primary key of the first user of the chunk.
+    first_user_id = models.IntegerField(help_text="Primary key of the first user")
+
+    #: Primary key of the last user of the chunk.
+    last_user_id = models.IntegerField(help_text="Primary key of the last user")
+
+    #: Number of notifications sent.
+    sent = models.IntegerField(default=0, help_text="Number of notifications sent")
+
+    #: Number of notifications failed.
+    failed = models.IntegerField(default=0, help_text="Number of notifications failed")
+
+    #: Primary key of the last user notified, ``None`` until the first batch has been sent.
+    last_sent_user_id = models.IntegerField(
+        null=True, blank=True, help_text="Primary key of the last user notified"
+    )
+
+    #: Date until the chunk is claimed by a running task, other tasks skip it until then.
+    lease_until = models.DateTimeField(
+        null=True, blank=True, help_text="DateTime until the chunk is claimed by a task"
+    )
+
+    #: Date the chunk has been sent, ``None`` while pending.
+    date_done = models.DateTimeField(
+        null=True, blank=True, help_text="DateTime the chunk has been sent"
+    )
+
+    def __str__(self):
+        return f"{self.job_id}: users {self.first_user_id}-{self.last_user_id}"
+
+
+class DeletedHpcObject(models.Model):
+    """Tombstone of a user, group or project removed from the database.
+
+    Objects are usually only marked as deleted, tombstones report the hard deleted ones in
+    the state delta.
+    """
+
+    class Meta:
+        indexes = [models.Index(fields=["date_deleted"])]
+
+    #: Model name of the object, e.g. ``hpcgroup``.
+    object_type = models.CharField(max_length=16, help_text="Model name of the object")
+
+    #: UUID of the object.
+    object_uuid = models.UUIDField(help_text="UUID of the object")
+
+    #: Date of deletion.
+    date_deleted = models.DateTimeField(default=timezone.now, help_text="DateTime of deletion")
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_uuid}"
@@ -0,0 +1,231 @@
+"""Precomputed roles of a user, consulted by the predicates in ``usersec.rules``."""
+
+from dataclasses import dataclass
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils.functional import cached_property
+
+from hpc_access.users.models import User
+from hpc_access.utils.predicate_cache import is_predicate_cache_active, memoize
+from usersec.models import (
+    INVITATION_STATUS_PENDING,
+    REQUEST_STATUS_ACTIVE,
+    HpcGroup,
+    HpcGroupCreateRequest,
+    HpcGroupInvitation,
+    HpcProject,
+    HpcUser,
+)
+
+
+@dataclass(frozen=True)
+class UserRoles:
+    """Class to hold the HPC objects a user owns, delegates or belongs to."""
+
+    #: HpcUsers of the user.
+    hpcuser_ids: frozenset = frozenset()
+
+    #: Primary groups of the HpcUsers of the user.
+    group_ids: frozenset = frozenset()
+
+    #: Groups owned or delegated by the user.
+    owned_group_ids: frozenset = frozenset()
+    delegated_group_ids: frozenset = frozenset()
+
+    #: HpcUsers with a primary group owned or delegated by the user.
+    owned_group_hpcuser_ids: frozenset = frozenset()
+    delegated_group_hpcuser_ids: frozenset = frozenset()
+
+    #: Projects of groups owned or delegated by the user.
+    owned_project_ids: frozenset = frozenset()
+    group_delegated_project_ids: frozenset = frozenset()
+
+    #: Projects delegated by the user or having one of the HpcUsers of the user as member.
+    delegated_project_ids: frozenset = frozenset()
+    member_project_ids: frozenset = frozenset()
+
+    #: Whether the user has an active group create request or a pending group invitation.
+    has_pending_group_request: bool = False
+    has_group_invitation: bool = False
+
+
+def load_user_roles(user):
+    """Load the roles of ``user`` with two queries, four if the user is a cluster user."""
+    if user.pk is None:
+        return UserRoles()
+
+    flags = (
+        User.objects.filter(pk=user.pk)
+        .annotate(
+            has_pending_group_request=Exists(
+                HpcGroupCreateRequest.objects.filter(
+                    requester=OuterRef("pk"), status=REQUEST_STATUS_ACTIVE
+                )
+            ),
+            has_group_invitation=Exists(
+                HpcGroupInvitation.objects.filter(
+                    username=user.username, status=INVITATION_STATUS_PENDING
+                )
+            ),
+        )
+        .values("has_pending_group_request", "has_group_invitation")
+        .first()
+    ) or {}
+
+    hpcusers = list(
+        HpcUser.objects.filter(
+            Q(user=user)
+            | Q(primary_group__owner__user=user)
+            | Q(primary_group__delegate__user=user)
+        ).values_list(
+            "id",
+            "user_id",
+            "primary_group_id",
+            "primary_group__owner__user_id",
+            "primary_group__delegate__user_id",
+        )
+    )
+
+    if not any(user_id == user.pk for _, user_id, _, _, _ in hpcusers):
+        return UserRoles(**flags)
+
+    groups = list(
+        HpcGroup.objects.filter(Q(owner__user=user) | Q(delegate__user=user)).values_list(
+            "id", "owner__user_id", "delegate__user_id"
+        )
+    )
+    projects = list(
+        HpcProject.objects.filter(
+            Q(group__owner__user=user)
+            | Q(group__delegate__user=user)
+            | Q(delegate__user=user)
+            | Q(members__user=user)
+        )
+        .annotate(
+            is_member=Exists(
+                HpcProject.members.through.objects.filter(
+                    hpcproject=OuterRef("pk"), hpcuser__user=user
+                )
+            )
+        )
+        .distinct()
+        .values_list(
+            "id",
+            "group__owner__user_id",
+            "group__delegate__user_id",
+            "delegate__user_id",
+            "is_member",
+        )
+    )
+
+    return UserRoles(
+        hpcuser_ids=frozenset(pk for pk, user_id, _, _, _ in hpcusers if user_id == user.pk),
+        group_ids=frozenset(
+            group_id for _, user_id, group_id, _, _ in hpcusers if user_id == user.pk and group_id
+        ),
+        owned_group_ids=frozenset(pk for pk, owner, _ in groups if owner == user.pk),
+        delegated_group_ids=frozenset(pk for pk, _, delegate in groups if delegate == user.pk),
+        owned_group_hpcuser_ids=frozenset(
+            pk for pk, _, _, owner, _ in hpcusers if owner == user.pk
+        ),
+        delegated_group_hpcuser_ids=frozenset(
+            pk for pk, _, _, _, delegate in hpcusers if delegate == user.pk
+        ),
+        owned_project_ids=frozenset(pk for pk, owner, _, _, _ in projects if owner == user.pk),
+        group_delegated_project_ids=frozenset(
+            pk for pk, _, delegate, _, _ in projects if delegate == user.pk
+        ),
+        delegated_project_ids=frozenset(
+            pk for pk, _, _, delegate, _ in projects if delegate == user.pk
+        ),
+        member_project_ids=frozenset(pk for pk, _, _, _, is_member in projects if is_member),
+        **flags,
+    )
+
+
+class LazyUserRoles:
+    """Roles of a user loaded one by one on first access, each with a single query.
+
+    Used outside of a request, where the roles are not reused and a predicate usually reads
+    only one of them.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    def _ids(self, queryset, field="id"):
+        return frozenset(queryset.values_list(field, flat=True))
+
+    @cached_property
+    def hpcuser_ids(self):
+        return self._ids(HpcUser.objects.filter(user=self.user))
+
+    @cached_property
+    def group_ids(self):
+        return self._ids(
+            HpcUser.objects.filter(user=self.user, primary_group__isnull=False),
+            "primary_group_id",
+        )
+
+    @cached_property
+    def owned_group_ids(self):
+        return self._ids(HpcGroup.objects.filter(owner__user=self.user))
+
+    @cached_property
+    def delegated_group_ids(self):
+        return self._ids(HpcGroup.objects.filter(delegate__user=self.user))
+
+    @cached_property
+    def owned_group_hpcuser_ids(self):
+        return self._ids(HpcUser.objects.filter(primary_group__owner__user=self.user))
+
+    @cached_property
+    def delegated_group_hpcuser_ids(self):
+        return self._ids(HpcUser.objects.filter(primary_group__delegate__user=self.user))
+
+    @cached_property
+    def owned_project_ids(self):
+        return self._ids(HpcProject.objects.filter(group__owner__user=self.user))
+
+    @cached_property
+    def group_delegated_project_ids(self):
+        return self._ids(HpcProject.objects.filter(group__delegate__user=self.user))
+
+    @cached_property
+    def delegated_project_ids(self):
+        return self._ids(HpcProject.objects.filter(delegate__user=self.user))
+
+    @cached_property
+    def member_project_ids(self):
+        return self._ids(HpcProject.objects.filter(members__user=self.user))
+
+    @cached_property
+    def has_pending_group_request(self):
+        return HpcGroupCreateRequest.objects.filter(
+            requester=self.user, status=REQUEST_STATUS_ACTIVE
+        ).exists()
+
+    @cached_property
+    def has_group_invitation(self):
+        return HpcGroupInvitation.objects.filter(
+            username=self.user.username, status=INVITATION_STATUS_PENDING
+        ).exists()
+
+
+@memoize
+def _get_user_roles(user):
+    return load_user_roles(user)
+
+
+def get_user_roles(user):
+    """Return the roles of ``user``, loaded once per request.
+
+    Outside of a request each role is loaded on its own when read, see ``LazyUserRoles``.
+    """
+    if user.pk is None:
+        return UserRoles()
+
+    if not is_predicate_cache_active():
+        return LazyUserRoles(user)
+
+    return _get_user_roles(user)
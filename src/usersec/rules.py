@@ -2,7 +2,7 @@ import rules
 from django.conf import settings
 
 from adminsec.rules import is_hpcadmin
-from usersec.models import INVITATION_STATUS_PENDING, REQUEST_STATUS_ACTIVE, HpcGroupInvitation
+from usersec.roles import get_user_roles
 
 # ------------------------------------------------------------------------------
 # Predicates
@@ -15,19 +15,17 @@ from usersec.models import INVITATION_STATUS_PENDING, REQUEST_STATUS_ACTIVE, Hpc
 
 @rules.predicate
 def is_cluster_user(user):
-    return user.hpcuser_user.exists()
+    return bool(get_user_roles(user).hpcuser_ids)
 
 
 @rules.predicate
 def _has_pending_group_request(user):
-    return user.hpcgroupcreaterequest_requester.filter(status=REQUEST_STATUS_ACTIVE).exists()
+    return get_user_roles(user).has_pending_group_request
 
 
 @rules.predicate
 def _has_group_invitation(user):
-    return HpcGroupInvitation.objects.filter(
-        username=user.username, status=INVITATION_STATUS_PENDING
-    ).exists()
+    return get_user_roles(user).has_group_invitation
 
 
 @rules.predicate
@@ -54,7 +52,7 @@ def _is_hpcuser(user, hpcuser):
     if hpcuser is None:
         raise ValueError("HpcUser is None")
 
-    return hpcuser.user == user
+    return hpcuser.pk in get_user_roles(user).hpcuser_ids
 
 
 @rules.predicate
@@ -62,16 +60,10 @@ def _is_pi_of_hpcuser(user, hpcuser):
     if hpcuser is None:
         raise ValueError("HpcUser is None")
 
-    if hpcuser.primary_group is None:
+    if hpcuser.primary_group_id is None:
         raise ValueError("HpcUser has no primary group")
 
-    if hpcuser.primary_group.owner is None:
-        raise ValueError("Primary group of HpcUser has no owner")
-
-    owner = hpcuser.primary_group.owner
-
-    if owner:
-        return owner.user == user
+    return hpcuser.primary_group_id in get_user_roles(user).owned_group_ids
 
 
 @rules.predicate
@@ -79,15 +71,10 @@ def _is_delegate_of_hpcuser(user, hpcuser):
     if hpcuser is None:
         raise ValueError("HpcUser is None")
 
-    if hpcuser.primary_group is None:
+    if hpcuser.primary_group_id is None:
         raise ValueError("HpcUser has no primary group")
 
-    delegate = hpcuser.primary_group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcuser.primary_group_id in get_user_roles(user).delegated_group_ids
 
 
 is_hpcuser = ~is_hpcadmin & is_cluster_user & _is_hpcuser
@@ -108,7 +95,7 @@ def _is_group_requester(user, hpcgroupcreaterequest):
     if hpcgroupcreaterequest is None:
         raise ValueError("HpcGroupCreateRequest is None")
 
-    return hpcgroupcreaterequest.requester == user
+    return hpcgroupcreaterequest.requester_id == user.pk
 
 
 is_group_requester = ~is_hpcadmin & _is_group_requester
@@ -126,12 +113,7 @@ def _is_group_owner_by_hpcgroupchangerequest(user, hpcgroupchangerequest):
     if hpcgroupchangerequest is None:
         raise ValueError("HpcGroupChangeRequest is None")
 
-    owner = hpcgroupchangerequest.group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcgroupchangerequest.group_id in get_user_roles(user).owned_group_ids
 
 
 @rules.predicate
@@ -139,12 +121,7 @@ def _is_group_delegate_by_hpcgroupchangerequest(user, hpcgroupchangerequest):
     if hpcgroupchangerequest is None:
         raise ValueError("HpcGroupChangeRequest is None")
 
-    delegate = hpcgroupchangerequest.group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcgroupchangerequest.group_id in get_user_roles(user).delegated_group_ids
 
 
 is_group_owner_by_hpcgroupchangerequest = (
@@ -171,12 +148,7 @@ def _is_group_owner_by_hpcprojectcreaterequest(user, hpcprojectcreaterequest):
     if hpcprojectcreaterequest is None:
         raise ValueError("HpcProjectCreateRequest is None")
 
-    owner = hpcprojectcreaterequest.group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcprojectcreaterequest.group_id in get_user_roles(user).owned_group_ids
 
 
 @rules.predicate
@@ -184,12 +156,7 @@ def _is_group_delegate_by_hpcprojectcreaterequest(user, hpcprojectcreaterequest)
     if hpcprojectcreaterequest is None:
         raise ValueError("HpcProjectCreateRequest is None")
 
-    delegate = hpcprojectcreaterequest.group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcprojectcreaterequest.group_id in get_user_roles(user).delegated_group_ids
 
 
 is_group_owner_by_hpcprojectcreaterequest = (
@@ -216,12 +183,7 @@ def _is_project_owner_by_hpcprojectchangerequest(user, hpcprojectchangerequest):
     if hpcprojectchangerequest is None:
         raise ValueError("HpcProjectChangeRequest is None")
 
-    owner = hpcprojectchangerequest.project.group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcprojectchangerequest.project_id in get_user_roles(user).owned_project_ids
 
 
 @rules.predicate
@@ -229,12 +191,7 @@ def _is_project_delegate_by_hpcprojectchangerequest(user, hpcprojectchangereques
     if hpcprojectchangerequest is None:
         raise ValueError("HpcProjectChangeRequest is None")
 
-    delegate = hpcprojectchangerequest.project.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcprojectchangerequest.project_id in get_user_roles(user).delegated_project_ids
 
 
 @rules.predicate
@@ -242,12 +199,7 @@ def _is_group_delegate_by_hpcprojectchangerequest(user, hpcprojectchangerequest)
     if hpcprojectchangerequest is None:
         raise ValueError("HpcProjectChangeRequest is None")
 
-    delegate = hpcprojectchangerequest.project.group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcprojectchangerequest.project_id in get_user_roles(user).group_delegated_project_ids
 
 
 is_project_owner_by_hpcprojectchangerequest = (
@@ -281,12 +233,7 @@ def _is_group_owner_by_hpcusercreaterequest(user, hpcusercreaterequest):
     if hpcusercreaterequest is None:
         raise ValueError("HpcUserCreateRequest is None")
 
-    owner = hpcusercreaterequest.group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcusercreaterequest.group_id in get_user_roles(user).owned_group_ids
 
 
 @rules.predicate
@@ -294,12 +241,7 @@ def _is_group_delegate_by_hpcusercreaterequest(user, hpcusercreaterequest):
     if hpcusercreaterequest is None:
         raise ValueError("HpcUserCreateRequest is None")
 
-    delegate = hpcusercreaterequest.group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcusercreaterequest.group_id in get_user_roles(user).delegated_group_ids
 
 
 is_group_owner_by_hpcusercreaterequest = (
@@ -326,12 +268,7 @@ def _is_group_owner_by_hpcuserchangerequest(user, hpcuserchangerequest):
     if hpcuserchangerequest is None:
         raise ValueError("HpcUserChangeRequest is None")
 
-    owner = hpcuserchangerequest.user.primary_group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcuserchangerequest.user_id in get_user_roles(user).owned_group_hpcuser_ids
 
 
 @rules.predicate
@@ -339,12 +276,7 @@ def _is_group_delegate_by_hpcuserchangerequest(user, hpcuserchangerequest):
     if hpcuserchangerequest is None:
         raise ValueError("HpcUserChangeRequest is None")
 
-    delegate = hpcuserchangerequest.user.primary_group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcuserchangerequest.user_id in get_user_roles(user).delegated_group_hpcuser_ids
 
 
 is_group_owner_by_hpcusercreaterequest = (
@@ -371,12 +303,7 @@ def _is_group_owner_by_hpcuserdeleterequest(user, hpcuserdeleterequest):
     if hpcuserdeleterequest is None:
         raise ValueError("HpcUserDeleteRequest is None")
 
-    owner = hpcuserdeleterequest.user.primary_group.owner
-
-    if owner:
-        return owner.user == user
-
-    return False
+    return hpcuserdeleterequest.user_id in get_user_roles(user).owned_group_hpcuser_ids
 
 
 @rules.predicate
@@ -384,12 +311,7 @@ def _is_group_delegate_by_hpcuserdeleterequest(user, hpcuserdeleterequest):
     if hpcuserdeleterequest is None:
         raise ValueError("HpcUserDeleteRequest is None")
 
-    delegate = hpcuserdeleterequest.user.primary_group.delegate
-
-    if delegate:
-        return delegate.user == user
-
-    return False
+    return hpcuserdeleterequest.user_id in get_user_roles(user).delegated_group_hpcuser_ids
 
 
 is_group_owner_by_hpcuserdeleterequest = (
@@ -416,7 +338,7 @@ def _is_group_member(user, group):
     if group is None:
         raise ValueError("HpcGroup is None")
 
-    return group.hpcuser.filter(user=user).exists()
+    return group.pk in get_user_roles(user).group_ids
 
 
 @rules.predicate
@@ -424,7 +346,7 @@ def _is_group_owner(user, group):
     if group is None:
         raise ValueError("HpcGroup is None")
 
-    return user.hpcuser_user.filter(hpcgroup_owner=group).exists()
+    return group.pk in get_user_roles(user).owned_group_ids
 
 
 @rules.predicate
@@ -432,7 +354,7 @@ def _is_group_delegate(user, group):
     if group is None:
         raise ValueError("HpcGroup is None")
 
-    return user.hpcuser_user.filter(hpcgroup_delegate=group).exists()
+    return group.pk in get_user_roles(user).delegated_group_ids
 
 
 is_group_member = ~is_hpcadmin & is_cluster_user & _is_group_member
@@ -455,7 +377,7 @@ def _is_project_member(user, project):
     if project is None:
         raise ValueError("HpcProject is None")
 
-    return project.members.contains(user.hpcuser_user.first())
+    return project.pk in get_user_roles(user).member_project_ids
 
 
 @rules.predicate
@@ -463,7 +385,7 @@ def _is_project_owner(user, project):
     if project is None:
         raise ValueError("HpcProject is None")
 
-    return project.group.owner == user.hpcuser_user.first()
+    return project.pk in get_user_roles(user).owned_project_ids
 
 
 @rules.predicate
@@ -471,7 +393,7 @@ def _is_project_delegate(user, project):
     if project is None:
         raise ValueError("HpcProject is None")
 
-    return user.hpcuser_user.filter(hpcproject_delegate=project).exists()
+    return project.pk in get_user_roles(user).delegated_project_ids
 
 
 @rules.predicate
@@ -479,7 +401,7 @@ def _is_associated_group_delegate(user, project):
     if project is None:
         raise ValueError("HpcProject is None")
 
-    return user.hpcuser_user.filter(hpcgroup_delegate=project.group).exists()
+    return project.group_id in get_user_roles(user).delegated_group_ids
 
 
 is_project_member = ~is_hpcadmin & is_cluster_user & _is_project_member
@@ -516,7 +438,7 @@ def _is_project_invited_user(user, hpcprojectinvitation):
     if hpcprojectinvitation is None:
         raise ValueError("HpcProjectInvitation is None")
 
-    return user.hpcuser_user.filter(id=hpcprojectinvitation.user.id).exists()
+    return hpcprojectinvitation.user_id in get_user_roles(user).hpcuser_ids
 
 
 can_manage_hpcprojectinvitation = ~is_hpcadmin & is_cluster_user & _is_project_invited_user
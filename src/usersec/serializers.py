@@ -17,6 +17,7 @@ from usersec.models import (
     HpcProjectVersion,
     HpcUser,
     HpcUserVersion,
+    ResourceUsageSample,
 )
 
 HPC_ALUMNI_GROUP = "hpc-alumnis"
@@ -452,3 +453,16 @@ class HpcUserLookupSerializer(serializers.ModelSerializer):
             "primary_group",
             "full_name",
         ]
+
+
+class ResourceUsageSampleSerializer(serializers.ModelSerializer):
+    """Serializer for ResourceUsageSample model."""
+
+    class Meta:
+        model = ResourceUsageSample
+        fields = [
+            "tier",
+            "used",
+            "resolution",
+            "date",
+        ]
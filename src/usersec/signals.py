@@ -0,0 +1,70 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+
+from hpc_access.users.models import User
+from hpc_access.utils.predicate_cache import clear_predicate_cache
+from usersec.models import (
+    DeletedHpcObject,
+    HpcGroup,
+    HpcGroupCreateRequest,
+    HpcGroupInvitation,
+    HpcProject,
+    HpcUser,
+)
+
+#: Fields of ``User`` rendered as part of the HPC user.
+HPCUSER_USER_FIELDS = {"email", "name", "first_name", "last_name", "display_name", "phone"}
+
+
+def touch_projects_on_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update ``date_modified`` of projects whose members changed.
+
+    Member changes do not save the project, but clients polling for changes rely on
+    ``date_modified``.
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if not reverse:
+        project_ids = [instance.pk]
+    elif action == "pre_clear":
+        project_ids = list(instance.hpcproject_members.values_list("pk", flat=True))
+    else:
+        project_ids = pk_set
+
+    if project_ids:
+        HpcProject.objects.filter(pk__in=project_ids).update(date_modified=timezone.now())
+
+
+m2m_changed.connect(touch_projects_on_members_changed, sender=HpcProject.members.through)
+
+
+def touch_hpcusers_on_user_changed(sender, instance, created, update_fields, **kwargs):
+    """Update ``date_modified`` of the HPC users of a changed Django user.
+
+    The HPC users render fields of the Django user, clients polling for changes rely on
+    ``date_modified``.  Saves limited to other fields, e.g. on login, are ignored.
+    """
+    if created or (update_fields is not None and not HPCUSER_USER_FIELDS & set(update_fields)):
+        return
+
+    HpcUser.objects.filter(user=instance).update(date_modified=timezone.now())
+
+
+def record_deleted_hpc_object(sender, instance, **kwargs):
+    """Leave a tombstone for a user, group or project removed from the database."""
+    DeletedHpcObject.objects.create(
+        object_type=instance._meta.model_name, object_uuid=instance.uuid
+    )
+
+
+post_save.connect(touch_hpcusers_on_user_changed, sender=User)
+
+for model in (HpcUser, HpcGroup, HpcProject):
+    post_delete.connect(record_deleted_hpc_object, sender=model)
+
+for model in (HpcUser, HpcGroup, HpcProject, HpcGroupCreateRequest, HpcGroupInvitation):
+    post_save.connect(clear_predicate_cache, sender=model)
+    post_delete.connect(clear_predicate_cache, sender=model)
+
+m2m_changed.connect(clear_predicate_cache, sender=HpcProject.members.through)
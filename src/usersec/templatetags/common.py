@@ -115,6 +115,15 @@ def get_posix_project_name(name):
     return f"{POSIX_PROJECT_PREFIX}{name}"
 
 
+@register.filter
+def quota_report(obj, reports):
+    """Return the quota report of ``obj`` from the ``reports`` loaded by the view."""
+    if reports and obj in reports:
+        return reports[obj]
+
+    return obj.generate_quota_report()
+
+
 @register.filter
 def storage_progress_color(status):
     """Return the color for the storage progress."""
@@ -22,6 +22,8 @@ from usersec.models import (
     HpcUserChangeRequest,
     HpcUserCreateRequest,
     HpcUserDeleteRequest,
+    OutboxEmail,
+    ResourceUsageSample,
     TermsAndConditions,
 )
 
@@ -392,3 +394,28 @@ class TermsAndConditionsFactory(factory.django.DjangoModelFactory):
 
     title = "AGBs"
     text = "Some terms and some conditions."
+
+
+class ResourceUsageSampleFactory(factory.django.DjangoModelFactory):
+    """Factory for ResourceUsageSample model"""
+
+    class Meta:
+        model = ResourceUsageSample
+
+    object_type = "hpcgroup"
+    object_uuid = factory.Faker("uuid4")
+    tier = "tier1_work"
+    used = 1.0
+    date = datetime(2025, 1, 1, tzinfo=utc)
+
+
+class OutboxEmailFactory(factory.django.DjangoModelFactory):
+    """Factory for OutboxEmail model"""
+
+    class Meta:
+        model = OutboxEmail
+
+    from_email = "sender@example.com"
+    recipients = ["user@example.com"]
+    subject = "Subject"
+    body = "Content"
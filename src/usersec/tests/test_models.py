@@ -1,5 +1,12 @@
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest.mock import patch
+
 from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 from factory import LazyAttribute, SubFactory
 from test_plus.test import TestCase
 
@@ -17,6 +24,11 @@ from usersec.models import (
     REQUEST_STATUS_RETRACTED,
     REQUEST_STATUS_REVISION,
     TERMS_AUDIENCE_ALL,
+    USAGE_RESOLUTION_DAILY,
+    USAGE_RESOLUTION_HOURLY,
+    USAGE_RESOLUTION_RAW,
+    VERSION_USAGE_POLICY_SKIP,
+    VERSION_USAGE_POLICY_VERSION,
     HpcGroup,
     HpcGroupChangeRequest,
     HpcGroupChangeRequestVersion,
@@ -46,11 +58,19 @@ from usersec.models import (
     HpcUserDeleteRequest,
     HpcUserDeleteRequestVersion,
     HpcUserVersion,
+    IdCounter,
+    ResourceUsageSample,
     TermsAndConditions,
+    compute_quota_report,
     get_next_hpcgroup_gid,
     get_next_hpcproject_gid,
     get_next_hpcuser_uid,
+    get_quota_reports,
+    get_versioned_models,
     parse_email,
+    record_usage_samples,
+    refresh_quota_status,
+    select_versions_to_compact,
     user_active,
 )
 from usersec.tests.factories import (
@@ -68,6 +88,7 @@ from usersec.tests.factories import (
     HpcUserCreateRequestFactory,
     HpcUserDeleteRequestFactory,
     HpcUserFactory,
+    ResourceUsageSampleFactory,
     TermsAndConditionsFactory,
     hpc_obj_to_dict,
     hpc_version_obj_to_dict,
@@ -376,7 +397,9 @@ class VersionTesterMixin:
     def _test_get_latest_version(self, **update):
         obj = self.factory()
         obj.update_with_version(**update)
-        self.assertEqual(obj.get_latest_version(), self.version_model.objects.last())
+        with self.assertNumQueries(1):
+            latest = obj.get_latest_version()
+        self.assertEqual(latest, self.version_model.objects.last())
 
     def _test_get_latest_version_not_available(self):
         obj = self.model()
@@ -491,6 +514,254 @@ class PendingRequestTesterMixin:
         self.assertFalse(obj.has_pending_requests())
 
 
+class TestVersionManagerBulk(TestCase):
+    """Tests for the bulk versioned operations of VersionManager."""
+
+    def setUp(self):
+        self.group = HpcGroupFactory()
+        self.hpcuser1 = HpcUserFactory(primary_group=self.group)
+        self.hpcuser2 = HpcUserFactory(primary_group=self.group)
+
+    def test_bulk_create_with_version(self):
+        projects = [
+            HpcProjectFactory.build(group=self.group, creator=self.group.creator) for _ in range(3)
+        ]
+
+        HpcProject.objects.bulk_create_with_version(
+            projects, m2m={"members": [[self.hpcuser1], [self.hpcuser1, self.hpcuser2], []]}
+        )
+
+        self.assertEqual(HpcProject.objects.count(), 3)
+        self.assertEqual(HpcProjectVersion.objects.count(), 3)
+        for project, count in zip(projects, (1, 2, 0), strict=True):
+            version = project.get_latest_version()
+            self.assertEqual(project.current_version, 1)
+            self.assertEqual(version.version, 1)
+            self.assertEqual(version.name, project.name)
+            self.assertEqual(project.members.count(), count)
+            self.assertEqual(version.members.count(), count)
+
+    def test_bulk_update_with_version(self):
+        project1 = HpcProjectFactory(group=self.group)
+        project1.description = "changed"
+        project1.save_with_version()
+        project1.members.add(self.hpcuser1, self.hpcuser2)
+        project2 = HpcProjectFactory(group=self.group)
+
+        for project in (project1, project2):
+            project.description = "bulk"
+
+        with self.assertNumQueries(7):
+            HpcProject.objects.bulk_update_with_version([project1, project2], ["description"])
+
+        project1.refresh_from_db()
+        project2.refresh_from_db()
+        self.assertEqual(project1.current_version, 3)
+        self.assertEqual(project2.current_version, 2)
+        self.assertEqual(project1.get_latest_version().description, "bulk")
+        self.assertEqual(project2.get_latest_version().description, "bulk")
+        self.assertEqual(project1.get_latest_version().members.count(), 2)
+        self.assertEqual(project2.get_latest_version().members.count(), 0)
+
+    def test_bulk_update_with_version_empty(self):
+        self.assertEqual(HpcProject.objects.bulk_update_with_version([], ["description"]), [])
+        self.assertEqual(HpcProjectVersion.objects.count(), 0)
+
+
+class TestVersionUsagePolicy(TestCase):
+    """Tests for the handling of usage-only changes by the versioned saves."""
+
+    def setUp(self):
+        self.group = HpcGroupFactory()
+        self.hpcuser1 = HpcUserFactory(primary_group=self.group)
+        self.hpcuser2 = HpcUserFactory(primary_group=self.group)
+
+    def _save_usage(self):
+        self.hpcuser1.resources_used = {TIER_USER_HOME: 0.95}
+        self.hpcuser1.save_with_version()
+        self.hpcuser1.refresh_from_db()
+        return self.hpcuser1.version_history.order_by("version").last()
+
+    def test_save_with_version_coalesce(self):
+        latest = self._save_usage()
+
+        self.assertEqual(self.hpcuser1.current_version, 1)
+        self.assertEqual(self.hpcuser1.version_history.count(), 1)
+        self.assertEqual(latest.resources_used, {TIER_USER_HOME: 0.95})
+        self.assertEqual(self.hpcuser1.get_quota_status(), HpcQuotaStatus.YELLOW)
+
+    @override_settings(VERSION_USAGE_POLICY=VERSION_USAGE_POLICY_SKIP)
+    def test_save_with_version_skip(self):
+        latest = self._save_usage()
+
+        self.assertEqual(self.hpcuser1.current_version, 1)
+        self.assertEqual(self.hpcuser1.resources_used, {TIER_USER_HOME: 0.95})
+        self.assertEqual(latest.resources_used, {TIER_USER_HOME: 0.5})
+
+    @override_settings(VERSION_USAGE_POLICY=VERSION_USAGE_POLICY_VERSION)
+    def test_save_with_version_version(self):
+        latest = self._save_usage()
+
+        self.assertEqual(self.hpcuser1.current_version, 2)
+        self.assertEqual(latest.resources_used, {TIER_USER_HOME: 0.95})
+
+    def test_save_with_version_other_changes(self):
+        self.hpcuser1.description = "changed"
+        latest = self._save_usage()
+
+        self.assertEqual(self.hpcuser1.current_version, 2)
+        self.assertEqual(latest.description, "changed")
+
+    def test_save_with_version_no_changes(self):
+        self.hpcuser1.save_with_version()
+
+        self.assertEqual(self.hpcuser1.current_version, 2)
+
+    def test_bulk_update_with_version_coalesce(self):
+        for hpcuser in (self.hpcuser1, self.hpcuser2):
+            hpcuser.resources_used = {TIER_USER_HOME: 1.0}
+
+        with self.assertNumQueries(5):
+            HpcUser.objects.bulk_update_with_version(
+                [self.hpcuser1, self.hpcuser2], ["resources_used"]
+            )
+
+        for hpcuser in (self.hpcuser1, self.hpcuser2):
+            hpcuser.refresh_from_db()
+            self.assertEqual(hpcuser.current_version, 1)
+            self.assertEqual(hpcuser.get_quota_status(), HpcQuotaStatus.RED)
+            self.assertEqual(hpcuser.get_latest_version().resources_used, {TIER_USER_HOME: 1.0})
+
+    @override_settings(VERSION_USAGE_POLICY=VERSION_USAGE_POLICY_SKIP)
+    def test_bulk_update_with_version_skip(self):
+        self.hpcuser1.resources_used = {TIER_USER_HOME: 1.0}
+
+        HpcUser.objects.bulk_update_with_version([self.hpcuser1], ["resources_used"])
+
+        self.hpcuser1.refresh_from_db()
+        self.assertEqual(self.hpcuser1.resources_used, {TIER_USER_HOME: 1.0})
+        self.assertEqual(self.hpcuser1.get_latest_version().resources_used, {TIER_USER_HOME: 0.5})
+
+
+class TestCompactVersionHistory(TestCase):
+    """Tests for the compaction of the version history."""
+
+    def setUp(self):
+        self.hpcuser = HpcUserFactory()
+        self.hpcuser.update_with_version(description="change 0")
+        self.hpcuser.save_with_version()
+        self.hpcuser.save_with_version()
+        self.hpcuser.delete_with_version()
+        self.hpcuser.save_with_version()
+        self.hpcuser.update_with_version(description="change 1")
+        self.past = timezone.now() - timedelta(days=settings.VERSION_HISTORY_RETENTION_DAYS + 1)
+        HpcUserVersion.objects.update(date_created=self.past)
+
+    def _versions(self, obj):
+        return list(obj.version_history.order_by("version").values_list("version", flat=True))
+
+    def test_select_versions_to_compact(self):
+        now = timezone.now()
+        versions = [
+            {"id": 1, "status": "A", "name": "a", "date_created": self.past},
+            {"id": 2, "status": "A", "name": "a", "date_created": self.past},
+            {"id": 3, "status": "A", "name": "a", "date_created": self.past},
+            {"id": 4, "status": "A", "name": "a", "date_created": self.past, "comment": "note"},
+            {"id": 5, "status": "A", "name": "b", "date_created": self.past},
+            {"id": 6, "status": "A", "name": "b", "date_created": self.past},
+            {"id": 7, "status": "B", "name": "b", "date_created": self.past},
+            {"id": 8, "status": "B", "name": "b", "date_created": now},
+            {"id": 9, "status": "B", "name": "b", "date_created": now},
+        ]
+
+        self.assertEqual(select_versions_to_compact(versions, now), [2, 5])
+
+    def test_compact_version_history(self):
+        progress = list(HpcUser.objects.compact_version_history())
+
+        self.assertEqual(progress, [{"last_pk": self.hpcuser.pk, "objects": 1, "deleted": 2}])
+        self.assertEqual(self._versions(self.hpcuser), [1, 4, 5, 6, 7])
+        self.assertEqual(self.hpcuser.get_latest_version().description, "change 1")
+
+    def test_compact_version_history_changed_fields(self):
+        hpcuser2 = HpcUserFactory()
+
+        for i in range(3):
+            hpcuser2.update_with_version(description=f"change {i}")
+
+        HpcUserVersion.objects.update(date_created=self.past)
+
+        list(HpcUser.objects.compact_version_history())
+
+        self.assertEqual(self._versions(hpcuser2), [1, 2, 3, 4])
+
+    def test_compact_version_history_changed_members(self):
+        project = HpcProjectFactory()
+        project.save_with_version()
+        project.get_latest_version().members.add(self.hpcuser)
+        project.save_with_version()
+        HpcProjectVersion.objects.update(date_created=self.past)
+
+        list(HpcProject.objects.compact_version_history())
+
+        self.assertEqual(self._versions(project), [1, 2, 3])
+
+    def test_compact_version_history_retention(self):
+        HpcUserVersion.objects.filter(version__gte=3).update(date_created=timezone.now())
+
+        list(HpcUser.objects.compact_version_history())
+
+        self.assertEqual(self._versions(self.hpcuser), [1, 3, 4, 5, 6, 7])
+
+    def test_compact_version_history_dry_run(self):
+        progress = list(HpcUser.objects.compact_version_history(dry_run=True))
+
+        self.assertEqual(progress[0]["deleted"], 2)
+        self.assertEqual(self._versions(self.hpcuser), [1, 2, 3, 4, 5, 6, 7])
+
+    def test_compact_version_history_batches(self):
+        hpcuser2 = HpcUserFactory()
+        hpcuser2.save_with_version()
+        hpcuser2.save_with_version()
+        HpcUserVersion.objects.update(date_created=self.past)
+
+        with self.assertNumQueries(11):
+            progress = list(HpcUser.objects.compact_version_history(batch_size=1))
+
+        self.assertEqual([p["deleted"] for p in progress], [2, 1])
+        self.assertEqual(self._versions(hpcuser2), [1, 3])
+
+    def test_compact_version_history_start_after(self):
+        progress = list(HpcUser.objects.compact_version_history(start_after=self.hpcuser.pk))
+
+        self.assertEqual(progress, [])
+        self.assertEqual(len(self._versions(self.hpcuser)), 7)
+
+    def test_compact_version_history_comments(self):
+        request = HpcGroupCreateRequestFactory(comment="first")
+        request.update_with_version(comment="")
+        request.update_with_version(comment="question")
+        request.update_with_version(comment="")
+        request.update_with_version(comment="")
+        HpcGroupCreateRequestVersion.objects.update(date_created=self.past)
+
+        list(HpcGroupCreateRequest.objects.compact_version_history())
+
+        self.assertEqual(self._versions(request), [1, 2, 3, 5])
+        self.assertEqual(
+            list(request.version_history.order_by("version").values_list("comment", flat=True)),
+            ["first", "", "question", ""],
+        )
+
+    def test_get_versioned_models(self):
+        models = get_versioned_models()
+
+        self.assertIn(HpcUser, models)
+        self.assertIn(HpcProjectInvitation, models)
+        self.assertNotIn(HpcUserVersion, models)
+        self.assertNotIn(TermsAndConditions, models)
+
+
 class TestGetNextIdFunctions(TestCase):
     def test_get_next_hpcuser_id(self):
         HpcUserFactory(uid=2000)
@@ -519,6 +790,22 @@ class TestGetNextIdFunctions(TestCase):
         HpcProjectFactory(gid=None)
         self.assertEqual(get_next_hpcproject_gid(), 1)
 
+    def test_get_next_hpcuser_id_consecutive(self):
+        HpcUserFactory(uid=2000)
+        self.assertEqual(get_next_hpcuser_uid(), 2001)
+        self.assertEqual(get_next_hpcuser_uid(), 2002)
+
+    def test_get_next_hpcuser_id_not_reused(self):
+        hpcuser = HpcUserFactory(uid=2000)
+        self.assertEqual(get_next_hpcuser_uid(), 2001)
+        hpcuser.delete()
+        self.assertEqual(get_next_hpcuser_uid(), 2002)
+
+    def test_get_next_hpcgroup_id_counter(self):
+        HpcGroupFactory(gid=5000)
+        get_next_hpcgroup_gid()
+        self.assertEqual(IdCounter.objects.get(name="hpcgroup_gid").last_value, 5001)
+
 
 class TestHpcUser(VersionTesterMixin, PendingRequestTesterMixin, TestCase):
     """Tests for HpcUser model"""
@@ -719,6 +1006,118 @@ class TestHpcUser(VersionTesterMixin, PendingRequestTesterMixin, TestCase):
 
         self.assertDictEqual(user.generate_quota_report(), expected)
 
+    def test_generate_quota_report_memoized(self):
+        user = self.factory(
+            resources_requested={TIER_USER_HOME: 20},
+            resources_used={TIER_USER_HOME: 10},
+            home_directory="/home/users",
+        )
+
+        with patch(
+            "usersec.models.compute_quota_report", wraps=compute_quota_report
+        ) as compute_mock:
+            report = user.generate_quota_report()
+            self.assertIs(user.generate_quota_report(), report)
+            user.resources_used = {TIER_USER_HOME: 20}
+            report = user.generate_quota_report()
+
+        self.assertEqual(compute_mock.call_count, 2)
+        self.assertEqual(report["status"], {TIER_USER_HOME: HpcQuotaStatus.RED})
+
+    def test_get_quota_reports_cached(self):
+        cache.clear()
+        user = self.factory(
+            resources_requested={TIER_USER_HOME: 20},
+            resources_used={TIER_USER_HOME: 10},
+            home_directory="/home/users",
+        )
+
+        with patch(
+            "usersec.models.compute_quota_report", wraps=compute_quota_report
+        ) as compute_mock:
+            reports = get_quota_reports(HpcUser.objects.all())
+            self.assertEqual(reports, get_quota_reports(HpcUser.objects.all()))
+            self.assertEqual(compute_mock.call_count, 1)
+
+            user.resources_used = {TIER_USER_HOME: 20}
+            user.save_with_version()
+            reports = get_quota_reports(HpcUser.objects.all())
+            self.assertEqual(compute_mock.call_count, 2)
+
+        self.assertEqual(reports[user]["status"], {TIER_USER_HOME: HpcQuotaStatus.RED})
+
+    def test_get_quota_reports_kept_on_objects(self):
+        cache.clear()
+        self.factory(
+            resources_requested={TIER_USER_HOME: 20},
+            resources_used={TIER_USER_HOME: 10},
+            home_directory="/home/users",
+        )
+        get_quota_reports(HpcUser.objects.all())
+        user = HpcUser.objects.get()
+
+        with patch(
+            "usersec.models.compute_quota_report", wraps=compute_quota_report
+        ) as compute_mock:
+            report = get_quota_reports([user])[user]
+            self.assertEqual(user.generate_quota_report(), report)
+
+        compute_mock.assert_not_called()
+
+    def test_quota_status(self):
+        user = self.factory(
+            resources_requested={TIER_USER_HOME: 20},
+            resources_used={TIER_USER_HOME: 18},
+            home_directory="/home/users",
+        )
+        user.refresh_from_db()
+
+        self.assertEqual(user.get_quota_status(), HpcQuotaStatus.YELLOW)
+        self.assertEqual(user.quota_status_tiers, {TIER_USER_HOME: HpcQuotaStatus.YELLOW.value})
+
+    def test_quota_status_update_fields(self):
+        user = self.factory(
+            resources_requested={TIER_USER_HOME: 20},
+            resources_used={TIER_USER_HOME: 10},
+            home_directory="/home/users",
+        )
+        user.resources_used = {TIER_USER_HOME: 20}
+        user.save(update_fields=["resources_used"])
+        user.refresh_from_db()
+
+        self.assertEqual(user.get_quota_status(), HpcQuotaStatus.RED)
+        self.assertEqual(user.get_quota_status_tiers(), {TIER_USER_HOME: HpcQuotaStatus.RED})
+        self.assertEqual(user.get_latest_version().resources_used, {TIER_USER_HOME: 10})
+
+    def test_quota_status_no_resources(self):
+        user = self.factory(
+            resources_requested={},
+            resources_used={},
+            home_directory="/home/users",
+        )
+        user.refresh_from_db()
+
+        self.assertIsNone(user.get_quota_status())
+        self.assertEqual(user.quota_status_tiers, {})
+
+    def test_refresh_quota_status(self):
+        cache.clear()
+        user = self.factory(
+            resources_requested={TIER_USER_HOME: 100},
+            resources_used={TIER_USER_HOME: 85},
+            home_directory="/home/users",
+        )
+        self.assertEqual(refresh_quota_status()["usersec.HpcUser"], 0)
+        self.assertIsNone(refresh_quota_status())
+
+        with self.settings(QUOTA_WARNING_THRESHOLD=80, QUOTA_WARNING_ABSOLUTE=10**6):
+            self.assertEqual(refresh_quota_status()["usersec.HpcUser"], 1)
+            self.assertIsNone(refresh_quota_status())
+
+        user.refresh_from_db()
+        self.assertEqual(user.get_quota_status(), HpcQuotaStatus.YELLOW)
+        self.assertEqual(refresh_quota_status(force=True)["usersec.HpcUser"], 1)
+
     def test_parse_email(self):
         email = parse_email("valid@example.com")
         self.assertEqual(email, "valid@example.com")
@@ -1078,6 +1477,22 @@ class TestHpcProject(VersionTesterMixin, PendingRequestTesterMixin, TestCase):
     version_model = HpcProjectVersion
     factory = HpcProjectFactory
 
+    def test_members_changed_date_modified(self):
+        obj = self.factory()
+        hpcuser = HpcUserFactory(primary_group=obj.group)
+        past = timezone.now() - timedelta(days=1)
+
+        for change in (
+            lambda: obj.members.add(hpcuser),
+            lambda: obj.members.remove(hpcuser),
+            lambda: hpcuser.hpcproject_members.add(obj),
+            lambda: hpcuser.hpcproject_members.clear(),
+        ):
+            HpcProject.objects.filter(pk=obj.pk).update(date_modified=past)
+            change()
+            obj.refresh_from_db()
+            self.assertGreater(obj.date_modified, past)
+
     def test_create_with_version(self):
         self._test_create_with_version()
 
@@ -2373,3 +2788,62 @@ class TestTermsAndConditions(TestCase):
         self.assertEqual(TermsAndConditions.objects.count(), 1)
         self.assertEqual(tnc.audience, TERMS_AUDIENCE_ALL)
         self.assertIsNone(tnc.date_published)
+
+
+class TestResourceUsageSample(TestCase):
+    """Tests for ResourceUsageSample model"""
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime(2025, 6, 1, 12, 30, tzinfo=dt_timezone.utc)
+        self.hpc_group = HpcGroupFactory()
+
+    def _sample(self, used, **kwargs):
+        return ResourceUsageSampleFactory(object_uuid=self.hpc_group.uuid, used=used, **kwargs)
+
+    def test_record_usage_samples(self):
+        samples = record_usage_samples([self.hpc_group], date=self.now)
+
+        self.assertEqual(
+            {(s.tier, s.used) for s in ResourceUsageSample.objects.all()},
+            set(self.hpc_group.resources_used.items()),
+        )
+        self.assertEqual(len(samples), len(self.hpc_group.resources_used))
+        self.assertTrue(all(s.object_type == "hpcgroup" for s in samples))
+        self.assertTrue(all(s.resolution == USAGE_RESOLUTION_RAW for s in samples))
+
+    def test_compact(self):
+        old = self.now - timedelta(days=10)
+        self._sample(1.0, date=old.replace(minute=5))
+        self._sample(2.0, date=old.replace(minute=55))
+        self._sample(5.0, date=old.replace(minute=10), tier="tier1_scratch")
+        recent = self._sample(3.0, date=self.now - timedelta(days=1))
+        ancient = self.now - timedelta(days=100)
+        self._sample(4.0, date=ancient.replace(hour=1), resolution=USAGE_RESOLUTION_HOURLY)
+        self._sample(6.0, date=ancient.replace(hour=5), resolution=USAGE_RESOLUTION_HOURLY)
+
+        created = ResourceUsageSample.objects.compact(now=self.now)
+
+        self.assertEqual(created, {USAGE_RESOLUTION_HOURLY: 2, USAGE_RESOLUTION_DAILY: 1})
+        self.assertEqual(
+            sorted(ResourceUsageSample.objects.values_list("tier", "resolution", "date", "used")),
+            [
+                ("tier1_scratch", USAGE_RESOLUTION_HOURLY, old.replace(minute=0), 5.0),
+                (
+                    "tier1_work",
+                    USAGE_RESOLUTION_DAILY,
+                    ancient.replace(hour=0, minute=0),
+                    5.0,
+                ),
+                ("tier1_work", USAGE_RESOLUTION_HOURLY, old.replace(minute=0), 1.5),
+                ("tier1_work", USAGE_RESOLUTION_RAW, recent.date, 3.0),
+            ],
+        )
+
+    def test_compact_nothing(self):
+        self._sample(1.0, date=self.now)
+
+        created = ResourceUsageSample.objects.compact(now=self.now)
+
+        self.assertEqual(created, {USAGE_RESOLUTION_HOURLY: 0, USAGE_RESOLUTION_DAILY: 0})
+        self.assertEqual(ResourceUsageSample.objects.count(), 1)
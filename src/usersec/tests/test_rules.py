@@ -1,14 +1,20 @@
+from dataclasses import fields
+from unittest.mock import patch
+
 import rules
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages import get_messages
 from django.test import override_settings
 from django.urls import reverse
 from test_plus.test import TestCase
 
+from hpc_access.utils.predicate_cache import predicate_cache
 from usersec.models import (
     REQUEST_STATUS_ACTIVE,
     HpcGroupCreateRequest,
 )
+from usersec.roles import LazyUserRoles, UserRoles, get_user_roles, load_user_roles
 from usersec.tests.factories import (
     HPCGROUPCHANGEREQUEST_FORM_DATA_VALID,
     HPCGROUPCREATEREQUEST_FORM_DATA_VALID,
@@ -370,6 +376,152 @@ class TestRules(TestRulesBase):
         self.assertTrue(rules.test_rule("usersec_tests.is_orphan", self.user))
 
 
+class TestPredicateCache(TestRulesBase):
+    """Tests for the request-scoped memoization of predicates."""
+
+    def test_memoized(self):
+        with predicate_cache():
+            self.assertTrue(
+                rules.has_perm("usersec.view_hpcgroup", self.user_owner, self.hpc_group)
+            )
+
+            with self.assertNumQueries(0):
+                self.assertTrue(
+                    rules.has_perm("usersec.view_hpcgroup", self.user_owner, self.hpc_group)
+                )
+                self.assertTrue(rules.test_rule("usersec.is_cluster_user", self.user_owner))
+
+    def test_memoized_per_user_and_object(self):
+        with predicate_cache():
+            self.assertTrue(
+                rules.has_perm("usersec.view_hpcgroup", self.user_owner, self.hpc_group)
+            )
+            self.assertFalse(
+                rules.has_perm("usersec.view_hpcgroup", self.user_owner, self.hpc_other_group)
+            )
+            self.assertFalse(
+                rules.has_perm("usersec.view_hpcgroup", self.user_pending, self.hpc_group)
+            )
+
+    def test_not_memoized_outside_cache(self):
+        rules.test_rule("usersec.is_cluster_user", self.user)
+
+        with self.assertNumQueries(1):
+            rules.test_rule("usersec.is_cluster_user", self.user)
+
+    def test_cleared_on_write(self):
+        with predicate_cache():
+            self.assertFalse(rules.test_rule("usersec.is_cluster_user", self.user))
+
+            HpcUserFactory(user=self.user, primary_group=self.hpc_group)
+
+            self.assertTrue(rules.test_rule("usersec.is_cluster_user", self.user))
+
+    def test_cleared_on_members_changed(self):
+        with predicate_cache():
+            roles = get_user_roles(self.user_owner)
+            self.hpc_project.members.remove(self.hpc_member)
+
+            self.assertIsNot(get_user_roles(self.user_owner), roles)
+
+    def test_kept_on_unrelated_write(self):
+        with predicate_cache():
+            roles = get_user_roles(self.user_owner)
+            self.make_user("unrelated")
+
+            with self.assertNumQueries(0):
+                self.assertIs(get_user_roles(self.user_owner), roles)
+
+    def test_middleware(self):
+        # The home view of a user without group evaluates several rules checking invitations
+        with self.login(self.user):
+            with patch("usersec.roles.load_user_roles", wraps=load_user_roles) as mock:
+                self.client.get(reverse("home"))
+
+        mock.assert_called_once_with(self.user)
+
+
+class TestUserRoles(TestRulesBase):
+    """Tests for the precomputed roles of a user."""
+
+    def test_load_user_roles_owner(self):
+        with self.assertNumQueries(4):
+            roles = load_user_roles(self.user_owner)
+
+        self.assertEqual(roles.hpcuser_ids, {self.hpc_owner.id})
+        self.assertEqual(roles.group_ids, {self.hpc_group.id})
+        self.assertEqual(roles.owned_group_ids, {self.hpc_group.id})
+        self.assertEqual(roles.delegated_group_ids, set())
+        self.assertEqual(
+            roles.owned_group_hpcuser_ids,
+            {self.hpc_owner.id, self.hpc_delegate.id, self.hpc_member.id, self.hpc_member2.id},
+        )
+        self.assertEqual(roles.delegated_group_hpcuser_ids, set())
+        self.assertEqual(roles.owned_project_ids, {self.hpc_project.id})
+        self.assertEqual(roles.group_delegated_project_ids, set())
+        self.assertEqual(roles.delegated_project_ids, set())
+        self.assertEqual(roles.member_project_ids, {self.hpc_project.id})
+        self.assertFalse(roles.has_pending_group_request)
+        self.assertFalse(roles.has_group_invitation)
+
+    def test_load_user_roles_delegate(self):
+        roles = load_user_roles(self.user_delegate)
+
+        self.assertEqual(roles.owned_group_ids, set())
+        self.assertEqual(roles.delegated_group_ids, {self.hpc_group.id})
+        self.assertEqual(roles.owned_project_ids, set())
+        self.assertEqual(roles.group_delegated_project_ids, {self.hpc_project.id})
+        self.assertEqual(roles.member_project_ids, set())
+
+    def test_load_user_roles_project_delegate(self):
+        roles = load_user_roles(self.user_member_other_group)
+
+        self.assertEqual(roles.group_ids, {self.hpc_other_group.id})
+        self.assertEqual(roles.owned_group_ids, set())
+        self.assertEqual(roles.delegated_project_ids, {self.hpc_project.id})
+        self.assertEqual(roles.member_project_ids, {self.hpc_project.id})
+
+    def test_load_user_roles_orphan(self):
+        with self.assertNumQueries(2):
+            roles = load_user_roles(self.user_invited)
+
+        self.assertEqual(roles.hpcuser_ids, set())
+        self.assertTrue(roles.has_group_invitation)
+        self.assertFalse(roles.has_pending_group_request)
+        self.assertTrue(load_user_roles(self.user_pending).has_pending_group_request)
+
+    def test_load_user_roles_anonymous(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(load_user_roles(AnonymousUser()), UserRoles())
+
+    def test_get_user_roles_memoized(self):
+        with predicate_cache():
+            roles = get_user_roles(self.user_owner)
+
+            with self.assertNumQueries(0):
+                self.assertIs(get_user_roles(self.user_owner), roles)
+                self.assertTrue(
+                    rules.has_perm("usersec.view_hpcproject", self.user_owner, self.hpc_project)
+                )
+
+    def test_get_user_roles_lazy(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_user_roles(self.user_owner).owned_group_ids, {self.hpc_group.id})
+
+        for user in (
+            self.user_owner,
+            self.user_delegate,
+            self.user_member_other_group,
+            self.user_invited,
+            self.user_pending,
+        ):
+            loaded = load_user_roles(user)
+            lazy = LazyUserRoles(user)
+
+            for field in fields(UserRoles):
+                self.assertEqual(getattr(lazy, field.name), getattr(loaded, field.name), field.name)
+
+
 class TestPermissions(TestRulesBase):
     """Tests for permissions without views."""
 
@@ -1,8 +1,11 @@
 import json
+from unittest.mock import patch
 
 from django.conf import settings
 from django.contrib.messages import get_messages
 from django.core import mail
+from django.core.cache import cache
+from django.test import override_settings
 from django.urls import reverse
 from django.utils import timezone
 from test_plus.test import TestCase
@@ -11,6 +14,8 @@ from usersec.models import (
     INVITATION_STATUS_ACCEPTED,
     INVITATION_STATUS_PENDING,
     INVITATION_STATUS_REJECTED,
+    OUTBOX_STATUS_PENDING,
+    OUTBOX_STATUS_SENT,
     REQUEST_STATUS_ACTIVE,
     REQUEST_STATUS_APPROVED,
     REQUEST_STATUS_ARCHIVED,
@@ -27,6 +32,8 @@ from usersec.models import (
     HpcUserChangeRequest,
     HpcUserCreateRequest,
     HpcUserDeleteRequest,
+    OutboxEmail,
+    compute_quota_report,
 )
 from usersec.tests.factories import (
     HPCGROUPCREATEREQUEST_FORM_DATA_VALID,
@@ -559,6 +566,30 @@ class TestHpcGroupChangeRequestCreateView(TestViewBase):
             self.assertNoMessages(response)
             self.assertEqual(len(mail.outbox), 1)
 
+    @override_settings(EMAIL_OUTBOX=True)
+    def test_post_form_valid_outbox(self):
+        with self.login(self.user_owner):
+            data = dict(HPCGROUPCREATEREQUEST_FORM_DATA_VALID)
+
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                response = self.client.post(
+                    reverse(
+                        "usersec:hpcgroupchangerequest-create",
+                        kwargs={"hpcgroup": self.hpc_group.uuid},
+                    ),
+                    data=data,
+                )
+
+            self.assertRedirects(response, reverse("home"))
+            self.assertEqual(len(mail.outbox), 0)
+            self.assertEqual(OutboxEmail.objects.get().status, OUTBOX_STATUS_PENDING)
+
+            for callback in callbacks:
+                callback()
+
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertEqual(OutboxEmail.objects.get().status, OUTBOX_STATUS_SENT)
+
     def test_post_form_invalid(self):
         with self.login(self.user_owner):
             data = dict(HPCGROUPCREATEREQUEST_FORM_DATA_VALID)
@@ -887,6 +918,19 @@ class TestHpcUserView(TestViewBase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.context["object"], self.hpc_owner)
 
+    def test_get_quota_reports_cached(self):
+        cache.clear()
+
+        with self.login(self.user_owner):
+            self.client.get(reverse("usersec:hpcuser-overview"))
+
+            with patch("usersec.models.compute_quota_report") as compute_mock:
+                response = self.client.get(reverse("usersec:hpcuser-overview"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["projects"], [self.hpc_project])
+        compute_mock.assert_not_called()
+
     def test_get_no_cluster_user(self):
         with self.login(self.user):
             response = self.client.get(
@@ -940,6 +984,19 @@ class TestHpcGroupDetailView(TestViewBase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.context["object"], self.hpc_group)
 
+    def test_get_quota_report(self):
+        with self.login(self.user_owner):
+            with patch("usersec.models.compute_quota_report", wraps=compute_quota_report) as mock:
+                response = self.client.get(
+                    reverse("usersec:hpcgroup-detail", kwargs={"hpcgroup": self.hpc_group.uuid})
+                )
+
+        self.assertEqual(
+            response.context["quota_reports"][self.hpc_group],
+            self.hpc_group.generate_quota_report(),
+        )
+        self.assertLessEqual(mock.call_count, 1)
+
 
 class TestHpcProjectDetailView(TestViewBase):
     """Tests for HpcProjectDetailView."""
@@ -68,6 +68,7 @@ from usersec.models import (
     HpcUserDeleteRequest,
     TermsAndConditions,
     get_next_hpcuser_uid,
+    get_quota_reports,
 )
 
 # -----------------------------------------------------------------------------
@@ -122,6 +123,15 @@ class HpcPermissionMixin(LoginRequiredMixin, PermissionRequiredMixin):
             return redirect_to_login(self.request.get_full_path())
 
 
+class QuotaReportMixin:
+    """Add the quota report of the displayed object, loaded through the shared report cache."""
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["quota_reports"] = get_quota_reports([context["object"]])
+        return context
+
+
 class HomeView(LoginRequiredMixin, View):
     """Home view."""
 
@@ -389,6 +399,10 @@ class HpcUserView(HpcPermissionMixin, DetailView):
 
         context["group_manager"] = is_group_manager
         context["project_manager"] = is_project_manager
+        context["projects"] = list(context["object"].hpcproject_members.order_by("name"))
+        context["quota_reports"] = get_quota_reports(
+            [context["object"], *([group] if group else []), *context["projects"]]
+        )
         context["view_mode"] = settings.VIEW_MODE
         projects_available = False
         context["pending_requests"] = []
@@ -485,7 +499,7 @@ class HpcUserDetailView(HpcPermissionMixin, DetailView):
     permission_required = "usersec.view_hpcuser"
 
 
-class HpcGroupDetailView(HpcPermissionMixin, DetailView):
+class HpcGroupDetailView(HpcPermissionMixin, QuotaReportMixin, DetailView):
     """HPC group detail view."""
 
     model = HpcGroup
@@ -1326,7 +1340,7 @@ class HpcUserChangeRequestArchiveView(HpcPermissionMixin, SingleObjectMixin, Vie
         return HttpResponseRedirect(reverse("home"))
 
 
-class HpcProjectDetailView(HpcPermissionMixin, DetailView):
+class HpcProjectDetailView(HpcPermissionMixin, QuotaReportMixin, DetailView):
     """HPC project detail view."""
 
     model = HpcProject
@@ -8,7 +8,7 @@ from usersec.serializers import HpcUserLookupSerializer
 class HpcUserLookupApiView(ListAPIView):
     """API view for retrieving, updating and deleting a user."""
 
-    queryset = HpcUser.objects.all()
+    queryset = HpcUser.objects.select_related("user", "primary_group")
     serializer_class = HpcUserLookupSerializer
     # permission_classes = []
 